@@ -0,0 +1,336 @@
+# This Python file uses the following encoding: utf-8
+#
+# Vectorized (NumPy) versions of the QtSsMath sunrise/sunset calculations.
+# Every function here takes arrays of dates, latitudes, longitudes and
+# timezone clock offsets (in hours) and evaluates the same NOAA spreadsheet
+# chain as QtSsMath in a single pass over the arrays. Arguments are
+# broadcast against each other so a single location can be combined with
+# many dates, or many locations with a single date, etc. None of the
+# QtSsMath module globals (HomeLat, HomeLong, HomeTZ) are used.
+#
+# The spreadsheet formulas are at:
+#     https://www.esrl.noaa.gov/gmd/grad/solcalc/calcdetails.html
+#
+# Version: 1.0
+# Copyright (C) 2020/09/21 David A. Mair
+# This file is part of QtSunsetter<https://github.com/mairda/QtSunsetter.git>.
+#
+# QtSunsetter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# QtSunsetter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with QtSunsetter.  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import datetime
+
+import numpy as np
+
+
+# The same reference date as QtSsMath.refDays
+BATCH_BASE_DATE = np.datetime64("1899-12-30", "D")
+
+
+# Convert a date, a sequence of dates or an array of datetime64 values to an
+# array of days since the spreadsheet reference date
+# Returns a float64 array
+def batchRefDays(dates):
+    dArray = np.asarray(dates, dtype="datetime64[D]")
+    rDays = (dArray - BATCH_BASE_DATE).astype(np.float64)
+
+    return np.abs(rDays)
+# batchRefDays
+
+
+# Convert a time, a sequence of times or an array of fractions of the day to
+# an array of fractions of the day
+# Returns a float64 array
+def batchFracOfLocalDay(times):
+    if isinstance(times, datetime.time):
+        fDay = times.hour * 3600.0 + times.minute * 60.0 + times.second
+        return np.asarray(fDay / 86400.0)
+
+    tArray = np.asarray(times)
+    if tArray.dtype == object:
+        tArray = np.array([(t.hour * 3600.0 + t.minute * 60.0 + t.second) /
+                           86400.0 for t in tArray.ravel()]).reshape(
+                                tArray.shape)
+
+    return tArray.astype(np.float64)
+# batchFracOfLocalDay
+
+
+def batchJulianCentury(dates, tzs, times=datetime.time(0, 0, 0)):
+    jDay = batchRefDays(dates) + 2415018.5 + batchFracOfLocalDay(times)
+    jDay -= np.asarray(tzs, dtype=np.float64) / 24.0
+    # =D2+2415018.5+E2-$B$5/24
+
+    return (jDay - 2451545.0) / 36525.0
+    # =(F2-2451545)/36525
+# batchJulianCentury
+
+
+# Given an array of Julian centuries, return the sun's declination (degrees)
+# and the equation of time (minutes) as a tuple of arrays
+def batchDeclinationAndEqOfTime(jCent):
+    mLong = np.mod(280.46646 + jCent * (36000.76983 + jCent * 0.0003032), 360)
+    mAnom = 357.52911 + jCent * (35999.05029 - 0.0001537 * jCent)
+    oEccent = 0.016708634 - jCent * (0.000042037 + 0.0000001267 * jCent)
+
+    mAnomRad = np.radians(mAnom)
+    sEqC = np.sin(mAnomRad) * (1.914602 - jCent * (0.004817 + 0.000014 * jCent))
+    sEqC += np.sin(2 * mAnomRad) * (0.019993 - 0.000101 * jCent)
+    sEqC += np.sin(3 * mAnomRad) * 0.000289
+
+    tLong = mLong + sEqC
+    omegaRad = np.radians(125.04 - 1934.136 * jCent)
+    aLong = tLong - 0.00569 - 0.00478 * np.sin(omegaRad)
+
+    mObEcclip = 23 + (26 + ((21.448 - jCent * (46.815 + jCent * (0.00059 -
+                             jCent * 0.001813)))) / 60) / 60
+    oCorr = mObEcclip + 0.00256 * np.cos(omegaRad)
+    oCorrRad = np.radians(oCorr)
+
+    sDec = np.degrees(np.arcsin(np.sin(oCorrRad) * np.sin(np.radians(aLong))))
+
+    sVary = np.tan(oCorrRad / 2) ** 2
+    mLongRad = np.radians(mLong)
+    eTime = 4 * np.degrees(sVary * np.sin(2 * mLongRad) - 2 * oEccent *
+                           np.sin(mAnomRad) + 4 * oEccent * sVary *
+                           np.sin(mAnomRad) * np.cos(2 * mLongRad) - 0.5 *
+                           sVary * sVary * np.sin(4 * mLongRad) - 1.25 *
+                           oEccent * oEccent * np.sin(2 * mAnomRad))
+
+    return (sDec, eTime)
+# batchDeclinationAndEqOfTime
+
+
+# Sunrise hour angle (degrees) for arrays of latitude and declination, NaN
+# where the sun doesn't cross the horizon (a midnight sun or polar night day)
+def batchHASunrise(lats, sDec):
+    latRad = np.radians(np.asarray(lats, dtype=np.float64))
+    sDecRad = np.radians(sDec)
+    haRiseIn = np.cos(np.radians(90.833)) / (np.cos(latRad) *
+                                             np.cos(sDecRad))
+    haRiseIn -= np.tan(latRad) * np.tan(sDecRad)
+
+    with np.errstate(invalid="ignore"):
+        haRise = np.degrees(np.arccos(haRiseIn))
+
+    return haRise
+# batchHASunrise
+
+
+# Compute sunrise, sunset, solar noon and sunlight duration for arrays of
+# dates, latitudes, longitudes and timezone offsets (hours). times is the
+# time of day the solar state is evaluated at, like the aTime argument to the
+# QtSsMath functions.
+# Returns a tuple of arrays (sunrise, sunset, solarNoon, dayLength). The first
+# three are fractions of the local day, as LocalSunrise, LocalSunset and
+# SolarNoon return, dayLength is in minutes, as SunlightDuration returns.
+# Where the sun doesn't cross the horizon sunrise, sunset and dayLength are
+# NaN, where the QtSsMath functions raise ValueError. Use batchSolarDays to
+# classify those days instead.
+def batchSolarEvents(dates, lats, longs, tzs, times=datetime.time(0, 0, 0)):
+    rDays = batchRefDays(dates)
+    fDay = batchFracOfLocalDay(times)
+    lats = np.asarray(lats, dtype=np.float64)
+    longs = np.asarray(longs, dtype=np.float64)
+    tzs = np.asarray(tzs, dtype=np.float64)
+    rDays, fDay, lats, longs, tzs = np.broadcast_arrays(rDays, fDay, lats,
+                                                        longs, tzs)
+
+    jCent = (rDays + 2415018.5 + fDay - tzs / 24.0 - 2451545.0) / 36525.0
+    sDec, eTime = batchDeclinationAndEqOfTime(jCent)
+
+    haRise = batchHASunrise(lats, sDec)
+    sNoon = (720 - 4 * longs - eTime + tzs * 60) / 1440
+    # =(720-4*$B$4-V2+$B$5*60)/1440
+
+    hRise = np.abs(haRise)
+    aNoon = np.abs(sNoon)
+    sRise = aNoon - hRise * 4 / 1440
+    sSet = aNoon + hRise * 4 / 1440
+    dayLength = 8 * haRise
+
+    return (sRise, sSet, sNoon, dayLength)
+# batchSolarEvents
+
+
+# Compute sunrise, sunset, solar noon and sunlight duration as
+# batchSolarEvents does, with each day classified and days without a horizon
+# crossing given the same sentinels as QtSsMath.polarSentinels in place of
+# NaN: the hour angle is limited to 0 to 180 degrees, so a midnight sun day
+# has 1440 minutes of sunlight from half a day before solar noon to half a
+# day after and a polar night day rises and sets at solar noon with none.
+# Returns a tuple of arrays (dayType, sunrise, sunset, solarNoon, dayLength),
+# dayType is an int8 array of BATCH_DAY_NORMAL, BATCH_DAY_MIDNIGHT_SUN or
+# BATCH_DAY_POLAR_NIGHT
+def batchSolarDays(dates, lats, longs, tzs, times=datetime.time(0, 0, 0)):
+    rDays = batchRefDays(dates)
+    fDay = batchFracOfLocalDay(times)
+    lats = np.asarray(lats, dtype=np.float64)
+    longs = np.asarray(longs, dtype=np.float64)
+    tzs = np.asarray(tzs, dtype=np.float64)
+    rDays, fDay, lats, longs, tzs = np.broadcast_arrays(rDays, fDay, lats,
+                                                        longs, tzs)
+
+    jCent = (rDays + 2415018.5 + fDay - tzs / 24.0 - 2451545.0) / 36525.0
+    sDec, eTime = batchDeclinationAndEqOfTime(jCent)
+
+    latRad = np.radians(lats)
+    sDecRad = np.radians(sDec)
+    haRiseIn = np.cos(np.radians(90.833)) / (np.cos(latRad) *
+                                             np.cos(sDecRad))
+    haRiseIn -= np.tan(latRad) * np.tan(sDecRad)
+
+    dayType = np.full(haRiseIn.shape, BATCH_DAY_NORMAL, dtype=np.int8)
+    dayType[haRiseIn < -1.0] = BATCH_DAY_MIDNIGHT_SUN
+    dayType[haRiseIn > 1.0] = BATCH_DAY_POLAR_NIGHT
+
+    haRise = np.degrees(np.arccos(np.clip(haRiseIn, -1.0, 1.0)))
+    sNoon = (720 - 4 * longs - eTime + tzs * 60) / 1440
+    aNoon = np.abs(sNoon)
+    sRise = aNoon - haRise * 4 / 1440
+    sSet = aNoon + haRise * 4 / 1440
+    dayLength = 8 * haRise
+
+    return (dayType, sRise, sSet, sNoon, dayLength)
+# batchSolarDays
+
+
+# Build an array of every date from firstDate to lastDate inclusive, suitable
+# as the dates argument of the batch functions
+def batchDateRange(firstDate, lastDate):
+    return np.arange(np.datetime64(firstDate, "D"),
+                     np.datetime64(lastDate, "D") + 1)
+# batchDateRange
+
+
+# Compute a schedule table for many sites over many dates. The site arrays are
+# laid out along the first axis and the dates along the second, so the
+# returned arrays have shape (len(lats), len(dates)). As batchSolarEvents,
+# NaN is a day without a horizon crossing
+def batchSiteSchedule(dates, lats, longs, tzs, times=datetime.time(0, 0, 0)):
+    dArray = np.asarray(dates, dtype="datetime64[D]")[np.newaxis, :]
+    lats = np.asarray(lats, dtype=np.float64)[:, np.newaxis]
+    longs = np.asarray(longs, dtype=np.float64)[:, np.newaxis]
+    tzs = np.asarray(tzs, dtype=np.float64)[:, np.newaxis]
+
+    return batchSolarEvents(dArray, lats, longs, tzs, times)
+# batchSiteSchedule
+
+
+# Convert seconds since the epoch, or an array of datetime64 values, to an
+# array of Julian centuries
+def batchEpochJulianCentury(epochs):
+    eArray = np.asarray(epochs)
+    if np.issubdtype(eArray.dtype, np.datetime64):
+        eArray = (eArray - np.datetime64(0, "s")) / np.timedelta64(1, "s")
+    jDay = eArray.astype(np.float64) / 86400.0 + 2440587.5
+
+    return (jDay - 2451545.0) / 36525.0
+# batchEpochJulianCentury
+
+
+# Atmospheric refraction (degrees) for arrays of uncorrected solar elevation
+# (degrees)
+def batchRefraction(elevation):
+    elevation = np.asarray(elevation, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tanElev = np.tan(np.radians(elevation))
+        refract = np.where(
+            elevation > 85.0, 0.0,
+            np.where(elevation > 5.0,
+                     58.1 / tanElev - 0.07 / tanElev ** 3 +
+                     0.000086 / tanElev ** 5,
+                     np.where(elevation > -0.575,
+                              1735 + elevation * (-518.2 + elevation *
+                                                  (103.4 + elevation *
+                                                   (-12.79 + elevation *
+                                                    0.711))),
+                              -20.772 / tanElev)))
+    # =IF(AE2>85,0,IF(AE2>5,58.1/TAN(RADIANS(AE2))-0.07/TAN(RADIANS(AE2))^3+
+    #  0.000086/TAN(RADIANS(AE2))^5,IF(AE2>-0.575,1735+AE2*(-518.2+AE2*(
+    #  103.4+AE2*(-12.79+AE2*0.711))),-20.772/TAN(RADIANS(AE2)))))/3600
+
+    return refract / 3600.0
+# batchRefraction
+
+
+# Compute the sun's position at arrays of instants (seconds since the epoch
+# or datetime64 values) for arrays of latitudes and longitudes, broadcast
+# against each other.
+# Returns a tuple of arrays (elevation, azimuth) in degrees. The elevation is
+# corrected for atmospheric refraction, the azimuth is clockwise from north
+def batchSolarPosition(epochs, lats, longs):
+    jCent = batchEpochJulianCentury(epochs)
+    lats = np.asarray(lats, dtype=np.float64)
+    longs = np.asarray(longs, dtype=np.float64)
+    jCent, lats, longs = np.broadcast_arrays(jCent, lats, longs)
+    sDec, eTime = batchDeclinationAndEqOfTime(jCent)
+
+    # Minutes past midnight UTC, so the timezone drops out of true solar time
+    uMins = np.mod(jCent * 36525.0 + 0.5, 1.0) * 1440.0
+    tSolar = np.mod(uMins + eTime + 4 * longs, 1440)
+    # =MOD(E2*1440+V2+4*$B$4-60*$B$5,1440)
+    hAngle = tSolar / 4 - 180
+    # =IF(AB2/4<0,AB2/4+180,AB2/4-180)
+
+    latRad = np.radians(lats)
+    sDecRad = np.radians(sDec)
+    cosZenith = np.sin(latRad) * np.sin(sDecRad) +\
+        np.cos(latRad) * np.cos(sDecRad) * np.cos(np.radians(hAngle))
+    zenith = np.degrees(np.arccos(np.clip(cosZenith, -1.0, 1.0)))
+    # =DEGREES(ACOS(SIN(RADIANS($B$3))*SIN(RADIANS(T2))+COS(RADIANS($B$3))*
+    #  COS(RADIANS(T2))*COS(RADIANS(AC2))))
+
+    elevation = 90.0 - zenith
+    elevation += batchRefraction(elevation)
+
+    zenithRad = np.radians(zenith)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cosAzimuth = (np.sin(latRad) * np.cos(zenithRad) - np.sin(sDecRad)) /\
+            (np.cos(latRad) * np.sin(zenithRad))
+    azAngle = np.degrees(np.arccos(np.clip(np.nan_to_num(cosAzimuth),
+                                           -1.0, 1.0)))
+    azimuth = np.where(hAngle > 0, np.mod(azAngle + 180, 360),
+                       np.mod(540 - azAngle, 360))
+    # =IF(AC2>0,MOD(DEGREES(ACOS(((SIN(RADIANS($B$3))*COS(RADIANS(AD2)))-
+    #  SIN(RADIANS(T2)))/(COS(RADIANS($B$3))*SIN(RADIANS(AD2)))))+180,360),
+    #  MOD(540-DEGREES(ACOS(((SIN(RADIANS($B$3))*COS(RADIANS(AD2)))-
+    #  SIN(RADIANS(T2)))/(COS(RADIANS($B$3))*SIN(RADIANS(AD2))))),360))
+
+    return (elevation, azimuth)
+# batchSolarPosition
+
+
+# Compute the sun's position for one location every stepMinutes through a
+# local date, from midnight in the timezone (hours)
+# Returns a tuple of arrays (epochs, elevation, azimuth)
+def batchDaySolarPosition(aDate, lat, long, tz, stepMinutes=1):
+    days = (np.datetime64(aDate, "D") - np.datetime64(0, "D")).astype(
+        np.float64)
+    epochs = days * 86400.0 - tz * 3600.0 +\
+        np.arange(0, 1440, stepMinutes) * 60.0
+    elevation, azimuth = batchSolarPosition(epochs, lat, long)
+
+    return (epochs, elevation, azimuth)
+# batchDaySolarPosition
+
+
+# Kinds of day in batchSolarDays results, QtSsMath.DAY_NORMAL,
+# DAY_MIDNIGHT_SUN and DAY_POLAR_NIGHT
+BATCH_DAY_NORMAL = 0
+BATCH_DAY_MIDNIGHT_SUN = 1
+BATCH_DAY_POLAR_NIGHT = 2
+
+# if __name__ == "__main__":
+#     pass
@@ -0,0 +1,505 @@
+# This Python file uses the following encoding: utf-8
+#
+# Measure what one QtSunsetter.tick costs. The main window is built under the
+# Qt offscreen platform (unless another is chosen with QT_QPA_PLATFORM) and
+# ticked with a simulated clock that moves on a fixed step each tick, so a
+# run covers as much of the day and night as wanted in a few seconds. Each
+# tick's wall time is split into:
+#     math    - the QtSsMath/QtSsTODMath functions the window calls
+#     labels  - showTime and showSolarCrossingTime, less their math
+#     palette - recolorRunEditBackground, less its math
+#     scene   - drawIconByAngle, less its math
+#     other   - the rest of tick, e.g. the timer checks and remaining time
+#               label
+#     paint   - processing the events the tick queued, i.e. repainting the
+#               window, measured after the tick
+# and reported as p50/p99 figures in microseconds. The results can be saved as
+# JSON and compared with an earlier run.
+#
+# Usage:
+#     python QtSsBenchmark.py [--ticks <count>] [--step <seconds>]
+#                             [--start <YYYY-MM-DDTHH:MM>]
+#                             [--location <latitude> <longitude> <timezone>]
+#                             [--output <file.json>] [--compare <file.json>]
+#     python QtSsBenchmark.py --memory <days> [--step <seconds>]
+#                             [--start <YYYY-MM-DDTHH:MM>]
+#                             [--location <latitude> <longitude> <timezone>]
+#                             [--output <file.json>]
+#
+# With --memory the window is ticked through that many simulated days and
+# the memory in use and the number of sky view items sampled after each, it
+# exits with status 1 if they grow after the first day.
+#
+# The window is built without reading the configuration, so none of its
+# sunrise, sunset or twilight programs are run, only its location is used.
+#
+# Version: 1.0
+# Copyright (C) 2020/10/19 David A. Mair
+# This file is part of QtSunsetter<https://github.com/mairda/QtSunsetter.git>.
+#
+# QtSunsetter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# QtSunsetter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with QtSunsetter.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import datetime
+import json
+import math
+import os
+import platform
+import tempfile
+import time
+
+from QtSsDebug import errorMessage
+
+
+# Time sections of each tick, each section's time excludes the time of any
+# section entered while it runs so the sections add up to the tick
+class TickProfiler:
+    def __init__(self):
+        self.sectionTimes = {}
+        self.nested = []
+
+    # Start a new tick with every section at zero
+    def reset(self):
+        self.sectionTimes = {section: 0.0 for section in benchmarkSections}
+        self.nested = []
+
+    # Wrap a function so its time is added to a section
+    # Returns the wrapping function
+    def wrap(self, section, func):
+        def timed(*args, **kwargs):
+            startTime = time.perf_counter()
+            self.nested.append(0.0)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                nestedTime = self.nested.pop()
+                elapsed = time.perf_counter() - startTime
+                self.sectionTimes[section] += elapsed - nestedTime
+                if len(self.nested) > 0:
+                    self.nested[-1] += elapsed
+
+        return timed
+# TickProfiler
+
+
+# Get the value below which a percentage of sorted values fall (nearest rank)
+def percentile(sortedValues, percent):
+    if len(sortedValues) == 0:
+        return 0.0
+
+    rank = int(math.ceil(percent / 100.0 * len(sortedValues)))
+
+    return sortedValues[max(rank, 1) - 1]
+# percentile
+
+
+# Summarize a list of times in seconds as microseconds
+# Returns a dictionary of p50, p99, mean and max
+def summarizeTimes(times):
+    sortedTimes = sorted(times)
+    if len(sortedTimes) > 0:
+        mean = sum(sortedTimes) / len(sortedTimes)
+        most = sortedTimes[-1]
+    else:
+        mean = 0.0
+        most = 0.0
+
+    return {"p50": percentile(sortedTimes, 50.0) * 1e6,
+            "p99": percentile(sortedTimes, 99.0) * 1e6,
+            "mean": mean * 1e6,
+            "max": most * 1e6}
+# summarizeTimes
+
+
+# Put a profiler's wrappers around the math functions the QtSunsetter module
+# calls and the window's label, palette and scene methods
+def instrumentWindow(window, profiler):
+    import QtSunsetter
+
+    for name in benchmarkMathFunctions:
+        if hasattr(QtSunsetter, name):
+            setattr(QtSunsetter, name,
+                    profiler.wrap("math", getattr(QtSunsetter, name)))
+
+    for section, names in benchmarkMethods.items():
+        for name in names:
+            setattr(window, name, profiler.wrap(section, getattr(window,
+                                                                 name)))
+# instrumentWindow
+
+
+# Get the location saved in the configuration
+# Returns a tuple (latitude, longitude, timezone hours) or None
+def configuredLocation():
+    from QtSsConfig import SunsetterConfig
+
+    config = SunsetterConfig()
+    if not config.loadConfig():
+        return None
+
+    return (config.getLatitude(), config.getLongitude(), config.getHomeTZ())
+# configuredLocation
+
+
+# Build and show the main window for a simulated clock, which is a one item
+# list holding the time (seconds since the epoch) so it can be moved on
+# Returns a tuple (application, window)
+def buildWindow(simulated, location=None):
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+    from PySide2.QtWidgets import QApplication
+    from QtSsMath import setLatitude, setLongitude, setHomeTZ
+    from QtSsTODMath import ClockSnapshot, setClockSource
+    import QtSunsetter
+
+    app = QApplication.instance()
+    if app is None:
+        app = QApplication([])
+
+    # Never run the configured programs from a benchmark, the window is built
+    # with an empty home directory so it reads no configuration and has no
+    # programs. Only the configured location is used
+    if location is None:
+        location = configuredLocation()
+    savedHome = os.environ.get("HOME")
+    setClockSource(lambda: ClockSnapshot(simulated[0]))
+    with tempfile.TemporaryDirectory() as emptyHome:
+        os.environ["HOME"] = emptyHome
+        try:
+            window = QtSunsetter.QtSunsetter()
+        finally:
+            if savedHome is None:
+                del os.environ["HOME"]
+            else:
+                os.environ["HOME"] = savedHome
+    window.timer.stop()
+
+    if location is not None:
+        setLatitude(location[0])
+        setLongitude(location[1])
+        setHomeTZ(location[2] * 3600.0)
+    window.show()
+    app.processEvents()
+
+    return (app, window)
+# buildWindow
+
+
+# Get where the results were measured
+# Returns a dictionary ready to save as JSON
+def benchmarkSetting(ticks, step, start):
+    from QtSsMath import getLatitude, getLongitude, getHomeTZ
+
+    return {"ticks": ticks,
+            "step": step,
+            "start": datetime.datetime.fromtimestamp(start).isoformat(),
+            "latitude": getLatitude(),
+            "longitude": getLongitude(),
+            "timezone": getHomeTZ(),
+            "platform": os.environ.get("QT_QPA_PLATFORM"),
+            "python": platform.python_version(),
+            "machine": platform.machine()}
+# benchmarkSetting
+
+
+# Build the main window and tick it with a simulated clock
+# Returns a dictionary of the results, ready to save as JSON
+def runBenchmark(ticks=None, step=None, start=None, location=None):
+    from QtSsTODMath import setClockSource
+
+    if ticks is None:
+        ticks = benchmarkTicks
+    if step is None:
+        step = benchmarkStep
+    if start is None:
+        start = time.time()
+
+    simulated = [start]
+    try:
+        app, window = buildWindow(simulated, location)
+
+        profiler = TickProfiler()
+        instrumentWindow(window, profiler)
+
+        tickTimes = {section: [] for section in benchmarkSections}
+        tickTimes["other"] = []
+        tickTimes["paint"] = []
+        tickTimes["tick"] = []
+        for tickNum in range(ticks):
+            simulated[0] = start + tickNum * step
+            profiler.reset()
+
+            startTime = time.perf_counter()
+            window.tick()
+            tickTime = time.perf_counter() - startTime
+
+            startTime = time.perf_counter()
+            app.processEvents()
+            paintTime = time.perf_counter() - startTime
+
+            for section in benchmarkSections:
+                tickTimes[section].append(profiler.sectionTimes[section])
+            tickTimes["other"].append(tickTime -
+                                      sum(profiler.sectionTimes.values()))
+            tickTimes["paint"].append(paintTime)
+            tickTimes["tick"].append(tickTime)
+
+        window.close()
+    finally:
+        setClockSource(None)
+
+    results = benchmarkSetting(ticks, step, start)
+    results["sections"] = {section: summarizeTimes(times)
+                           for section, times in tickTimes.items()}
+
+    return results
+# runBenchmark
+
+
+# Get the resident set size of this process in kilobytes, from /proc on Linux
+# Returns an int or None where it can't be read
+def residentKilobytes():
+    try:
+        with open("/proc/self/statm", "r") as statm:
+            pages = int(statm.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+
+    return pages * os.sysconf("SC_PAGE_SIZE") // 1024
+# residentKilobytes
+
+
+# Tick the main window through a number of simulated days and sample the
+# memory in use after each: the process resident set size, the Python
+# allocations (tracemalloc) and the number of items in the sky scene. The
+# first day is taken as warm up, memory is stable if no later day grows the
+# Python allocations by more than memoryGrowthLimit bytes on the first and
+# the scene never gains items
+# Returns a dictionary of the results, ready to save as JSON
+def runMemoryCheck(days=None, step=None, start=None, location=None):
+    import tracemalloc
+    from PySide2.QtWidgets import QGraphicsView
+    from QtSsTODMath import setClockSource
+
+    if days is None:
+        days = memoryDays
+    if step is None:
+        step = benchmarkStep
+    if start is None:
+        start = time.time()
+    ticksPerDay = int(round(86400.0 / step))
+
+    simulated = [start]
+    samples = []
+    try:
+        app, window = buildWindow(simulated, location)
+        view = window.findChild(QGraphicsView, "dayIcon")
+
+        tracemalloc.start()
+        for dayNum in range(days):
+            for tickNum in range(ticksPerDay):
+                simulated[0] = start + (dayNum * ticksPerDay + tickNum) * step
+                window.tick()
+                app.processEvents()
+
+            if (view is not None) and (view.scene() is not None):
+                sceneItems = len(view.scene().items())
+            else:
+                sceneItems = 0
+            samples.append({"day": dayNum + 1,
+                            "residentKB": residentKilobytes(),
+                            "tracedBytes": tracemalloc.get_traced_memory()[0],
+                            "sceneItems": sceneItems})
+        tracemalloc.stop()
+
+        window.close()
+    finally:
+        setClockSource(None)
+
+    results = benchmarkSetting(days * ticksPerDay, step, start)
+    results["days"] = samples
+    results["stable"] = memoryIsStable(samples)
+
+    return results
+# runMemoryCheck
+
+
+# Check memory samples after the first day for growth
+# Returns a bool
+def memoryIsStable(samples):
+    if len(samples) < 2:
+        return True
+
+    first = samples[0]
+    for sample in samples[1:]:
+        if (sample["tracedBytes"] - first["tracedBytes"] >
+                memoryGrowthLimit) or\
+                (sample["sceneItems"] != first["sceneItems"]):
+            return False
+
+    return True
+# memoryIsStable
+
+
+# Print the memory samples
+def printMemoryResults(results):
+    print("{} days of {}s ticks from {} at {}, {} timezone {}".format(
+        len(results["days"]), results["step"], results["start"],
+        results["latitude"], results["longitude"], results["timezone"]))
+    print("{:>4} {:>12} {:>14} {:>6}".format("day", "resident KB",
+                                             "traced bytes", "items"))
+    for sample in results["days"]:
+        print("{:>4} {:>12} {:>14} {:>6}".format(sample["day"],
+                                                 str(sample["residentKB"]),
+                                                 sample["tracedBytes"],
+                                                 sample["sceneItems"]))
+    if results["stable"]:
+        print("Memory is stable")
+    else:
+        print("Memory grew after the first day")
+# printMemoryResults
+
+
+# Print the results, with the change from an earlier run's results if given
+def printResults(results, previous=None):
+    print("{} ticks of {}s from {} at {}, {} timezone {}".format(
+        results["ticks"], results["step"], results["start"],
+        results["latitude"], results["longitude"], results["timezone"]))
+    print("{:<8} {:>10} {:>10} {:>10} {:>10}".format("section", "p50 us",
+                                                    "p99 us", "mean us",
+                                                    "max us"))
+    for section, summary in results["sections"].items():
+        line = "{:<8} {:>10.1f} {:>10.1f} {:>10.1f} {:>10.1f}".format(
+            section, summary["p50"], summary["p99"], summary["mean"],
+            summary["max"])
+        if (previous is not None) and (section in previous["sections"]):
+            before = previous["sections"][section]
+            line += "  p50 {:+.1f}% p99 {:+.1f}%".format(
+                percentChange(before["p50"], summary["p50"]),
+                percentChange(before["p99"], summary["p99"]))
+        print(line)
+# printResults
+
+
+# Get the change from one figure to another as a percentage of the first
+def percentChange(before, after):
+    if before == 0.0:
+        return 0.0
+
+    return 100.0 * (after - before) / before
+# percentChange
+
+
+# A name for this module in warning messages
+benchmarkSrcFrom = "Benchmark"
+
+# Ticks to run and simulated seconds between them, as the display timer
+benchmarkTicks = 1440
+benchmarkStep = 60.0
+
+# Simulated days for the memory check and the most the Python allocations
+# can grow by after the first day, in bytes
+memoryDays = 7
+memoryGrowthLimit = 256 * 1024
+
+# Sections timed by wrapping, other and paint are measured around them
+benchmarkSections = ("math", "labels", "palette", "scene")
+
+# QtSunsetter module functions timed as math
+benchmarkMathFunctions = ("setSystemTime", "getTimeNowWithCorrection",
+                          "getSunriseTime", "getSunsetTime", "getDayType",
+                          "itsDaytime", "itsNighttime",
+                          "getTimeNowFractionOfLightPeriod",
+                          "getTimeToNextHorizonCrossing", "getNextSolarEvent",
+                          "getLatitude")
+
+# Window methods timed as each section
+benchmarkMethods = {"labels": ("showTime", "showSolarCrossingTime"),
+                    "palette": ("recolorRunEditBackground",),
+                    "scene": ("drawIconByAngle",)}
+
+if __name__ == "__main__":
+    benchOptions = {"--ticks": None, "--step": None, "--start": None,
+                    "--memory": None, "--output": None, "--compare": None}
+    benchLocation = None
+    try:
+        for option in benchOptions:
+            if option in sys.argv:
+                argNum = sys.argv.index(option)
+                benchOptions[option] = sys.argv[argNum + 1]
+                del sys.argv[argNum:argNum + 2]
+        if "--location" in sys.argv:
+            argNum = sys.argv.index("--location")
+            benchLocation = tuple(float(value) for value in
+                                  sys.argv[argNum + 1:argNum + 4])
+            if len(benchLocation) != 3:
+                raise IndexError()
+            del sys.argv[argNum:argNum + 4]
+        if len(sys.argv) != 1:
+            raise IndexError()
+
+        benchTicks = benchOptions["--ticks"]
+        if benchTicks is not None:
+            benchTicks = int(benchTicks)
+        benchStep = benchOptions["--step"]
+        if benchStep is not None:
+            benchStep = float(benchStep)
+        benchStart = benchOptions["--start"]
+        if benchStart is not None:
+            benchStart = datetime.datetime.fromisoformat(
+                benchStart).timestamp()
+        benchDays = benchOptions["--memory"]
+        if benchDays is not None:
+            benchDays = int(benchDays)
+    except IndexError:
+        errorMessage("Usage: {} [--ticks <count>] [--step <seconds>] "
+                     "[--start <YYYY-MM-DDTHH:MM>] "
+                     "[--location <latitude> <longitude> <timezone>] "
+                     "[--memory <days>] [--output <file.json>] "
+                     "[--compare <file.json>]".format(sys.argv[0]))
+        sys.exit(1)
+    except ValueError as e:
+        errorMessage("{}".format(e), benchmarkSrcFrom)
+        sys.exit(1)
+
+    benchPrevious = None
+    if benchOptions["--compare"] is not None:
+        try:
+            with open(benchOptions["--compare"], "r") as previousFile:
+                benchPrevious = json.load(previousFile)
+        except (OSError, ValueError) as e:
+            errorMessage("{}".format(e), benchmarkSrcFrom)
+            sys.exit(1)
+
+    if benchDays is not None:
+        benchResults = runMemoryCheck(benchDays, benchStep, benchStart,
+                                      benchLocation)
+        printMemoryResults(benchResults)
+    else:
+        benchResults = runBenchmark(benchTicks, benchStep, benchStart,
+                                    benchLocation)
+        printResults(benchResults, benchPrevious)
+
+    if benchOptions["--output"] is not None:
+        try:
+            with open(benchOptions["--output"], "w") as outputFile:
+                json.dump(benchResults, outputFile, indent=2)
+        except OSError as e:
+            errorMessage("{}".format(e), benchmarkSrcFrom)
+            sys.exit(1)
+
+    if (benchDays is not None) and not benchResults["stable"]:
+        sys.exit(1)
+
+    sys.exit(0)
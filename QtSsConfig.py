@@ -23,6 +23,8 @@ import re
 
 from PySide2.QtCore import QDir, QFile, QIODevice, QTextStream, QFileInfo
 from QtSsDebug import warningMessage, debugMessage
+from QtSsHooks import hookPolicies, hookModes
+from QtSsEvents import twilightEventTypes
 
 
 class SunsetterConfig:
@@ -45,6 +47,13 @@ class SunsetterConfig:
         self.sunsetRun = None
         self.runLastEventAtLaunch = False
         self.showLocationDMS = False
+        self.hookTimeout = None
+        self.hookPolicy = None
+        self.hookMode = None
+        self.hookStdin = False
+        self.refineEvents = False
+        self.eventTableFile = None
+        self.twilightRuns = {}
 
     def getShowLocationDMS(self):
         return self.showLocationDMS
@@ -82,6 +91,28 @@ class SunsetterConfig:
     def getRunLastEventAtLaunch(self):
         return self.runLastEventAtLaunch
 
+    def getHookTimeout(self):
+        return self.hookTimeout
+
+    def getHookPolicy(self):
+        return self.hookPolicy
+
+    def getHookMode(self):
+        return self.hookMode
+
+    def getHookStdin(self):
+        return self.hookStdin
+
+    def getRefineEvents(self):
+        return self.refineEvents
+
+    def getEventTableFile(self):
+        return self.eventTableFile
+
+    # Get the program to run at a twilight event (QtSsEvents type)
+    def getTwilightRun(self, eventType):
+        return self.twilightRuns.get(eventType)
+
     # Return True if fileName argument is an existing, executable file
     # else return False
     def isRunnableFile(self, fileName):
@@ -161,6 +192,69 @@ class SunsetterConfig:
                            "event at launch".format(enabled),
                            self.configSrcFrom)
 
+    def setHookTimeout(self, newTimeout):
+        if (newTimeout is None) or (newTimeout > 0.0):
+            self.hookTimeout = newTimeout
+        else:
+            warningMessage("Attempt to set invalid "
+                           "hook timeout: {}".format(newTimeout),
+                           self.configSrcFrom)
+
+    def setHookPolicy(self, newPolicy):
+        if (newPolicy is None) or (newPolicy in hookPolicies):
+            self.hookPolicy = newPolicy
+        else:
+            warningMessage("Attempt to set invalid "
+                           "hook policy: {}".format(newPolicy),
+                           self.configSrcFrom)
+
+    def setHookMode(self, newMode):
+        if (newMode is None) or (newMode in hookModes):
+            self.hookMode = newMode
+        else:
+            warningMessage("Attempt to set invalid "
+                           "hook mode: {}".format(newMode),
+                           self.configSrcFrom)
+
+    def setHookStdin(self, enabled):
+        if (enabled is True) or (enabled is False):
+            self.hookStdin = enabled
+        else:
+            warningMessage("Attempt to set unknown state, {}, for hook "
+                           "state on stdin".format(enabled),
+                           self.configSrcFrom)
+
+    def setRefineEvents(self, enabled):
+        if (enabled is True) or (enabled is False):
+            self.refineEvents = enabled
+        else:
+            warningMessage("Attempt to set unknown state, {}, for refining "
+                           "event times".format(enabled),
+                           self.configSrcFrom)
+
+    def setEventTableFile(self, newFileName):
+        if (newFileName is None) or QFileInfo(newFileName).isFile():
+            self.eventTableFile = newFileName
+        else:
+            warningMessage("Attempt to set missing file as event "
+                           "table {}".format(newFileName),
+                           self.configSrcFrom)
+
+    def setTwilightRun(self, newFileName, eventType):
+        if eventType not in twilightEventTypes:
+            warningMessage("Attempt to set run program for unrecognized "
+                           "twilight event: {}".format(eventType),
+                           self.configSrcFrom)
+        elif (newFileName is None) or (newFileName == ""):
+            self.twilightRuns.pop(eventType, None)
+        elif self.isRunnableFile(newFileName):
+            self.twilightRuns[eventType] = newFileName
+        else:
+            warningMessage("Attempt to set missing or non executable file "
+                           "as {} run program {}".format(eventType,
+                                                         newFileName),
+                           self.configSrcFrom)
+
     def getConfigFileDir(self):
         # Get the home directory path
         homePath = QDir.homePath()
@@ -304,6 +398,97 @@ class SunsetterConfig:
 
         return result
 
+    def hookTimeoutConfig(self, cfgLine):
+        nTimeout = None
+        m = re.search('^hooktimeout=(\\d+\\.{0,1}\\d*)$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            val = m.group(1)
+            try:
+                nTimeout = float(val)
+            except Exception:
+                warningMessage("Invalid hook timeout value {}. "
+                               "Ignored".format(val))
+                nTimeout = 0.0
+            if nTimeout > 0.0:
+                self.setHookTimeout(nTimeout)
+            debugMessage("Hook timeout = {} => {}".format(val, nTimeout))
+
+        return (nTimeout is not None)
+
+    def hookPolicyConfig(self, cfgLine):
+        result = False
+        m = re.search('^hookpolicy=(\\w+)$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            self.setHookPolicy(m.group(1).lower())
+            result = True
+            debugMessage("Hook policy = {}".format(m.group(1)))
+
+        return result
+
+    def hookModeConfig(self, cfgLine):
+        result = False
+        m = re.search('^hookmode=(\\w+)$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            self.setHookMode(m.group(1).lower())
+            result = True
+            debugMessage("Hook mode = {}".format(m.group(1)))
+
+        return result
+
+    def hookStdinConfig(self, cfgLine):
+        result = False
+
+        m = re.search('^hookstdin$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            self.setHookStdin(True)
+            result = True
+
+        return result
+
+    def refineEventsConfig(self, cfgLine):
+        result = False
+
+        m = re.search('^refineevents$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            self.setRefineEvents(True)
+            result = True
+
+        return result
+
+    def eventTableConfig(self, cfgLine):
+        result = False
+        m = re.search('^eventtable=(.+)$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            self.setEventTableFile(m.group(1))
+            result = True
+            debugMessage("Event table = {}".format(m.group(1)))
+
+        return result
+
+    def twilightRunConfig(self, cfgLine):
+        result = False
+        m = re.search('^({})run=(.*)$'.format("|".join(twilightEventTypes)),
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            self.setTwilightRun(m.group(2), m.group(1).lower())
+            result = True
+            debugMessage("{} program = {}".format(m.group(1), m.group(2)))
+
+        return result
+
     def processConfigLine(self, theLine):
         # Comments begin with a # character, remove them
         m = re.search('^(.*)\\s*\\#.*$', theLine)
@@ -340,6 +525,37 @@ class SunsetterConfig:
         if self.runLastEventAtLaunchConfig(theLine) is True:
             return
 
+        # If we have the longest time a sunrise/sunset program may run for
+        if self.hookTimeoutConfig(theLine) is True:
+            return
+
+        # If we have what to do with a program started while the last one
+        # for the same crossing is still running
+        if self.hookPolicyConfig(theLine) is True:
+            return
+
+        # If we have whether to start the programs each time or keep them
+        # running and send them each crossing
+        if self.hookModeConfig(theLine) is True:
+            return
+
+        # If we have the setting to send the crossing state to the programs'
+        # standard input
+        if self.hookStdinConfig(theLine) is True:
+            return
+
+        # If we have the setting to refine event times at each event
+        if self.refineEventsConfig(theLine) is True:
+            return
+
+        # If we have a precomputed table of horizon crossings
+        if self.eventTableConfig(theLine) is True:
+            return
+
+        # If we have a program to run at a twilight event
+        if self.twilightRunConfig(theLine) is True:
+            return
+
         warningMessage("Unprocessed config file line: {}".format(theLine),
                        self.configSrcFrom)
 
@@ -490,6 +706,129 @@ class SunsetterConfig:
 
         return outLine
 
+    def hookTimeoutProcessOutput(self, cfgLine):
+        outLine = None
+        m = re.search('^hooktimeout=(\\d+\\.{0,1}\\d*)$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            # If we haven't already saved it and have one to save
+            if (not self.savedHookTimeout) and\
+                    (self.getHookTimeout() is not None):
+                # Re-build using the current timeout
+                outLine = "hooktimeout={}".format(self.getHookTimeout())
+                self.savedHookTimeout = True
+            else:
+                # Saved it already
+                outLine = "#"
+
+        return outLine
+
+    def hookPolicyProcessOutput(self, cfgLine):
+        outLine = None
+        m = re.search('^hookpolicy=(\\w+)$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            # If we haven't already saved it and have one to save
+            if (not self.savedHookPolicy) and\
+                    (self.getHookPolicy() is not None):
+                # Re-build using the current policy
+                outLine = "hookpolicy={}".format(self.getHookPolicy())
+                self.savedHookPolicy = True
+            else:
+                # Saved it already
+                outLine = "#"
+
+        return outLine
+
+    def hookModeProcessOutput(self, cfgLine):
+        outLine = None
+        m = re.search('^hookmode=(\\w+)$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            # If we haven't already saved it and have one to save
+            if (not self.savedHookMode) and\
+                    (self.getHookMode() is not None):
+                # Re-build using the current mode
+                outLine = "hookmode={}".format(self.getHookMode())
+                self.savedHookMode = True
+            else:
+                # Saved it already
+                outLine = "#"
+
+        return outLine
+
+    def hookStdinProcessOutput(self, cfgLine):
+        outLine = None
+        m = re.search('^hookstdin$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            # If we haven't already saved it and it's enabled
+            if (not self.savedHookStdin) and (self.getHookStdin() is True):
+                outLine = "hookstdin"
+                self.savedHookStdin = True
+            else:
+                # Saved it already or it's disabled
+                outLine = "#"
+
+        return outLine
+
+    def refineEventsProcessOutput(self, cfgLine):
+        outLine = None
+        m = re.search('^refineevents$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            # If we haven't already saved it and it's enabled
+            if (not self.savedRefineEvents) and\
+                    (self.getRefineEvents() is True):
+                outLine = "refineevents"
+                self.savedRefineEvents = True
+            else:
+                # Saved it already or it's disabled
+                outLine = "#"
+
+        return outLine
+
+    def eventTableProcessOutput(self, cfgLine):
+        outLine = None
+        m = re.search('^eventtable=(.+)$',
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            # If we haven't already saved it and have one to save
+            if (not self.savedEventTable) and\
+                    (self.getEventTableFile() is not None):
+                outLine = "eventtable={}".format(self.getEventTableFile())
+                self.savedEventTable = True
+            else:
+                # Saved it already
+                outLine = "#"
+
+        return outLine
+
+    def twilightRunProcessOutput(self, cfgLine):
+        outLine = None
+        m = re.search('^({})run=(.*)$'.format("|".join(twilightEventTypes)),
+                      cfgLine,
+                      flags=re.IGNORECASE)
+        if m is not None:
+            eventType = m.group(1).lower()
+            # If we haven't already saved it and have one to save
+            if (eventType not in self.savedTwilightRuns) and\
+                    (self.getTwilightRun(eventType) is not None):
+                outLine = "{}run={}".format(eventType,
+                                            self.getTwilightRun(eventType))
+                self.savedTwilightRuns.add(eventType)
+            else:
+                # Saved it already
+                outLine = "#"
+
+        return outLine
+
     def processOutputConfigLine(self, outStream, theLine, doSave=True):
         global QTS_SUNRISE, QTS_SUNSET
 
@@ -554,6 +893,27 @@ class SunsetterConfig:
                 if tmpLine is None:
                     # If we have a program to run at sunrise or sunset (string)
                     tmpLine = self.solarCrossingRunProcessOutput(theLine)
+                    if tmpLine is None:
+                        # If we have a hook timeout (decimal seconds)
+                        tmpLine = self.hookTimeoutProcessOutput(theLine)
+                        if tmpLine is None:
+                            # If we have a hook policy (skip/queue/cancel)
+                            tmpLine = self.hookPolicyProcessOutput(theLine)
+                        if tmpLine is None:
+                            # If we have a hook mode (exec/worker)
+                            tmpLine = self.hookModeProcessOutput(theLine)
+                        if tmpLine is None:
+                            # If we have state on stdin for the programs
+                            tmpLine = self.hookStdinProcessOutput(theLine)
+                        if tmpLine is None:
+                            # If we have refined event times
+                            tmpLine = self.refineEventsProcessOutput(theLine)
+                        if tmpLine is None:
+                            # If we have an event table (file name)
+                            tmpLine = self.eventTableProcessOutput(theLine)
+                        if tmpLine is None:
+                            # If we have a twilight program (string)
+                            tmpLine = self.twilightRunProcessOutput(theLine)
 
             # If we get here with tmpLine not None we can treat it generically
             # for all cases
@@ -581,6 +941,13 @@ class SunsetterConfig:
         self.savedRiseRun = False
         self.savedSetRun = False
         self.savedRunLastEventAtLaunch = False
+        self.savedHookTimeout = False
+        self.savedHookPolicy = False
+        self.savedHookMode = False
+        self.savedHookStdin = False
+        self.savedRefineEvents = False
+        self.savedEventTable = False
+        self.savedTwilightRuns = set()
 
         # Get the config and temp filenames
         cfgFilename = self.getConfigFilename()
@@ -656,6 +1023,51 @@ class SunsetterConfig:
                                              "runlasteventatlaunch",
                                              launchRun)
 
+                hookTimeout = (self.savedHookTimeout is False) and\
+                              (self.hookTimeout is not None)
+                self.processOutputConfigLine(outStream,
+                                             "hooktimeout=0",
+                                             hookTimeout)
+
+                hookPolicy = (self.savedHookPolicy is False) and\
+                             (self.hookPolicy is not None)
+                self.processOutputConfigLine(outStream,
+                                             "hookpolicy=skip",
+                                             hookPolicy)
+
+                hookMode = (self.savedHookMode is False) and\
+                           (self.hookMode is not None)
+                self.processOutputConfigLine(outStream,
+                                             "hookmode=exec",
+                                             hookMode)
+
+                hookStdin = (self.savedHookStdin is False) and\
+                            (self.hookStdin is True)
+                self.processOutputConfigLine(outStream,
+                                             "hookstdin",
+                                             hookStdin)
+
+                refineEvents = (self.savedRefineEvents is False) and\
+                               (self.refineEvents is True)
+                self.processOutputConfigLine(outStream,
+                                             "refineevents",
+                                             refineEvents)
+
+                eventTable = (self.savedEventTable is False) and\
+                             (self.eventTableFile is not None)
+                self.processOutputConfigLine(outStream,
+                                             "eventtable=abc",
+                                             eventTable)
+
+                for eventType in twilightEventTypes:
+                    twilightRun = (eventType not in
+                                   self.savedTwilightRuns) and\
+                        (self.getTwilightRun(eventType) is not None)
+                    self.processOutputConfigLine(outStream,
+                                                 "{}run=abc".format(
+                                                     eventType),
+                                                 twilightRun)
+
                 # Rename the temp file as the config file
                 tmpFile.rename(cfgFilename)
             else:
@@ -0,0 +1,383 @@
+# This Python file uses the following encoding: utf-8
+#
+# Headless daemon running the sunrise/sunset programs for any number of
+# locations from one process. The next event for every location is kept in a
+# single priority queue (heap) ordered by time, the daemon sleeps until the
+# earliest, runs its program and queues that location's following event.
+#
+# Usage:
+#     python QtSsDaemon.py [--refined] <locations-file>
+#     python QtSsDaemon.py --test
+#
+# With --refined each event time is re-evaluated at the instant it happens,
+# see QtSsMath.RefinedObserver. Events passed while the system was suspended,
+# or the clock was stepped over them, are run late when it's noticed. --test
+# checks that with a simulated suspend and exits with status 1 if it fails.
+#
+# The locations file has one location per line, comments begin at a #
+# character:
+#     name latitude longitude timezone [sunriserun [sunsetrun]] [event=run ...]
+# latitude, longitude and timezone are signed decimal numbers as in the
+# QtSunsetter configuration file. Use - for a program that isn't wanted.
+# Programs for twilight events follow as event=program, where event is one of
+# civildawn, civildusk, nauticaldawn, nauticaldusk, astronomicaldawn or
+# astronomicaldusk.
+#
+# Version: 1.0
+# Copyright (C) 2020/10/19 David A. Mair
+# This file is part of QtSunsetter<https://github.com/mairda/QtSunsetter.git>.
+#
+# QtSunsetter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# QtSunsetter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with QtSunsetter.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import os
+import re
+import heapq
+import time
+
+from threading import Event
+
+from QtSsDebug import debugMessage, warningMessage, errorMessage
+from QtSsDebug import enableWarnings
+from QtSsMath import SolarObserver
+from QtSsFastMath import getSolarEvaluator, ENGINE_NOAA, ENGINE_REFINED
+from QtSsEvents import nextSolarEvent, observerCrossingState
+from QtSsEvents import EVENT_SUNRISE, EVENT_SUNSET, twilightEventTypes
+from QtSsHooks import HookDispatcher, defaultHookTimeout, hookEnvironment
+
+
+# One location the daemon handles and the programs to run there
+class SunsetterSite:
+    def __init__(self, name, observer, sunriseRun=None, sunsetRun=None,
+                 twilightRuns=None):
+        self.name = name
+        self.observer = observer
+        self.sunriseRun = sunriseRun
+        self.sunsetRun = sunsetRun
+        if twilightRuns is None:
+            twilightRuns = {}
+        self.twilightRuns = twilightRuns
+
+    def getEventRun(self, eventType):
+        if eventType == EVENT_SUNRISE:
+            return self.sunriseRun
+        elif eventType == EVENT_SUNSET:
+            return self.sunsetRun
+
+        return self.twilightRuns.get(eventType)
+
+    # The types of event the daemon waits for at this site, sunrise and
+    # sunset and any twilight event with a program
+    def getEventTypes(self):
+        return (EVENT_SUNRISE, EVENT_SUNSET) + tuple(self.twilightRuns.keys())
+
+
+# Return True if fileName argument is an existing, executable file
+# else return False
+def isRunnableFile(fileName):
+    return (fileName is not None) and (fileName != "") and\
+        os.path.isfile(fileName) and os.access(fileName, os.X_OK)
+
+
+# Create a site from a line of a locations file
+# Returns a SunsetterSite object or None if the line has no location
+def parseSiteLine(theLine):
+    # Comments begin with a # character, remove them
+    m = re.search('^(.*?)\\s*\\#.*$', theLine)
+    if m is not None:
+        theLine = m.group(1)
+
+    fields = theLine.split()
+    if len(fields) == 0:
+        return None
+
+    if len(fields) < 4:
+        warningMessage("Location needs a name, latitude, longitude and "
+                       "timezone: {}".format(theLine), daemonSrcFrom)
+        return None
+
+    try:
+        observer = SolarObserver(float(fields[1]),
+                                 float(fields[2]),
+                                 float(fields[3]))
+    except ValueError as e:
+        warningMessage("Invalid location {}: {}".format(fields[0], e),
+                       daemonSrcFrom)
+        return None
+
+    # Twilight programs are named, the sunrise and sunset programs aren't
+    positional = [field for field in fields[4:] if "=" not in field]
+    twilightRuns = {}
+    for field in fields[4:]:
+        if "=" in field:
+            eventType, fileName = field.split("=", 1)
+            eventType = eventType.lower()
+            if eventType not in twilightEventTypes:
+                warningMessage("Unrecognized twilight event for "
+                               "{}: {}".format(fields[0], eventType),
+                               daemonSrcFrom)
+            elif not isRunnableFile(fileName):
+                warningMessage("Missing or non executable program for "
+                               "{}: {}".format(fields[0], fileName),
+                               daemonSrcFrom)
+            else:
+                twilightRuns[eventType] = fileName
+
+    runs = []
+    for fileName in positional[0:2]:
+        if fileName == "-":
+            fileName = None
+        elif not isRunnableFile(fileName):
+            warningMessage("Missing or non executable program for "
+                           "{}: {}".format(fields[0], fileName),
+                           daemonSrcFrom)
+            fileName = None
+        runs.append(fileName)
+    while len(runs) < 2:
+        runs.append(None)
+
+    return SunsetterSite(fields[0], observer, runs[0], runs[1], twilightRuns)
+
+
+# Read every site from a locations file, calculating each site's events with
+# a QtSsFastMath solar engine
+# Returns a list of SunsetterSite objects
+def loadSites(fileName, engine=None):
+    sites = []
+    with open(fileName, "r") as siteFile:
+        for theLine in siteFile:
+            site = parseSiteLine(theLine.strip())
+            if site is not None:
+                site.observer = getSolarEvaluator(site.observer, engine)
+                sites.append(site)
+                debugMessage("Loaded location {} at {}".format(site.name,
+                                                               site.observer))
+
+    return sites
+
+
+class SunsetterDaemon:
+    # Longest time to sleep before re-checking the clock, in seconds. The
+    # wait runs on the monotonic clock, which stops while the system is
+    # suspended, so a suspend is only noticed when a wait ends and this
+    # bounds how late an event passed during one is run
+    maxSleep = 60.0
+
+    # How far after an event to wake, so the clock has passed it, in seconds
+    wakeMargin = 0.05
+
+    # Seconds the realtime and monotonic clocks can disagree by across a
+    # sleep before it's treated as a clock jump
+    clockJumpTolerance = 2.0
+
+    # Longest time a site's program can run for, in seconds
+    hookTimeout = defaultHookTimeout
+
+    def __init__(self, sites, hookPolicy=None):
+        self.sites = sites
+        self.hooks = HookDispatcher(hookPolicy)
+        self.queue = []
+        self.sequence = 0
+        self.stopEvent = Event()
+
+    # Queue the first event for a site after a time (seconds since the
+    # epoch). The sequence number keeps events at the same time in the order
+    # they were queued without comparing sites
+    def queueNextEvent(self, siteNum, afterEpoch):
+        site = self.sites[siteNum]
+        event = nextSolarEvent(site.observer, afterEpoch,
+                               eventTypes=site.getEventTypes())
+        if event is None:
+            warningMessage("No solar horizon crossing or twilight for {} in "
+                           "the next year".format(site.name), daemonSrcFrom)
+            return
+
+        heapq.heappush(self.queue, (event[0], self.sequence, event[1],
+                                    siteNum))
+        self.sequence += 1
+
+    # Throw away any queued events and queue the next one for every site
+    def planAll(self, nowEpoch=None):
+        if nowEpoch is None:
+            nowEpoch = time.time()
+
+        self.queue = []
+        for siteNum in range(len(self.sites)):
+            self.queueNextEvent(siteNum, nowEpoch)
+
+    # Sleep until deadline (seconds since the epoch) or for no more than
+    # maxSleep seconds
+    # Returns True if the clock jumped while sleeping
+    def waitUntil(self, deadline):
+        startEpoch = time.time()
+        startMono = time.monotonic()
+
+        sleepFor = min(deadline - startEpoch, self.maxSleep)
+        if sleepFor > 0.0:
+            self.stopEvent.wait(sleepFor)
+
+        realElapsed = time.time() - startEpoch
+        monoElapsed = time.monotonic() - startMono
+
+        return abs(realElapsed - monoElapsed) > self.clockJumpTolerance
+
+    def dispatch(self, eventEpoch, eventType, siteNum):
+        site = self.sites[siteNum]
+        lateBy = time.time() - eventEpoch
+        debugMessage("{} at {}, {:.3f}s after it was due".format(eventType,
+                                                                site.name,
+                                                                lateBy))
+
+        # Run the program without waiting, its output is prefixed with the
+        # site name and event. Each site's events have their own slot so a
+        # slow program only holds up later runs of itself. The program is
+        # given the site's solar state in its environment
+        fileName = site.getEventRun(eventType)
+        if fileName is not None:
+            prefix = "<{} {}: ".format(site.name, eventType)
+            state = observerCrossingState(site.observer, eventType,
+                                          eventEpoch)
+            state["site"] = site.name
+            self.hooks.dispatch((siteNum, eventType), [fileName],
+                                timeout=self.hookTimeout,
+                                outputPrefix=prefix,
+                                env=hookEnvironment(state))
+
+    # Run the queued events the clock has passed, e.g. those due while the
+    # system was suspended, late and with a warning. Each site's following
+    # events are queued from the one run so every passed event is run, in
+    # time order
+    def dispatchPassed(self):
+        nowEpoch = time.time()
+        while (len(self.queue) > 0) and (self.queue[0][0] <= nowEpoch):
+            eventEpoch, seq, eventType, siteNum = heapq.heappop(self.queue)
+            warningMessage("{} at {} passed during a clock jump, running it "
+                           "{:.0f}s late".format(eventType,
+                                                 self.sites[siteNum].name,
+                                                 nowEpoch - eventEpoch),
+                           daemonSrcFrom)
+            self.dispatch(eventEpoch, eventType, siteNum)
+            self.queueNextEvent(siteNum, eventEpoch)
+
+    # Handle events until stop() is called
+    def run(self):
+        self.planAll()
+        while (not self.stopEvent.is_set()) and (len(self.queue) > 0):
+            eventEpoch, seq, eventType, siteNum = self.queue[0]
+            if time.time() < eventEpoch + self.wakeMargin:
+                if self.waitUntil(eventEpoch + self.wakeMargin):
+                    debugMessage("Clock jump detected, re-planning")
+                    self.dispatchPassed()
+                    self.planAll()
+                continue
+
+            heapq.heappop(self.queue)
+            self.dispatch(eventEpoch, eventType, siteNum)
+            self.queueNextEvent(siteNum, eventEpoch)
+
+    def stop(self):
+        self.stopEvent.set()
+
+    # Wait for running programs to finish, for no more than timeout seconds
+    # Returns True if none are still running
+    def waitHooks(self, timeout=None):
+        return self.hooks.waitIdle(timeout)
+
+
+# Run a daemon across a simulated suspend, the realtime clock jumping two
+# days ahead while the monotonic clock moves a minute, and check the hooks
+# for the sunrises and sunsets passed during it were dispatched
+# Returns True if they were
+def testClockJump():
+    site = SunsetterSite("test", SolarObserver(29.976634, -101.766673, -6.0),
+                         "/bin/true", "/bin/true")
+    daemon = SunsetterDaemon([site])
+    startEpoch = 1624298400.0
+    clocks = {"real": startEpoch, "mono": 1000.0, "suspended": False}
+    dispatched = []
+
+    # Sleeping moves both clocks, the first sleep is the suspend
+    def fakeWait(seconds):
+        if not clocks["suspended"]:
+            clocks["suspended"] = True
+            clocks["real"] += 2 * 86400.0
+            clocks["mono"] += 60.0
+        else:
+            clocks["real"] += seconds
+            clocks["mono"] += seconds
+        if clocks["real"] > startEpoch + 3 * 86400.0:
+            daemon.stop()
+
+        return daemon.stopEvent.is_set()
+
+    def fakeDispatch(hookKey, args, **kwargs):
+        dispatched.append((clocks["real"], hookKey[1]))
+
+    daemon.stopEvent.wait = fakeWait
+    daemon.hooks.dispatch = fakeDispatch
+    realTime = time.time
+    realMonotonic = time.monotonic
+    time.time = lambda: clocks["real"]
+    time.monotonic = lambda: clocks["mono"]
+    try:
+        daemon.run()
+    finally:
+        time.time = realTime
+        time.monotonic = realMonotonic
+
+    # Two sunrises and two sunsets passed during the suspend, all run as it
+    # ended
+    passed = [eventType for at, eventType in dispatched
+              if at < startEpoch + 2 * 86400.0 + 120.0]
+    print("Dispatched across the jump: {}".format(passed))
+
+    return (passed.count(EVENT_SUNRISE) == 2) and\
+        (passed.count(EVENT_SUNSET) == 2)
+# testClockJump
+
+
+# A name for this module in warning messages
+daemonSrcFrom = "Daemon"
+
+if __name__ == "__main__":
+    # enableDebug()
+    enableWarnings()
+
+    if "--test" in sys.argv:
+        sys.exit(0 if testClockJump() else 1)
+
+    daemonEngine = ENGINE_NOAA
+    if "--refined" in sys.argv:
+        sys.argv.remove("--refined")
+        daemonEngine = ENGINE_REFINED
+
+    if len(sys.argv) != 2:
+        errorMessage("Usage: {0} [--refined] <locations-file>\n"
+                     "       {0} --test".format(sys.argv[0]))
+        sys.exit(1)
+
+    daemonSites = loadSites(sys.argv[1], daemonEngine)
+    if len(daemonSites) == 0:
+        errorMessage("No locations loaded from {}".format(sys.argv[1]),
+                     daemonSrcFrom)
+        sys.exit(1)
+
+    daemon = SunsetterDaemon(daemonSites)
+    try:
+        daemon.run()
+    except KeyboardInterrupt:
+        daemon.stop()
+    daemon.waitHooks(SunsetterDaemon.hookTimeout)
+
+    sys.exit(0)
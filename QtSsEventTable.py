@@ -0,0 +1,259 @@
+# This Python file uses the following encoding: utf-8
+#
+# Precomputed sunrise, sunset and solar noon times for one location over one
+# or more years, in a compact binary file. The file is memory mapped and the
+# next event found by binary search, so no solar calculations are made at run
+# time.
+#
+# Usage:
+#     python QtSsEventTable.py write [--chebyshev|--refined] <latitude>
+#                                    <longitude> <timezone> <first-year>
+#                                    [<last-year>] <table-file>
+#     python QtSsEventTable.py next <table-file>
+#
+# File format, all little endian:
+#     header  - 8 byte magic "QTSEVT01", latitude, longitude and timezone
+#               (float64), first and last year (uint16), event count (uint32)
+#     records - one per event in time order, epoch seconds (uint32, truncated
+#               to the second) and event type (uint32, 1 sunrise, 2 sunset,
+#               3 solar noon)
+#
+# Version: 1.0
+# Copyright (C) 2020/10/19 David A. Mair
+# This file is part of QtSunsetter<https://github.com/mairda/QtSunsetter.git>.
+#
+# QtSunsetter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# QtSunsetter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with QtSunsetter.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import bisect
+import datetime
+import math
+import mmap
+import struct
+import time
+
+from QtSsDebug import debugMessage, warningMessage, errorMessage
+from QtSsDebug import enableWarnings
+from QtSsMath import SolarObserver
+from QtSsEvents import eventEpoch, EVENT_SUNRISE, EVENT_SUNSET
+from QtSsEvents import EVENT_SOLAR_NOON, horizonCrossingFractions
+from QtSsFastMath import getSolarEvaluator, ENGINE_NOAA, ENGINE_CHEBYSHEV
+from QtSsFastMath import ENGINE_REFINED
+
+
+# The epochs of a table's events as a sequence, for bisect
+class EventTableEpochs:
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return self.table.count
+
+    def __getitem__(self, index):
+        return self.table.getEvent(index)[0]
+
+
+# A memory mapped event table file
+class EventTable:
+    def __init__(self, fileName):
+        with open(fileName, "rb") as tableFile:
+            self.map = mmap.mmap(tableFile.fileno(), 0,
+                                 access=mmap.ACCESS_READ)
+
+        if len(self.map) < tableHeader.size:
+            self.close()
+            raise ValueError("Too short for an event table: "
+                             "{}".format(fileName))
+
+        magic, self.latitude, self.longitude, self.tz, self.firstYear,\
+            self.lastYear, self.count = tableHeader.unpack_from(self.map, 0)
+        if magic != tableMagic:
+            self.close()
+            raise ValueError("Not an event table: {}".format(fileName))
+
+        if len(self.map) != tableHeader.size + self.count * tableRecord.size:
+            self.close()
+            raise ValueError("Event table size doesn't match its event "
+                             "count: {}".format(fileName))
+
+        self.epochs = EventTableEpochs(self)
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        self.map.close()
+
+    # Get an event by its position in the table
+    # Returns a tuple (epoch, event type)
+    def getEvent(self, index):
+        epoch, code = tableRecord.unpack_from(self.map, tableHeader.size +
+                                              index * tableRecord.size)
+
+        return (epoch, eventTypeNames.get(code))
+
+    # Returns True if the table was made for a location and timezone
+    def matches(self, latitude, longitude, tz):
+        return (abs(self.latitude - latitude) < 1e-6) and\
+            (abs(self.longitude - longitude) < 1e-6) and\
+            (abs(self.tz - tz) < 1e-6)
+
+    # Get the first event of one of the types after a time (seconds since
+    # the epoch)
+    # Returns a tuple (epoch, event type) or None if the table ends first
+    def nextEvent(self, afterEpoch, eventTypes=(EVENT_SUNRISE, EVENT_SUNSET)):
+        index = bisect.bisect_right(self.epochs, afterEpoch)
+        while index < self.count:
+            event = self.getEvent(index)
+            if event[1] in eventTypes:
+                return event
+            index += 1
+
+        return None
+
+    # Get the last event of one of the types at or before a time (seconds
+    # since the epoch)
+    # Returns a tuple (epoch, event type) or None if the table starts later
+    def previousEvent(self, atEpoch,
+                      eventTypes=(EVENT_SUNRISE, EVENT_SUNSET)):
+        index = bisect.bisect_right(self.epochs, atEpoch) - 1
+        while index >= 0:
+            event = self.getEvent(index)
+            if event[1] in eventTypes:
+                return event
+            index -= 1
+
+        return None
+
+
+# Calculate every sunrise, sunset and solar noon for an observer from the
+# start of the first year to the end of the last year, in the observer's
+# timezone, with a QtSsFastMath engine. Days where the sun doesn't cross the
+# horizon have only a solar noon
+# Returns a list of (epoch, event type code) tuples in time order
+def calculateEvents(observer, firstYear, lastYear, engine=ENGINE_NOAA):
+    evaluator = getSolarEvaluator(observer, engine)
+    events = []
+    aTime = datetime.time(0, 6, 0)
+    aDate = datetime.date(firstYear, 1, 1)
+    endDate = datetime.date(lastYear, 12, 31)
+    while aDate <= endDate:
+        sNoon, crossings = horizonCrossingFractions(evaluator, aDate, aTime)
+        for fraction, eventType in crossings:
+            events.append((eventEpoch(aDate, fraction, observer.tz),
+                           eventTypeCodes[eventType]))
+        events.append((eventEpoch(aDate, sNoon, observer.tz),
+                       eventTypeCodes[EVENT_SOLAR_NOON]))
+        aDate += datetime.timedelta(days=1)
+
+    events.sort()
+
+    return events
+
+
+# Write the event table for an observer and range of years to a file
+# Returns the number of events written
+def writeEventTable(fileName, observer, firstYear, lastYear=None,
+                    engine=ENGINE_NOAA):
+    if lastYear is None:
+        lastYear = firstYear
+
+    events = calculateEvents(observer, firstYear, lastYear, engine)
+    tableData = bytearray(tableHeader.size + len(events) * tableRecord.size)
+    tableHeader.pack_into(tableData, 0, tableMagic, observer.latitude,
+                          observer.longitude, observer.tz, firstYear,
+                          lastYear, len(events))
+    offset = tableHeader.size
+    for epoch, code in events:
+        tableRecord.pack_into(tableData, offset, int(math.floor(epoch)), code)
+        offset += tableRecord.size
+
+    with open(fileName, "wb") as tableFile:
+        tableFile.write(tableData)
+    debugMessage("Wrote {} events to {}".format(len(events), fileName))
+
+    return len(events)
+
+
+# Open an event table, reporting a missing or bad file
+# Returns an EventTable object or None
+def loadEventTable(fileName):
+    try:
+        return EventTable(fileName)
+    except (OSError, ValueError) as e:
+        warningMessage("Can't use event table {}: {}".format(fileName, e),
+                       eventTableSrcFrom)
+
+    return None
+
+
+# A name for this module in warning messages
+eventTableSrcFrom = "Event Table"
+
+tableMagic = b"QTSEVT01"
+tableHeader = struct.Struct("<8sdddHHI")
+tableRecord = struct.Struct("<II")
+
+# Event types as stored in the table
+eventTypeCodes = {EVENT_SUNRISE: 1, EVENT_SUNSET: 2, EVENT_SOLAR_NOON: 3}
+eventTypeNames = {1: EVENT_SUNRISE, 2: EVENT_SUNSET, 3: EVENT_SOLAR_NOON}
+
+if __name__ == "__main__":
+    enableWarnings()
+
+    tableEngine = ENGINE_NOAA
+    if "--chebyshev" in sys.argv:
+        sys.argv.remove("--chebyshev")
+        tableEngine = ENGINE_CHEBYSHEV
+    if "--refined" in sys.argv:
+        sys.argv.remove("--refined")
+        tableEngine = ENGINE_REFINED
+
+    if (len(sys.argv) in (7, 8)) and (sys.argv[1] == "write"):
+        try:
+            tableObserver = SolarObserver(float(sys.argv[2]),
+                                          float(sys.argv[3]),
+                                          float(sys.argv[4]))
+            tableFirst = int(sys.argv[5])
+            tableLast = int(sys.argv[-2]) if len(sys.argv) == 8 else None
+        except ValueError as e:
+            errorMessage("{}".format(e), eventTableSrcFrom)
+            sys.exit(1)
+
+        tableCount = writeEventTable(sys.argv[-1], tableObserver, tableFirst,
+                                     tableLast, tableEngine)
+        print("Wrote {} events to {}".format(tableCount, sys.argv[-1]))
+    elif (len(sys.argv) == 3) and (sys.argv[1] == "next"):
+        table = loadEventTable(sys.argv[2])
+        if table is None:
+            sys.exit(1)
+
+        print("Location {}, {} timezone {}, {} to {}, {} "
+              "events".format(table.latitude, table.longitude, table.tz,
+                              table.firstYear, table.lastYear, table.count))
+        nextEvent = table.nextEvent(time.time())
+        if nextEvent is None:
+            print("No more crossings in the table")
+        else:
+            print("Next {} at {}".format(nextEvent[1],
+                                         time.ctime(nextEvent[0])))
+        table.close()
+    else:
+        errorMessage("Usage: {0} write [--chebyshev|--refined] <latitude> "
+                     "<longitude> <timezone> <first-year> [<last-year>] "
+                     "<table-file>\n"
+                     "       {0} next <table-file>".format(sys.argv[0]))
+        sys.exit(1)
+
+    sys.exit(0)
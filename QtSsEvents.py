@@ -0,0 +1,523 @@
+# This Python file uses the following encoding: utf-8
+#
+# Solar horizon crossing events as absolute times (seconds since the epoch)
+# for any SolarObserver, independent of the system clock timezone and the
+# QtSsMath home location globals
+#
+# Version: 1.0
+# Copyright (C) 2020/10/19 David A. Mair
+# This file is part of QtSunsetter<https://github.com/mairda/QtSunsetter.git>.
+#
+# QtSunsetter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# QtSunsetter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with QtSunsetter.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import bisect
+import calendar
+import csv
+import datetime
+import math
+import time
+
+from threading import Lock, Thread
+
+from QtSsDebug import debugMessage, errorMessage
+from QtSsMath import SolarObserver, RefinedObserver, timeFromDayFraction
+from QtSsMath import measureRefinement
+from QtSsMath import DAY_NORMAL, DAY_MIDNIGHT_SUN
+
+
+# Get the time (seconds since the epoch) of the midnight that starts a date in
+# a timezone with a clock offset of tz hours
+def dayStartEpoch(aDate, tz):
+    return calendar.timegm(aDate.timetuple()) - tz * 3600.0
+
+
+# Get the time (seconds since the epoch) of a fraction of a date in a timezone
+# with a clock offset of tz hours
+def eventEpoch(aDate, fracOfDay, tz):
+    return dayStartEpoch(aDate, tz) + fracOfDay * 86400.0
+
+
+# Get the date in a timezone with a clock offset of tz hours at a time
+# (seconds since the epoch)
+def localDateAt(epoch, tz):
+    return datetime.date(1970, 1, 1) +\
+        datetime.timedelta(seconds=epoch + tz * 3600.0)
+
+
+# Get the sunrise and sunset on a date for an observer as fractions of the
+# day, without raising ValueError on a polar day or night. A polar night has
+# none. On a midnight sun day the sun only reaches the horizon at solar
+# midnight, where a run of them meets a normal day the crossing that keeps
+# sunrises and sunsets alternating is placed there (the polar day sentinels)
+# Returns a tuple (solarNoon, list of (fraction, event type) in time order)
+def horizonCrossingFractions(observer, aDate, aTime=datetime.time(0, 6, 0)):
+    dayType, sRise, sSet, sNoon, sDur = observer.dayEvents(aDate, aTime)
+    if dayType == DAY_NORMAL:
+        return (sNoon, [(sRise, EVENT_SUNRISE), (sSet, EVENT_SUNSET)])
+
+    crossings = []
+    if dayType == DAY_MIDNIGHT_SUN:
+        oneDay = datetime.timedelta(days=1)
+        if observer.dayType(aDate - oneDay, aTime) == DAY_NORMAL:
+            crossings.append((sRise, EVENT_SUNRISE))
+        if observer.dayType(aDate + oneDay, aTime) == DAY_NORMAL:
+            crossings.append((sSet, EVENT_SUNSET))
+
+    return (sNoon, crossings)
+
+
+# Get the sunrise and sunset times (seconds since the epoch) for an observer
+# on a date in the observer's timezone, and optionally solar noon and the
+# twilight begin and end times
+# Returns a list of (epoch, event type) tuples in time order, empty if the sun
+# doesn't cross the horizon on the date and noon isn't wanted
+def solarEventsOnDate(observer, aDate, aTime=datetime.time(0, 6, 0),
+                      includeNoon=False, includeTwilight=False):
+    if includeTwilight is True:
+        return crossingEventsOnDate(observer, aDate, aTime, includeNoon)
+
+    sNoon, crossings = horizonCrossingFractions(observer, aDate, aTime)
+    events = [(eventEpoch(aDate, fraction, observer.tz), eventType)
+              for fraction, eventType in crossings]
+
+    if includeNoon is True:
+        events.append((eventEpoch(aDate, sNoon, observer.tz),
+                       EVENT_SOLAR_NOON))
+        events.sort()
+
+    return events
+
+
+# Get the sunrise, sunset and every twilight begin and end time (seconds
+# since the epoch) for an observer on a date in the observer's timezone, and
+# optionally solar noon, from one solar calculation
+# Returns a list of (epoch, event type) tuples in time order
+def crossingEventsOnDate(observer, aDate, aTime=datetime.time(0, 6, 0),
+                         includeNoon=False):
+    sNoon, crossings = observer.horizonCrossings(aDate, aTime)
+    events = []
+
+    # Only a polar day needs more than the one calculation
+    if crossings["horizon"] is None:
+        for fraction, eventType in horizonCrossingFractions(observer, aDate,
+                                                            aTime)[1]:
+            events.append((eventEpoch(aDate, fraction, observer.tz),
+                           eventType))
+    for level, levelTimes in crossings.items():
+        if levelTimes is not None:
+            beginType, endType = crossingEventTypes[level]
+            events.append((eventEpoch(aDate, levelTimes[0], observer.tz),
+                           beginType))
+            events.append((eventEpoch(aDate, levelTimes[1], observer.tz),
+                           endType))
+
+    if includeNoon is True:
+        events.append((eventEpoch(aDate, sNoon, observer.tz),
+                       EVENT_SOLAR_NOON))
+    events.sort()
+
+    return events
+
+
+# Get the twilight begin and end times for an observer on a date in the
+# observer's timezone, for the programs run at an event
+# Returns a dictionary of times as strings, or None for those that don't
+# happen on the date, by twilight event name
+def twilightState(observer, aDate, aTime=datetime.time(0, 6, 0)):
+    state = {}
+    sNoon, crossings = observer.horizonCrossings(aDate, aTime)
+    for level, (beginType, endType) in crossingEventTypes.items():
+        if beginType in twilightEventTypes:
+            levelTimes = crossings[level]
+            for eventType, index in ((beginType, 0), (endType, 1)):
+                if levelTimes is None:
+                    state[twilightStateNames[eventType]] = None
+                else:
+                    state[twilightStateNames[eventType]] =\
+                        str(timeFromDayFraction(levelTimes[index]))
+
+    return state
+
+
+# Get an event time as a datetime in the observer's timezone
+def eventDateTime(observer, epoch):
+    return datetime.datetime.fromtimestamp(
+        epoch, datetime.timezone(datetime.timedelta(hours=observer.tz)))
+
+
+# Generate the sunrise and sunset (and optionally solar noon and twilight)
+# events for an observer from the start of one date to the end of another,
+# in the observer's timezone. Each date is calculated only when the events
+# before it have been used, so any range can be streamed. Without an end date
+# it never stops
+# Yields (datetime, event type, observer) tuples in time order
+def iterSolarEvents(observer, startDate, endDate=None, includeNoon=False,
+                    includeTwilight=False):
+    aDate = startDate
+    while (endDate is None) or (aDate <= endDate):
+        for epoch, eventType in solarEventsOnDate(
+                observer, aDate, includeNoon=includeNoon,
+                includeTwilight=includeTwilight):
+            yield (eventDateTime(observer, epoch), eventType, observer)
+        aDate += datetime.timedelta(days=1)
+
+
+# Generate the events for an observer that follow a time (seconds since the
+# epoch), without end
+# Yields (datetime, event type, observer) tuples in time order
+def iterSolarEventsAfter(observer, afterEpoch, includeNoon=False,
+                         includeTwilight=False):
+    # The day before can have events late enough to follow afterEpoch when the
+    # timezone is far from the longitude
+    startDate = localDateAt(afterEpoch, observer.tz) -\
+        datetime.timedelta(days=1)
+    for event in iterSolarEvents(observer, startDate,
+                                 includeNoon=includeNoon,
+                                 includeTwilight=includeTwilight):
+        if event[0].timestamp() > afterEpoch:
+            yield event
+
+
+# Get the first solar horizon crossing for an observer after a time (seconds
+# since the epoch), looking at most maxDays ahead. eventTypes limits it to
+# those types of event, which can include twilight
+# Returns a tuple (epoch, event type) or None if there isn't one
+def nextSolarEvent(observer, afterEpoch, maxDays=366, eventTypes=None):
+    aDate = localDateAt(afterEpoch, observer.tz)
+    if eventTypes is None:
+        eventTypes = (EVENT_SUNRISE, EVENT_SUNSET)
+    includeTwilight = any(eventType in twilightEventTypes
+                          for eventType in eventTypes)
+
+    # The day before can have events late enough to follow afterEpoch when the
+    # timezone is far from the longitude
+    aDate -= datetime.timedelta(days=1)
+    for dayNum in range(maxDays + 2):
+        for event in solarEventsOnDate(observer, aDate,
+                                       includeTwilight=includeTwilight):
+            if (event[0] > afterEpoch) and (event[1] in eventTypes):
+                return event
+        aDate += datetime.timedelta(days=1)
+
+    return None
+
+
+# The horizon crossings for an observer over a rolling window of days, sorted
+# by time so the crossing before or after any time in the window is found by
+# bisection. Times are whole seconds since the epoch, truncated as the
+# displayed sunrise and sunset times are.
+#
+# clockTZ is the clock offset in hours of the clock the crossings are timed
+# by, the observer's timezone if it is None. A different one places the
+# observer's local crossing times on that clock, e.g. the system clock when
+# it is taken to be the clock at the observer.
+#
+# A query near the end of the window extends it on a thread while queries
+# carry on with the current window, a query outside it re-fills it first.
+# Through a midnight sun or polar night the window stretches back and forward
+# to the crossings either side of it, so the next crossing is always found
+# without re-filling day by day.
+class EventIndex:
+    # Days before and after the query time to cover
+    daysBefore = 1
+    daysAfter = 7
+
+    # Most days to look back or forward for a crossing across a polar day or
+    # night
+    maxPolarDays = 366
+
+    # Start extending the window when fewer than this many seconds of it are
+    # left after a query
+    refillMargin = 2 * 86400
+
+    def __init__(self, observer, clockTZ=None):
+        self.observer = observer
+        if clockTZ is None:
+            clockTZ = observer.tz
+        self.clockTZ = clockTZ
+
+        # (window start, window end, crossing times, crossing types), replaced
+        # as a whole so a query never sees half a refill
+        self.window = None
+        self.refillLock = Lock()
+        self.refilling = False
+        self.refills = 0
+
+    # Calculate the crossings on a date, see horizonCrossingFractions
+    # Returns a tuple of lists (times, types)
+    def dateCrossings(self, aDate):
+        sNoon, crossings = horizonCrossingFractions(self.observer, aDate)
+
+        return ([math.floor(eventEpoch(aDate, fraction, self.clockTZ))
+                 for fraction, eventType in crossings],
+                [eventType for fraction, eventType in crossings])
+
+    # Calculate the crossings on the days around a time
+    # Returns a tuple (window start, window end, times, types)
+    def calculateWindow(self, aroundEpoch):
+        firstDate = localDateAt(aroundEpoch, self.clockTZ) -\
+            datetime.timedelta(days=self.daysBefore)
+        lastDate = firstDate + datetime.timedelta(days=self.daysBefore +
+                                                  self.daysAfter)
+        epochs = []
+        types = []
+        aDate = firstDate
+        while aDate <= lastDate:
+            dateEpochs, dateTypes = self.dateCrossings(aDate)
+            epochs += dateEpochs
+            types += dateTypes
+            aDate += datetime.timedelta(days=1)
+
+        # Across a polar day or night look further for the crossings either
+        # side of the time
+        dayNum = 0
+        while ((len(epochs) == 0) or (epochs[0] > aroundEpoch)) and\
+                (dayNum < self.maxPolarDays):
+            firstDate -= datetime.timedelta(days=1)
+            dateEpochs, dateTypes = self.dateCrossings(firstDate)
+            epochs = dateEpochs + epochs
+            types = dateTypes + types
+            dayNum += 1
+        dayNum = 0
+        while ((len(epochs) == 0) or (epochs[-1] <= aroundEpoch)) and\
+                (dayNum < self.maxPolarDays):
+            lastDate += datetime.timedelta(days=1)
+            dateEpochs, dateTypes = self.dateCrossings(lastDate)
+            epochs += dateEpochs
+            types += dateTypes
+            dayNum += 1
+
+        # Queries are answered from the window from its first crossing until
+        # its last, outside that the crossing before or after could be
+        # outside the window
+        if len(epochs) > 0:
+            windowStart = epochs[0]
+            windowEnd = epochs[-1]
+        else:
+            windowStart = dayStartEpoch(firstDate, self.clockTZ)
+            windowEnd = dayStartEpoch(lastDate, self.clockTZ) + 86400.0
+
+        return (windowStart, windowEnd, epochs, types)
+
+    # Re-fill the window around a time
+    # Returns the new window
+    def refill(self, aroundEpoch):
+        window = self.calculateWindow(aroundEpoch)
+        with self.refillLock:
+            self.window = window
+            self.refills += 1
+        debugMessage("Event index filled with {} crossings".format(
+            len(window[2])))
+
+        return window
+
+    # Extend a window on a thread, it's only used if it wasn't replaced while
+    # this ran
+    def refillThreadEntry(self, oldWindow, aroundEpoch):
+        try:
+            window = self.calculateWindow(aroundEpoch)
+            with self.refillLock:
+                if self.window is oldWindow:
+                    self.window = window
+                    self.refills += 1
+        finally:
+            with self.refillLock:
+                self.refilling = False
+
+    # Get a window that covers a time, re-filling it now if it doesn't and
+    # starting to extend it if the time is near its end
+    # Returns a tuple (window start, window end, times, types)
+    def getWindow(self, epoch):
+        window = self.window
+        if (window is None) or (epoch < window[0]) or (epoch >= window[1]):
+            return self.refill(epoch)
+
+        if epoch > window[1] - self.refillMargin:
+            with self.refillLock:
+                startRefill = not self.refilling
+                self.refilling = True
+            if startRefill:
+                Thread(target=self.refillThreadEntry, args=(window, epoch),
+                       name="QtS Event Index", daemon=True).start()
+
+        return window
+
+    # Get the first crossing after a time (seconds since the epoch)
+    # Returns a tuple (epoch, event type) or None if there's none in the
+    # window
+    def nextCrossing(self, epoch):
+        windowStart, windowEnd, epochs, types = self.getWindow(epoch)
+        index = bisect.bisect_right(epochs, epoch)
+        if index >= len(epochs):
+            return None
+
+        return (epochs[index], types[index])
+
+    # Get the last crossing at or before a time (seconds since the epoch)
+    # Returns a tuple (epoch, event type) or None if there's none in the
+    # window
+    def previousCrossing(self, epoch):
+        windowStart, windowEnd, epochs, types = self.getWindow(epoch)
+        index = bisect.bisect_right(epochs, epoch)
+        if index == 0:
+            return None
+
+        return (epochs[index - 1], types[index - 1])
+
+    # Returns True if the last crossing at or before a time was a sunrise
+    def isDaytime(self, epoch):
+        previous = self.previousCrossing(epoch)
+
+        return (previous is not None) and (previous[1] == EVENT_SUNRISE)
+
+
+# Get what the programs run at a horizon crossing are told about it, the same
+# as QtSsTODMath.getCrossingState but for any observer. scheduled is when the
+# crossing was due and actual when it was handled, seconds since the epoch
+# Returns a dictionary
+def observerCrossingState(observer, eventType, scheduled, actual=None):
+    if actual is None:
+        actual = time.time()
+
+    aDate = localDateAt(scheduled, observer.tz)
+    tomorrow = aDate + datetime.timedelta(days=1)
+    state = {"event": eventType,
+             "scheduled": scheduled,
+             "actual": actual,
+             "latitude": observer.latitude,
+             "longitude": observer.longitude,
+             "timezone": observer.tz,
+             "date": aDate.isoformat(),
+             "sunrise": None,
+             "sunset": None,
+             "tomorrowSunrise": None,
+             "dayLength": None,
+             "lightPeriodFraction": None,
+             "nextCrossing": None}
+
+    aTime = datetime.time(0, 6, 0)
+    state.update(twilightState(observer, aDate, aTime))
+    dayType, sRise, sSet, sNoon, sDur = observer.dayEvents(aDate, aTime)
+    state["dayType"] = dayType
+    state["dayLength"] = (sSet - sRise) * 86400.0
+    tomorrowType, sTomorrow, tSet, tNoon, tDur = observer.dayEvents(tomorrow,
+                                                                    aTime)
+    if dayType == DAY_NORMAL:
+        state["sunrise"] = str(timeFromDayFraction(sRise))
+        state["sunset"] = str(timeFromDayFraction(sSet))
+    if tomorrowType == DAY_NORMAL:
+        state["tomorrowSunrise"] = str(timeFromDayFraction(sTomorrow))
+
+    # The light period this crossing starts, day at sunrise, night at sunset
+    if (dayType == DAY_NORMAL) and (tomorrowType == DAY_NORMAL):
+        if eventType == EVENT_SUNRISE:
+            periodLength = (sSet - sRise) * 86400.0
+        else:
+            periodLength = (1.0 + sTomorrow - sSet) * 86400.0
+        if periodLength > 0.0:
+            state["lightPeriodFraction"] = (actual - scheduled) / periodLength
+
+    nextEvent = nextSolarEvent(observer, scheduled)
+    if nextEvent is not None:
+        state["nextCrossing"] = nextEvent[0] - actual
+
+    return state
+
+
+# Solar horizon crossing event types
+EVENT_SUNRISE = "sunrise"
+EVENT_SUNSET = "sunset"
+EVENT_SOLAR_NOON = "noon"
+
+# Twilight event types, the sun reaching each twilight level's zenith angle
+# in the morning (dawn) and evening (dusk)
+EVENT_CIVIL_DAWN = "civildawn"
+EVENT_CIVIL_DUSK = "civildusk"
+EVENT_NAUTICAL_DAWN = "nauticaldawn"
+EVENT_NAUTICAL_DUSK = "nauticaldusk"
+EVENT_ASTRONOMICAL_DAWN = "astronomicaldawn"
+EVENT_ASTRONOMICAL_DUSK = "astronomicaldusk"
+twilightEventTypes = (EVENT_CIVIL_DAWN, EVENT_CIVIL_DUSK,
+                      EVENT_NAUTICAL_DAWN, EVENT_NAUTICAL_DUSK,
+                      EVENT_ASTRONOMICAL_DAWN, EVENT_ASTRONOMICAL_DUSK)
+
+# The begin and end event types of each QtSsMath.horizonZeniths level
+crossingEventTypes = {"horizon": (EVENT_SUNRISE, EVENT_SUNSET),
+                      "civil": (EVENT_CIVIL_DAWN, EVENT_CIVIL_DUSK),
+                      "nautical": (EVENT_NAUTICAL_DAWN, EVENT_NAUTICAL_DUSK),
+                      "astronomical": (EVENT_ASTRONOMICAL_DAWN,
+                                       EVENT_ASTRONOMICAL_DUSK)}
+
+# The names of the twilight times in the state given to the programs
+twilightStateNames = {EVENT_CIVIL_DAWN: "civilDawn",
+                      EVENT_CIVIL_DUSK: "civilDusk",
+                      EVENT_NAUTICAL_DAWN: "nauticalDawn",
+                      EVENT_NAUTICAL_DUSK: "nauticalDusk",
+                      EVENT_ASTRONOMICAL_DAWN: "astronomicalDawn",
+                      EVENT_ASTRONOMICAL_DUSK: "astronomicalDusk"}
+
+# A name for this module in warning messages
+eventsSrcFrom = "Events"
+
+# Write the events for a location and range of dates as CSV
+if __name__ == "__main__":
+    csvNoon = "--noon" in sys.argv
+    if csvNoon:
+        sys.argv.remove("--noon")
+    csvTwilight = "--twilight" in sys.argv
+    if csvTwilight:
+        sys.argv.remove("--twilight")
+    csvRefine = "--refined" in sys.argv
+    if csvRefine:
+        sys.argv.remove("--refined")
+
+    if len(sys.argv) != 6:
+        errorMessage("Usage: {} [--noon] [--twilight] [--refined] <latitude> "
+                     "<longitude> <timezone> <first-date> <last-date>\n"
+                     "Dates are YYYY-MM-DD".format(sys.argv[0]))
+        sys.exit(1)
+
+    try:
+        csvObserver = SolarObserver(float(sys.argv[1]), float(sys.argv[2]),
+                                    float(sys.argv[3]))
+        csvFirst = datetime.date.fromisoformat(sys.argv[4])
+        csvLast = datetime.date.fromisoformat(sys.argv[5])
+    except ValueError as e:
+        errorMessage("{}".format(e), eventsSrcFrom)
+        sys.exit(1)
+
+    if csvRefine:
+        csvEvaluator = RefinedObserver(csvObserver)
+    else:
+        csvEvaluator = csvObserver
+
+    csvOut = csv.writer(sys.stdout)
+    csvOut.writerow(["time", "event", "latitude", "longitude"])
+    for eventTime, eventType, eventObserver in\
+            iterSolarEvents(csvEvaluator, csvFirst, csvLast, csvNoon,
+                            csvTwilight):
+        csvOut.writerow([eventTime.isoformat(), eventType,
+                         eventObserver.latitude, eventObserver.longitude])
+
+    # How the refinement went, kept out of the CSV
+    if csvRefine:
+        refDays, refMean, refMost, refResidual, refChange =\
+            measureRefinement(csvObserver, csvFirst, csvLast)
+        print("Refined sunrise/sunset on {} days: {:.2f} iterations per day "
+              "(most {}), largest residual {:.3f}s, largest change "
+              "{:.1f}s".format(refDays, refMean, refMost, refResidual,
+                               refChange), file=sys.stderr)
+
+    sys.exit(0)
@@ -0,0 +1,672 @@
+# This Python file uses the following encoding: utf-8
+#
+# Run the sunrise/sunset programs (hooks). Hooks run as asyncio subprocesses
+# on one event loop thread, however many are running at once. Their output is
+# copied to ours line by line as it arrives and a hook running longer than its
+# timeout is terminated, then killed if it doesn't exit.
+#
+# Version: 1.0
+# Copyright (C) 2020/10/19 David A. Mair
+# This file is part of QtSunsetter<https://github.com/mairda/QtSunsetter.git>.
+#
+# QtSunsetter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# QtSunsetter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with QtSunsetter.  If not, see <http://www.gnu.org/licenses/>.
+
+import asyncio
+import concurrent.futures
+import json
+import os
+import re
+import signal
+import subprocess
+import time
+
+from collections import deque
+from threading import Condition, Lock, Thread
+
+from QtSsDebug import debugMessage, warningMessage
+
+
+# What happened when a hook ran
+class HookResult:
+    def __init__(self, args, returnCode, timedOut, killed, duration):
+        self.args = args
+        self.returnCode = returnCode
+        self.timedOut = timedOut
+        self.killed = killed
+        self.duration = duration
+
+    def __repr__(self):
+        return "HookResult({}, returnCode={}, timedOut={}, killed={}, "\
+            "duration={:.3f})".format(self.args, self.returnCode,
+                                      self.timedOut, self.killed,
+                                      self.duration)
+
+
+# Make the environment for a hook from the state of the event it is run for
+# (e.g. from getCrossingState), each value is added as QTS_ and the upper case
+# name, e.g. tomorrowSunrise is QTS_TOMORROW_SUNRISE
+# Returns a dictionary
+def hookEnvironment(state, baseEnv=None):
+    if baseEnv is None:
+        baseEnv = os.environ
+
+    env = dict(baseEnv)
+    for name, value in state.items():
+        envName = "QTS_" + re.sub('([A-Z])', '_\\1', name).upper()
+        if value is None:
+            value = ""
+        env[envName] = str(value)
+
+    return env
+
+
+# Make the standard input for a hook from the state of the event it is run
+# for, one line of JSON
+# Returns bytes
+def hookStdinData(state):
+    return (json.dumps(state) + "\n").encode("utf-8")
+
+
+# Read a line of a hook's output however long it is, a StreamReader's
+# readline raises ValueError and drops what it has read on one longer than
+# its buffer limit
+# Returns bytes, empty at the end of the output
+async def readHookLine(stream):
+    aLine = b""
+    while True:
+        try:
+            return aLine + await stream.readuntil(b"\n")
+        except asyncio.IncompleteReadError as e:
+            return aLine + e.partial
+        except asyncio.LimitOverrunError as e:
+            aLine += await stream.read(e.consumed)
+
+
+# Copy each line of a hook's output as it arrives
+async def streamHookOutput(stream, outputPrefix):
+    while True:
+        aLine = await readHookLine(stream)
+        if not aLine:
+            break
+
+        uText = str(aLine, "utf-8", errors="replace").rstrip("\r\n")
+        print("{}{}".format(outputPrefix, uText), flush=True)
+
+
+# Send a signal to a hook and anything it started
+def signalHook(sproc, sigNum):
+    try:
+        os.killpg(sproc.pid, sigNum)
+    except ProcessLookupError:
+        pass
+
+
+# Run a hook program (args is the program and its arguments) to completion or
+# until timeout seconds have passed. Hooks run in their own process group,
+# one that times out has the group sent SIGTERM and then SIGKILL if it is
+# still running killGrace seconds later. A timeout of None lets the hook run
+# as long as it likes
+# Returns a HookResult object
+async def runHookAsync(args, timeout=None, killGrace=5.0, outputPrefix="<: ",
+                       env=None, stdinData=None):
+    startTime = time.monotonic()
+    if stdinData is not None:
+        stdinPipe = subprocess.PIPE
+    else:
+        stdinPipe = subprocess.DEVNULL
+
+    sproc = await asyncio.create_subprocess_exec(*args,
+                                                 stdin=stdinPipe,
+                                                 stdout=subprocess.PIPE,
+                                                 stderr=subprocess.STDOUT,
+                                                 env=env,
+                                                 start_new_session=True)
+    if stdinData is not None:
+        try:
+            sproc.stdin.write(stdinData)
+            await sproc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            debugMessage("{} didn't read its input".format(args[0]))
+        sproc.stdin.close()
+
+    reader = asyncio.ensure_future(streamHookOutput(sproc.stdout,
+                                                    outputPrefix))
+    timedOut = False
+    killed = False
+    try:
+        await asyncio.wait_for(sproc.wait(), timeout)
+    except asyncio.CancelledError:
+        # Cancelled by a newer run of the same hook, stop this one
+        debugMessage("{} cancelled, terminating".format(args[0]))
+        signalHook(sproc, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(sproc.wait(), killGrace)
+        except asyncio.TimeoutError:
+            signalHook(sproc, signal.SIGKILL)
+        reader.cancel()
+        raise
+    except asyncio.TimeoutError:
+        timedOut = True
+        warningMessage("{} still running after {}s, "
+                       "terminating".format(args[0], timeout), hooksSrcFrom)
+        signalHook(sproc, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(sproc.wait(), killGrace)
+        except asyncio.TimeoutError:
+            warningMessage("{} ignored terminate, killing".format(args[0]),
+                           hooksSrcFrom)
+            signalHook(sproc, signal.SIGKILL)
+            killed = True
+            try:
+                await asyncio.wait_for(sproc.wait(), killGrace)
+            except asyncio.TimeoutError:
+                warningMessage("{} left output open after it was "
+                               "killed".format(args[0]), hooksSrcFrom)
+
+    # The hook has exited, but a child of it could still hold the output open
+    try:
+        await asyncio.wait_for(reader, killGrace)
+    except asyncio.TimeoutError:
+        debugMessage("Gave up reading output of {}".format(args[0]))
+
+    duration = time.monotonic() - startTime
+    result = HookResult(args, sproc.returncode, timedOut, killed, duration)
+    debugMessage("Hook finished: {}".format(result))
+
+    return result
+
+
+# An asyncio event loop on its own thread for running hooks from code that
+# isn't asyncio based, e.g. the Qt GUI or a plain loop
+class HookRunner:
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread(target=self.runLoop, name="QtS Hooks",
+                             daemon=True)
+        self.thread.start()
+
+    def runLoop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    # Start a hook, the arguments are those of runHookAsync
+    # Returns a concurrent.futures.Future for the HookResult
+    def submit(self, args, **kwargs):
+        return asyncio.run_coroutine_threadsafe(runHookAsync(args, **kwargs),
+                                                self.loop)
+
+    # Run a hook, waiting for it to finish
+    # Returns a HookResult object
+    def runHook(self, args, **kwargs):
+        return self.submit(args, **kwargs).result()
+
+
+# The hooks for one event type, the one in flight, those waiting to run and
+# how long past runs took
+class HookSlot:
+    def __init__(self):
+        self.inFlight = None
+        self.startTime = None
+        self.pending = deque()
+        self.durations = deque(maxlen=hookDurationHistory)
+        self.runs = 0
+        self.skipped = 0
+        self.cancelled = 0
+
+
+# Runs hooks for event types (any hashable, e.g. QTS_SUNRISE) keeping track
+# of the one in flight for each. A hook dispatched while one for its event
+# type is still running is handled by a policy:
+#     HOOK_POLICY_SKIP   - don't run the new hook
+#     HOOK_POLICY_QUEUE  - run the new hook when the running one finishes
+#     HOOK_POLICY_CANCEL - stop the running hook and run the new one
+class HookDispatcher:
+    def __init__(self, policy=None, runner=None):
+        if policy is None:
+            policy = HOOK_POLICY_SKIP
+        self.policy = policy
+        self.runner = runner
+        self.slots = {}
+        self.lock = Lock()
+        self.idle = Condition(self.lock)
+
+    def setPolicy(self, newPolicy):
+        if newPolicy in hookPolicies:
+            self.policy = newPolicy
+        else:
+            warningMessage("Unrecognized hook policy: {}".format(newPolicy),
+                           hooksSrcFrom)
+
+    def getPolicy(self):
+        return self.policy
+
+    def getRunner(self):
+        if self.runner is None:
+            self.runner = getHookRunner()
+
+        return self.runner
+
+    def getSlot(self, eventType):
+        slot = self.slots.get(eventType)
+        if slot is None:
+            slot = HookSlot()
+            self.slots[eventType] = slot
+
+        return slot
+
+    # Run a hook for an event type, the other arguments are those of
+    # runHookAsync
+    # Returns a concurrent.futures.Future for the HookResult, or None if the
+    # hook was skipped or queued
+    def dispatch(self, eventType, args, **kwargs):
+        oldFuture = None
+        with self.lock:
+            slot = self.getSlot(eventType)
+            if slot.inFlight is not None:
+                if self.policy == HOOK_POLICY_QUEUE:
+                    slot.pending.append((args, kwargs))
+                    debugMessage("Queued {}, {} waiting".format(
+                        args[0], len(slot.pending)))
+                    return None
+                elif self.policy == HOOK_POLICY_CANCEL:
+                    slot.cancelled += 1
+                    oldFuture = slot.inFlight
+                    slot.inFlight = None
+                else:
+                    slot.skipped += 1
+                    debugMessage("Skipped {}, it's still running".format(
+                        args[0]))
+                    return None
+
+            future = self.startHook(eventType, slot, args, kwargs)
+
+        # Cancelling calls hookDone, which needs the lock
+        if oldFuture is not None:
+            oldFuture.cancel()
+        self.watchHook(eventType, future)
+
+        return future
+
+    # Start a hook in a slot, the lock must be held. Call watchHook with the
+    # future once the lock is released
+    def startHook(self, eventType, slot, args, kwargs):
+        future = self.getRunner().submit(args, **kwargs)
+        slot.inFlight = future
+        slot.startTime = time.monotonic()
+        slot.runs += 1
+
+        return future
+
+    # Call hookDone when a hook's future is done. A hook that has already
+    # finished, e.g. a missing program, calls it straight away in this thread
+    # so the lock must not be held
+    def watchHook(self, eventType, future):
+        future.add_done_callback(lambda f: self.hookDone(eventType, f))
+
+    def hookDone(self, eventType, future):
+        nextFuture = None
+        with self.lock:
+            slot = self.getSlot(eventType)
+            if future.cancelled():
+                debugMessage("Hook for {} cancelled".format(eventType))
+            elif future.exception() is not None:
+                warningMessage("Hook failed: {}".format(future.exception()),
+                               hooksSrcFrom)
+            else:
+                slot.durations.append(future.result().duration)
+
+            # A cancelled hook was already replaced in its slot
+            if slot.inFlight is future:
+                slot.inFlight = None
+                if len(slot.pending) > 0:
+                    args, kwargs = slot.pending.popleft()
+                    nextFuture = self.startHook(eventType, slot, args, kwargs)
+
+            self.idle.notify_all()
+
+        if nextFuture is not None:
+            self.watchHook(eventType, nextFuture)
+
+    # Returns True if a hook for the event type is running
+    def isRunning(self, eventType):
+        with self.lock:
+            return self.getSlot(eventType).inFlight is not None
+
+    # Returns True if a hook for any event type is running
+    def anyRunning(self):
+        with self.lock:
+            for slot in self.slots.values():
+                if slot.inFlight is not None:
+                    return True
+
+        return False
+
+    # Get the number of hooks waiting to run for an event type
+    def queueDepth(self, eventType):
+        with self.lock:
+            return len(self.getSlot(eventType).pending)
+
+    # Get how long recent runs of hooks for an event type took, in seconds
+    # Returns a list of floats, oldest first
+    def getDurations(self, eventType):
+        with self.lock:
+            return list(self.getSlot(eventType).durations)
+
+    # Get counts for an event type
+    # Returns a dictionary
+    def getStats(self, eventType):
+        with self.lock:
+            slot = self.getSlot(eventType)
+            stats = {"running": slot.inFlight is not None,
+                     "queueDepth": len(slot.pending),
+                     "runs": slot.runs,
+                     "skipped": slot.skipped,
+                     "cancelled": slot.cancelled}
+            if slot.inFlight is not None:
+                stats["runningFor"] = time.monotonic() - slot.startTime
+            if len(slot.durations) > 0:
+                stats["lastDuration"] = slot.durations[-1]
+                stats["meanDuration"] = sum(slot.durations) /\
+                    len(slot.durations)
+
+        return stats
+
+    # Wait for every running and queued hook to finish, for no more than
+    # timeout seconds if it isn't None
+    # Returns True if no hooks are running
+    def waitIdle(self, timeout=None):
+        with self.lock:
+            return self.idle.wait_for(
+                lambda: all(slot.inFlight is None
+                            for slot in self.slots.values()), timeout)
+
+
+# A hook program started once and kept running. Each event is sent to it as
+# a line of JSON on its standard input:
+#     {"seq": 1, "event": "sunrise", "time": 1603108800.0}
+# and it acknowledges the event by writing a line of JSON with the same seq:
+#     {"ack": 1}
+# Any other output from the worker is copied to ours. A worker that exits is
+# restarted, waiting longer between restarts while it keeps dying quickly
+class HookWorker:
+    def __init__(self, args, runner=None, ackTimeout=10.0, killGrace=5.0,
+                 outputPrefix="<: ", restartDelay=1.0, maxRestartDelay=60.0):
+        self.args = args
+        self.runner = runner
+        self.ackTimeout = ackTimeout
+        self.killGrace = killGrace
+        self.outputPrefix = outputPrefix
+        self.restartDelay = restartDelay
+        self.maxRestartDelay = maxRestartDelay
+        self.nextRestartDelay = restartDelay
+        self.sproc = None
+        self.startTime = None
+        self.stopping = False
+        self.startLock = None
+        self.seq = 0
+        self.pendingAcks = {}
+        self.ackTimes = deque(maxlen=hookDurationHistory)
+        self.sent = 0
+        self.acked = 0
+        self.ackTimeouts = 0
+        self.restarts = 0
+
+    def getRunner(self):
+        if self.runner is None:
+            self.runner = getHookRunner()
+
+        return self.runner
+
+    # Returns True if the worker process is running
+    def isAlive(self):
+        return (self.sproc is not None) and (self.sproc.returncode is None)
+
+    async def startWorker(self):
+        self.sproc = await asyncio.create_subprocess_exec(
+            *self.args,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            start_new_session=True)
+        self.startTime = time.monotonic()
+        debugMessage("Started hook worker {} as {}".format(self.args[0],
+                                                           self.sproc.pid))
+        asyncio.ensure_future(self.readWorkerOutput(self.sproc))
+        asyncio.ensure_future(self.watchWorker(self.sproc))
+
+    # Copy the worker's output, taking acknowledgements out of it
+    async def readWorkerOutput(self, sproc):
+        while True:
+            aLine = await readHookLine(sproc.stdout)
+            if not aLine:
+                break
+
+            uText = str(aLine, "utf-8", errors="replace").rstrip("\r\n")
+            try:
+                reply = json.loads(uText)
+            except ValueError:
+                reply = None
+
+            # Sequence numbers are ints, any other "ack" is ordinary output
+            if isinstance(reply, dict) and\
+                    isinstance(reply.get("ack"), int):
+                waiting = self.pendingAcks.pop(reply["ack"], None)
+                if (waiting is not None) and (not waiting.done()):
+                    waiting.set_result(reply)
+                continue
+
+            print("{}{}".format(self.outputPrefix, uText), flush=True)
+
+    # Restart the worker when it exits, unless we stopped it
+    async def watchWorker(self, sproc):
+        await sproc.wait()
+
+        # Anything waiting on an acknowledgement won't get one, unless they
+        # were sent to a worker started since this one
+        if sproc is self.sproc:
+            for waiting in self.pendingAcks.values():
+                if not waiting.done():
+                    waiting.set_result(None)
+            self.pendingAcks = {}
+
+        if self.stopping or (sproc is not self.sproc):
+            return
+
+        # A worker that ran for a while gets restarted quickly, one that keeps
+        # dying waits longer each time
+        ranFor = time.monotonic() - self.startTime
+        if ranFor > self.maxRestartDelay:
+            self.nextRestartDelay = self.restartDelay
+        warningMessage("Hook worker {} exited ({}), restarting in "
+                       "{}s".format(self.args[0], sproc.returncode,
+                                    self.nextRestartDelay), hooksSrcFrom)
+        await asyncio.sleep(self.nextRestartDelay)
+        self.nextRestartDelay = min(self.nextRestartDelay * 2.0,
+                                    self.maxRestartDelay)
+
+        # Sending an event may have restarted it while we waited
+        if (not self.stopping) and (sproc is self.sproc):
+            self.restarts += 1
+            await self.startWorker()
+
+    # Start the worker if it isn't running
+    # Returns True if it is running
+    async def startAsync(self):
+        # Created here so it belongs to the runner loop
+        if self.startLock is None:
+            self.startLock = asyncio.Lock()
+
+        # Events sent together while the worker is starting share one start
+        async with self.startLock:
+            if not self.isAlive():
+                if self.sproc is not None:
+                    self.restarts += 1
+                try:
+                    await self.startWorker()
+                except OSError as e:
+                    warningMessage("Can't start hook worker {}: "
+                                   "{}".format(self.args[0], e),
+                                   hooksSrcFrom)
+                    return False
+
+        return True
+
+    # Send an event to the worker, starting it if it isn't running
+    # Returns the seconds it took to acknowledge or None if it didn't
+    async def sendAsync(self, eventType, message=None):
+        if not await self.startAsync():
+            return None
+
+        self.seq += 1
+        seq = self.seq
+        line = {"seq": seq, "event": eventType, "time": time.time()}
+        if message is not None:
+            line.update(message)
+
+        waiting = asyncio.get_event_loop().create_future()
+        self.pendingAcks[seq] = waiting
+        sendTime = time.monotonic()
+        try:
+            self.sproc.stdin.write((json.dumps(line) + "\n").encode("utf-8"))
+            await self.sproc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            warningMessage("Hook worker {} isn't reading "
+                           "events".format(self.args[0]), hooksSrcFrom)
+            self.pendingAcks.pop(seq, None)
+            return None
+        self.sent += 1
+
+        try:
+            reply = await asyncio.wait_for(waiting, self.ackTimeout)
+        except asyncio.TimeoutError:
+            reply = None
+            self.pendingAcks.pop(seq, None)
+            self.ackTimeouts += 1
+            warningMessage("Hook worker {} didn't acknowledge {} {} within "
+                           "{}s".format(self.args[0], eventType, seq,
+                                        self.ackTimeout), hooksSrcFrom)
+            return None
+
+        if reply is None:
+            warningMessage("Hook worker {} exited before acknowledging {} "
+                           "{}".format(self.args[0], eventType, seq),
+                           hooksSrcFrom)
+            return None
+
+        ackTime = time.monotonic() - sendTime
+        self.acked += 1
+        self.ackTimes.append(ackTime)
+        debugMessage("Hook worker {} acknowledged {} {} in "
+                     "{:.3f}s".format(self.args[0], eventType, seq, ackTime))
+
+        return ackTime
+
+    # Stop the worker, closing its input then terminating it and then killing
+    # it if it doesn't exit
+    async def stopAsync(self):
+        self.stopping = True
+        if not self.isAlive():
+            return
+
+        self.sproc.stdin.close()
+        try:
+            await asyncio.wait_for(self.sproc.wait(), self.killGrace)
+            return
+        except asyncio.TimeoutError:
+            pass
+
+        signalHook(self.sproc, signal.SIGTERM)
+        try:
+            await asyncio.wait_for(self.sproc.wait(), self.killGrace)
+        except asyncio.TimeoutError:
+            signalHook(self.sproc, signal.SIGKILL)
+
+    # Start the worker from outside the runner loop, ahead of its first event
+    # so that doesn't wait for it to start
+    # Returns a concurrent.futures.Future for whether it is running
+    def start(self):
+        return asyncio.run_coroutine_threadsafe(self.startAsync(),
+                                                self.getRunner().loop)
+
+    # Send an event from outside the runner loop, the arguments are those of
+    # sendAsync
+    # Returns a concurrent.futures.Future for the acknowledgement time
+    def send(self, eventType, message=None):
+        return asyncio.run_coroutine_threadsafe(
+            self.sendAsync(eventType, message), self.getRunner().loop)
+
+    # Stop the worker from outside the runner loop, waiting for no more than
+    # timeout seconds
+    def stop(self, timeout=None):
+        future = asyncio.run_coroutine_threadsafe(self.stopAsync(),
+                                                  self.getRunner().loop)
+        try:
+            future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            pass
+
+    # Get counts and acknowledgement times
+    # Returns a dictionary
+    def getStats(self):
+        stats = {"alive": self.isAlive(),
+                 "sent": self.sent,
+                 "acked": self.acked,
+                 "ackTimeouts": self.ackTimeouts,
+                 "restarts": self.restarts}
+        if len(self.ackTimes) > 0:
+            stats["lastAck"] = self.ackTimes[-1]
+            stats["meanAck"] = sum(self.ackTimes) / len(self.ackTimes)
+            stats["maxAck"] = max(self.ackTimes)
+
+        return stats
+
+
+# Get the shared hook runner, starting it on first use
+# Returns a HookRunner object
+def getHookRunner():
+    global hookRunner
+
+    with hookRunnerLock:
+        if hookRunner is None:
+            hookRunner = HookRunner()
+
+    return hookRunner
+
+
+# A name for this module in warning messages
+hooksSrcFrom = "Hooks"
+
+# Default longest time a hook can run for, in seconds
+defaultHookTimeout = 300.0
+
+# Policies for a hook dispatched while one for the same event is running
+HOOK_POLICY_SKIP = "skip"
+HOOK_POLICY_QUEUE = "queue"
+HOOK_POLICY_CANCEL = "cancel"
+hookPolicies = (HOOK_POLICY_SKIP, HOOK_POLICY_QUEUE, HOOK_POLICY_CANCEL)
+
+# How many past run durations to keep for each event type
+hookDurationHistory = 32
+
+# How hook programs are run, started for each event or started once and sent
+# each event
+HOOK_MODE_EXEC = "exec"
+HOOK_MODE_WORKER = "worker"
+hookModes = (HOOK_MODE_EXEC, HOOK_MODE_WORKER)
+
+hookRunner = None
+hookRunnerLock = Lock()
+
+# if __name__ == "__main__":
+#     pass
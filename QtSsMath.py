@@ -70,241 +70,628 @@ def timeFromDayFraction(fracOfDay):
 # timeFromDayFraction
 
 
-def JulianDay(aDate, aTime=datetime.time(0, 0, 0)):
-    global HomeTZ
+# All of the NOAA spreadsheet intermediate values for one date, time of day
+# and location, each computed exactly once. The spreadsheet column used for
+# each value is noted in the comment of the formula that computes it. The
+# ha* values are None when the sun doesn't cross the horizon on the date at
+# the latitude (the ACOS argument is outside -1 to 1).
+class SolarState:
+    __slots__ = ("date", "time", "latitude", "longitude", "tz",
+                 "julianDay", "julianCentury", "geomMeanLong", "geomMeanAnom",
+                 "earthOrbitEccent", "eqOfCtr", "trueLong", "trueAnom",
+                 "radVector", "appLong", "meanObliqEcliptic", "obliqCorr",
+                 "rightAscension", "declination", "variance", "eqOfTime",
+                 "haSunriseCos", "haSunrise", "solarNoon", "localSunrise",
+                 "localSunset", "sunlightDuration", "dayType")
+
+    def __init__(self, aDate, aTime, latitude, longitude, tz, jDay=None):
+        self.date = aDate
+        self.time = aTime
+        self.latitude = latitude
+        self.longitude = longitude
+        self.tz = tz
+
+        # A julian day can be supplied in place of the date and time
+        if jDay is None:
+            jDay = refDays(aDate) + 2415018.5 + fracOfLocalDay(aTime) -\
+                tz / 24.0
+            # =D2+2415018.5+E2-$B$5/24
+        self.julianDay = jDay
+
+        jCent = (jDay - 2451545.0) / 36525.0
+        # =(F2-2451545)/36525
+        self.julianCentury = jCent
+
+        mLong = (280.46646 + jCent * (36000.76983 + jCent * 0.0003032)) % 360
+        # =MOD(280.46646+G2*(36000.76983+G2*0.0003032),360)
+        self.geomMeanLong = mLong
+
+        mAnom = 357.52911 + jCent * (35999.05029 - 0.0001537 * jCent)
+        # =357.52911+G2*(35999.05029-0.0001537*G2)
+        self.geomMeanAnom = mAnom
+
+        oEccent = 0.016708634 - jCent * (0.000042037 + 0.0000001267*jCent)
+        # =0.016708634-G2*(0.000042037+0.0000001267*G2)
+        self.earthOrbitEccent = oEccent
+
+        mAnomRad = radians(mAnom)
+        sEqC = sin(mAnomRad)
+        sEqC *= (1.914602 - jCent * (0.004817 + 0.000014 * jCent))
+        sEqC += sin(2 * mAnomRad) * (0.019993 - 0.000101 * jCent)
+        sEqC += sin(3 * mAnomRad) * 0.000289
+        # =SIN(RADIANS(J2))*(1.914602-G2*(0.004817+0.000014*G2))+SIN(RADIANS(2*J2))*(0.019993-0.000101*G2)+SIN(RADIANS(3*J2))*0.000289
+        self.eqOfCtr = sEqC
+
+        tLong = mLong + sEqC
+        # =I2+L2
+        self.trueLong = tLong
+
+        tAnom = mAnom + sEqC
+        # =J2+L2
+        self.trueAnom = tAnom
+
+        rVec = (1.000001018 * (1 - oEccent * oEccent))
+        rVec /= (1 + oEccent * cos(radians(tAnom)))
+        # =(1.000001018*(1-K2*K2))/(1+K2*COS(RADIANS(N2)))
+        self.radVector = rVec
+
+        omegaRad = radians(125.04 - 1934.136 * jCent)
+        aLong = tLong - 0.00569 - 0.00478 * sin(omegaRad)
+        # =M2-0.00569-0.00478*SIN(RADIANS(125.04-1934.136*G2))
+        self.appLong = aLong
+
+        mObEcclip = 23 + (26 + ((21.448 - jCent * (46.815 + jCent * (0.00059 -
+                                jCent * 0.001813)))) / 60) / 60
+        # =23+(26+((21.448-G2*(46.815+G2*(0.00059-G2*0.001813))))/60)/60
+        self.meanObliqEcliptic = mObEcclip
+
+        oCorr = mObEcclip + 0.00256 * cos(omegaRad)
+        # =Q2+0.00256*COS(RADIANS(125.04-1934.136*G2))
+        self.obliqCorr = oCorr
+
+        aLongRad = radians(aLong)
+        oCorrRad = radians(oCorr)
+        self.rightAscension = degrees(atan2(cos(oCorrRad) * sin(aLongRad),
+                                            cos(aLongRad)))
+        # =DEGREES(ATAN2(COS(RADIANS(P2)),COS(RADIANS(R2))*SIN(RADIANS(P2))))
+        # In python math function is atan2(y, x)
+        # In LibreOffice function is atan2(x, y)
+
+        sDec = degrees(asin(sin(oCorrRad) * sin(aLongRad)))
+        # =DEGREES(ASIN(SIN(RADIANS(R2))*SIN(RADIANS(P2))))
+        self.declination = sDec
+
+        sVary = tan(oCorrRad / 2) * tan(oCorrRad / 2)
+        # =TAN(RADIANS(R2/2))*TAN(RADIANS(R2/2))
+        self.variance = sVary
+
+        mLongRad = radians(mLong)
+        eTime = 4 * degrees(sVary * sin(2 * mLongRad) - 2 * oEccent *
+                            sin(mAnomRad) + 4 * oEccent * sVary *
+                            sin(mAnomRad) * cos(2 * mLongRad) - 0.5 *
+                            sVary * sVary * sin(4 * mLongRad) - 1.25 *
+                            oEccent * oEccent * sin(2 * mAnomRad))
+        # =4*DEGREES(U2*SIN(2*RADIANS(I2))-2*K2*SIN(RADIANS(J2))+4*K2*U2*SIN(RADIANS(J2))*COS(2*RADIANS(I2))-0.5*U2*U2*SIN(4*RADIANS(I2))-1.25*K2*K2*SIN(2*RADIANS(J2)))
+        self.eqOfTime = eTime
+
+        sNoon = (720 - 4 * longitude - eTime + tz * 60) / 1440
+        # =(720-4*$B$4-V2+$B$5*60)/1440
+        self.solarNoon = sNoon
+
+        sDecRad = radians(sDec)
+        latRad = radians(latitude)
+        haRiseIn = cos(radians(90.833)) / (cos(latRad) * cos(sDecRad)) -\
+            tan(latRad) * tan(sDecRad)
+        self.haSunriseCos = haRiseIn
+        self.dayType = dayTypeFromCos(haRiseIn)
+        if self.dayType == DAY_NORMAL:
+            haRise = degrees(acos(haRiseIn))
+            # =DEGREES(ACOS(COS(RADIANS(90.833))/(COS(RADIANS($B$3))*COS(RADIANS(T2)))-TAN(RADIANS($B$3))*TAN(RADIANS(T2))))
+            self.haSunrise = haRise
+
+            self.localSunrise = abs(sNoon) - abs(haRise) * 4 / 1440
+            # =X2-W2*4/1440
+            self.localSunset = abs(sNoon) + abs(haRise) * 4 / 1440
+            # =X2+W2*4/1440
+            self.sunlightDuration = 8 * haRise
+            # =8*W2
+        else:
+            self.haSunrise = None
+            self.localSunrise = None
+            self.localSunset = None
+            self.sunlightDuration = None
+
+    # The sun's horizon values are only missing when the ACOS argument is
+    # outside its domain, report that as the math library would have
+    def requireHorizon(self):
+        if self.haSunrise is None:
+            raise ValueError("math domain error")
+
+    # Sunrise, sunset and sunlight duration that are defined on every day. On
+    # polar days they are the polar day sentinels, see polarSentinels
+    # Returns a tuple (dayType, sunrise, sunset, solarNoon, sunlightDuration)
+    def dayEvents(self):
+        if self.dayType == DAY_NORMAL:
+            return (DAY_NORMAL, self.localSunrise, self.localSunset,
+                    self.solarNoon, self.sunlightDuration)
+
+        return polarSentinels(self.dayType, self.solarNoon)
+
+    # The times the sun crosses the horizon and each twilight zenith on this
+    # state's date, from the declination and solar noon already calculated
+    # Returns a dictionary of (begin, end) fractions of the day by level name
+    # in horizonZeniths, or None for a level the sun doesn't cross
+    def horizonCrossings(self):
+        crossings = {}
+        for level, zenith in horizonZeniths:
+            if level == "horizon":
+                haLevel = self.haSunrise
+            else:
+                haLevel = zenithHourAngle(self.latitude, self.declination,
+                                          zenith)
+            if haLevel is None:
+                crossings[level] = None
+            else:
+                crossings[level] = (abs(self.solarNoon) - abs(haLevel) * 4 /
+                                    1440,
+                                    abs(self.solarNoon) + abs(haLevel) * 4 /
+                                    1440)
+
+        return crossings
+# SolarState
+
+
+# Classify a day from the cosine of its sunrise hour angle, outside -1 to 1
+# the sun doesn't cross the horizon: below -1 it stays above it all day, above
+# 1 it stays below
+def dayTypeFromCos(haRiseIn):
+    if haRiseIn < -1.0:
+        return DAY_MIDNIGHT_SUN
+    elif haRiseIn > 1.0:
+        return DAY_POLAR_NIGHT
+
+    return DAY_NORMAL
+# dayTypeFromCos
+
+
+# The values a day without a horizon crossing uses for its sunrise, sunset
+# and sunlight duration. They are those of the hour angle limited to 0 to 180
+# degrees: a midnight sun day "rises" half a day before solar noon and "sets"
+# half a day after with 1440 minutes of sunlight, a polar night day rises and
+# sets at solar noon with none
+# Returns a tuple (dayType, sunrise, sunset, solarNoon, sunlightDuration)
+def polarSentinels(dayType, sNoon):
+    if dayType == DAY_MIDNIGHT_SUN:
+        return (dayType, abs(sNoon) - 0.5, abs(sNoon) + 0.5, sNoon, 1440.0)
+
+    return (dayType, abs(sNoon), abs(sNoon), sNoon, 0.0)
+# polarSentinels
+
+
+# The hour angle (degrees) at which the sun reaches a zenith angle (degrees)
+# at a latitude and solar declination, as HASunrise is for 90.833 degrees
+# Returns None if the sun doesn't reach the zenith angle
+def zenithHourAngle(latitude, declination, zenith):
+    sDecRad = radians(declination)
+    latRad = radians(latitude)
+    haIn = cos(radians(zenith)) / (cos(latRad) * cos(sDecRad)) -\
+        tan(latRad) * tan(sDecRad)
+    if (haIn < -1.0) or (haIn > 1.0):
+        return None
+
+    return degrees(acos(haIn))
+# zenithHourAngle
+
+
+# Get the SolarState for a date and time at the current home location and
+# timezone. The most recent state is kept so that the chain of functions below
+# calling each other for the same arguments only computes it once
+def getSolarState(aDate, aTime=datetime.time(0, 0, 0)):
+    global HomeLat, HomeLong, HomeTZ, lastSolarState
+
+    sState = lastSolarState
+    if (sState is None) or (sState.date != aDate) or\
+            (sState.time != aTime) or (sState.latitude != HomeLat) or\
+            (sState.longitude != HomeLong) or (sState.tz != HomeTZ):
+        sState = SolarState(aDate, aTime, HomeLat, HomeLong, HomeTZ)
+        lastSolarState = sState
+
+    return sState
+# getSolarState
 
-    jDay = refDays(aDate) + 2415018.5 + fracOfLocalDay(aTime) - HomeTZ / 24.0
-    # =D2+2415018.5+E2-$B$5/24
 
-    return jDay
+def JulianDay(aDate, aTime=datetime.time(0, 0, 0)):
+    return getSolarState(aDate, aTime).julianDay
 # JulianDay
 
 
 def JulianCentury(aDate, aTime=datetime.time(0, 0, 0)):
-    jCent = JulianDay(aDate, aTime)
-    jCent -= 2451545.0
-    jCent /= 36525.0
-    # =(F2-2451545)/36525
-
-    return jCent
+    return getSolarState(aDate, aTime).julianCentury
 # JulianCentury
 
 
 def SunGeomMeanLong(aDate, aTime=datetime.time(0, 0, 0)):
-    jCent = JulianCentury(aDate, aTime)
-    mLong = (280.46646 + jCent * (36000.76983 + jCent * 0.0003032)) % 360
-    # =MOD(280.46646+G2*(36000.76983+G2*0.0003032),360)
-
-    return mLong
+    return getSolarState(aDate, aTime).geomMeanLong
 # SunGeomMeanLong
 
 
 def SunGeomMeanAnom(aDate, aTime=datetime.time(0, 0, 0)):
-    jCent = JulianCentury(aDate, aTime)
-    mAnom = 357.52911 + jCent * (35999.05029 - 0.0001537 * jCent)
-    # =357.52911+G2*(35999.05029-0.0001537*G2)
-
-    return mAnom
+    return getSolarState(aDate, aTime).geomMeanAnom
 # SunGeomMeanAnom
 
 
 def SunEqOfCtr(aDate, aTime=datetime.time(0, 0, 0)):
-    jCent = JulianCentury(aDate, aTime)
-    mAnom = SunGeomMeanAnom(aDate, aTime)
-    sEqC = sin(radians(mAnom))
-    sEqC *= (1.914602 - jCent * (0.004817 + 0.000014 * jCent))
-    sEqC += sin(radians(2 * mAnom)) * (0.019993 - 0.000101 * jCent)
-    sEqC += sin(radians(3 * mAnom)) * 0.000289
-    # =SIN(RADIANS(J2))*(1.914602-G2*(0.004817+0.000014*G2))+SIN(RADIANS(2*J2))*(0.019993-0.000101*G2)+SIN(RADIANS(3*J2))*0.000289
-
-    return sEqC
+    return getSolarState(aDate, aTime).eqOfCtr
 # SunEqOfCtr
 
 
 def SunTrueLong(aDate, aTime=datetime.time(0, 0, 0)):
-    tLong = SunGeomMeanLong(aDate, aTime) + SunEqOfCtr(aDate, aTime)
-    # =I2+L2
-
-    return tLong
+    return getSolarState(aDate, aTime).trueLong
 # SunTrueLong
 
 
 def SunTrueAnom(aDate, aTime=datetime.time(0, 0, 0)):
-    tAnom = SunGeomMeanAnom(aDate, aTime) + SunEqOfCtr(aDate, aTime)
-    # =J2+L2
-
-    return tAnom
+    return getSolarState(aDate, aTime).trueAnom
 # SunTrueAnom
 
 
 def SunRadVector(aDate, aTime=datetime.time(0, 0, 0)):
-    oEccent = EarthOrbitEccent(aDate, aTime)
-    tAnom = SunTrueAnom(aDate, aTime)
-    rVec = (1.000001018 * (1 - oEccent * oEccent))
-    rVec /= (1 + oEccent * cos(radians(tAnom)))
-    # =(1.000001018*(1-K2*K2))/(1+K2*COS(RADIANS(N2)))
-
-    return rVec
+    return getSolarState(aDate, aTime).radVector
 # SunRadVector
 
 
 def SunAppLongDegrees(aDate, aTime=datetime.time(0, 0, 0)):
-    jCent = JulianCentury(aDate, aTime)
-    tLong = SunTrueLong(aDate, aTime)
-    aLong = tLong - 0.00569 - 0.00478 * sin(radians(125.04 - 1934.136 * jCent))
-    # =M2-0.00569-0.00478*SIN(RADIANS(125.04-1934.136*G2))
-
-    return aLong
+    return getSolarState(aDate, aTime).appLong
 # SunAppLongDegrees
 
 
 def SunRightAscension(aDate, aTime=datetime.time(0, 0, 0)):
-    aLong = radians(SunAppLongDegrees(aDate, aTime))
-    oCorr = radians(ObliqCorrDegrees(aDate, aTime))
-
-    x = cos(aLong)
-    y = cos(oCorr) * sin(aLong)
-
-    rAscRad = atan2(y, x)
-    rAscDeg = degrees(rAscRad)
-
-    # aLong = 84.61
-    # oCorr = 23.44
-    # rAsc = degrees(atan2(cos(radians(aLong)),
-    #                cos(radians(oCorr)) * sin(radians(aLong))))
-
-    # =DEGREES(ATAN2(COS(RADIANS(P2)),COS(RADIANS(R2))*SIN(RADIANS(P2))))
-    # For atan2:
-    # x is COS(RADIANS(P2))
-    # y is COS(RADIANS(R2))*SIN(RADIANS(P2))
-    # In python math function is atan2(y, x)
-    # In LibreOffice function is atan2(x, y)
-
-    return rAscDeg
+    return getSolarState(aDate, aTime).rightAscension
 # SunRightAscension
 
 
 def SunDeclination(aDate, aTime=datetime.time(0, 0, 0)):
-    aLong = SunAppLongDegrees(aDate, aTime)
-    oCorr = ObliqCorrDegrees(aDate, aTime)
-    sDec = degrees(asin(sin(radians(oCorr)) * sin(radians(aLong))))
-    # =DEGREES(ASIN(SIN(RADIANS(R2))*SIN(RADIANS(P2))))
-
-    return sDec
+    return getSolarState(aDate, aTime).declination
 # SunDeclination
 
 
 def SunVariance(aDate, aTime=datetime.time(0, 0, 0)):
-    oCorr = ObliqCorrDegrees(aDate, aTime)
-    sVar = tan(radians(oCorr / 2)) * tan(radians(oCorr / 2))
-    # =TAN(RADIANS(R2/2))*TAN(RADIANS(R2/2))
-
-    return sVar
+    return getSolarState(aDate, aTime).variance
 # SunVariance
 
 
 def HASunrise(aDate, aTime=datetime.time(0, 0, 0)):
-    global HomeLat
-
-    sDecRad = radians(SunDeclination(aDate, aTime))
-    homeLatRad = radians(HomeLat)
-    haRiseIn = acos(cos(radians(90.833)) / (cos(homeLatRad) *
-                    cos(sDecRad)) - tan(homeLatRad) *
-                    tan(sDecRad))
-    haRise = degrees(haRiseIn)
-    # =DEGREES(ACOS(COS(RADIANS(90.833))/(COS(RADIANS($B$3))*COS(RADIANS(T2)))-TAN(RADIANS($B$3))*TAN(RADIANS(T2))))
+    sState = getSolarState(aDate, aTime)
+    sState.requireHorizon()
 
-    return haRise
+    return sState.haSunrise
 # HASunrise
 
 
 def MeanObliqEcliptic(aDate, aTime=datetime.time(0, 0, 0)):
-    jCent = JulianCentury(aDate, aTime)
-    mObEcclip = 23 + (26 + ((21.448 - jCent * (46.815 + jCent * (0.00059 -
-                            jCent * 0.001813)))) / 60) / 60
-    # =23+(26+((21.448-G2*(46.815+G2*(0.00059-G2*0.001813))))/60)/60
-
-    return mObEcclip
+    return getSolarState(aDate, aTime).meanObliqEcliptic
 # MeanObliqEcliptic
 
 
 def ObliqCorrDegrees(aDate, aTime=datetime.time(0, 0, 0)):
-    jCent = JulianCentury(aDate, aTime)
-    mObEcclip = MeanObliqEcliptic(aDate, aTime)
-    oCorr = mObEcclip + 0.00256 * cos(radians(125.04 - 1934.136 * jCent))
-    # =Q2+0.00256*COS(RADIANS(125.04-1934.136*G2))
-
-    return oCorr
+    return getSolarState(aDate, aTime).obliqCorr
 # ObliqCorrDegrees
 
 
 def EarthOrbitEccent(aDate, aTime=datetime.time(0, 0, 0)):
-    jCent = JulianCentury(aDate, aTime)
-    oEccent = 0.016708634 - jCent * (0.000042037 + 0.0000001267*jCent)
-    # =0.016708634-G2*(0.000042037+0.0000001267*G2)
-
-    return oEccent
+    return getSolarState(aDate, aTime).earthOrbitEccent
 # EarthOrbitEccent
 
 
 # Eq of Time (minutes)
 def eqOfTime(aDate, aTime=datetime.time(0, 0, 0)):
-    mLong = SunGeomMeanLong(aDate, aTime)
-    mAnom = SunGeomMeanAnom(aDate, aTime)
-    oEccent = EarthOrbitEccent(aDate, aTime)
-    sVary = SunVariance(aDate, aTime)
-    # eTime = -1
-    eTime = 4 * degrees(sVary * sin(2 * radians(mLong)) - 2 * oEccent *
-                        sin(radians(mAnom)) + 4 * oEccent * sVary *
-                        sin(radians(mAnom)) * cos(2 * radians(mLong)) - 0.5 *
-                        sVary * sVary * sin(4 * radians(mLong)) - 1.25 *
-                        oEccent * oEccent * sin(2 * radians(mAnom)))
-    # =4*DEGREES(U2*SIN(2*RADIANS(I2))-2*K2*SIN(RADIANS(J2))+4*K2*U2*SIN(RADIANS(J2))*COS(2*RADIANS(I2))-0.5*U2*U2*SIN(4*RADIANS(I2))-1.25*K2*K2*SIN(2*RADIANS(J2)))
-
-    return eTime
+    return getSolarState(aDate, aTime).eqOfTime
 # egOfTime
 
 
 def SolarNoon(aDate, aTime=datetime.time(0, 0, 0)):
-    global HomeLat, HomeLong, HomeTZ
-
-    # rDays = refDays(aDate)
-    eTime = eqOfTime(aDate, aTime)
-    sNoon = (720 - 4 * HomeLong - eTime + HomeTZ * 60) / 1440
-    # =(720-4*$B$4-V2+$B$5*60)/1440
-
-    return sNoon
+    return getSolarState(aDate, aTime).solarNoon
 # SolarNoon
 
 
 def LocalSunrise(aDate, aTime=datetime.time(0, 0, 0)):
-    hRise = abs(HASunrise(aDate, aTime))
-    sNoon = abs(SolarNoon(aDate, aTime))
-    lRise = sNoon - hRise * 4 / 1440
-    # =X2-W2*4/1440
+    sState = getSolarState(aDate, aTime)
+    sState.requireHorizon()
 
-    return lRise
+    return sState.localSunrise
 # LocalSunrise
 
 
 def LocalSunset(aDate, aTime=datetime.time(0, 0, 0)):
-    hRise = abs(HASunrise(aDate, aTime))
-    sNoon = abs(SolarNoon(aDate, aTime))
-    lSet = sNoon + hRise * 4 / 1440
-    # =X2+W2*4/1440
+    sState = getSolarState(aDate, aTime)
+    sState.requireHorizon()
 
-    return lSet
+    return sState.localSunset
 # LocalSunset
 
 
 def SunlightDuration(aDate, aTime=datetime.time(0, 0, 0)):
-    sDur = 8 * HASunrise(aDate, aTime)
-    # =8*W2
+    sState = getSolarState(aDate, aTime)
+    sState.requireHorizon()
 
-    return sDur
+    return sState.sunlightDuration
 # SunlightDuration
 
 
+# A location (latitude, longitude and timezone clock offset in hours) to make
+# solar calculations for. Unlike the module functions above an observer doesn't
+# use or change the HomeLat, HomeLong and HomeTZ globals, so any number of them
+# can be used at once, including from worker threads or processes. Observers
+# don't change after they are created, use a new one for a new location.
+class SolarObserver:
+    __slots__ = ("latitude", "longitude", "tz")
+
+    def __init__(self, latitude, longitude, tz):
+        if (latitude < -90.0) or (latitude > 90.0):
+            raise ValueError("Invalid latitude: {}".format(latitude))
+        if (longitude < -180.0) or (longitude > 180.0):
+            raise ValueError("Invalid longitude: {}".format(longitude))
+
+        self.latitude = latitude
+        self.longitude = longitude
+        self.tz = tz
+
+    def __repr__(self):
+        return "SolarObserver({}, {}, {})".format(self.latitude,
+                                                  self.longitude,
+                                                  self.tz)
+
+    def __eq__(self, other):
+        if not isinstance(other, SolarObserver):
+            return NotImplemented
+
+        return (self.latitude == other.latitude) and\
+            (self.longitude == other.longitude) and (self.tz == other.tz)
+
+    def __hash__(self):
+        return hash((self.latitude, self.longitude, self.tz))
+
+    # Get every NOAA intermediate value for a date and time at this location
+    def solarState(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return SolarState(aDate, aTime, self.latitude, self.longitude, self.tz)
+
+    def solarNoon(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.solarState(aDate, aTime).solarNoon
+
+    def localSunrise(self, aDate, aTime=datetime.time(0, 0, 0)):
+        sState = self.solarState(aDate, aTime)
+        sState.requireHorizon()
+
+        return sState.localSunrise
+
+    def localSunset(self, aDate, aTime=datetime.time(0, 0, 0)):
+        sState = self.solarState(aDate, aTime)
+        sState.requireHorizon()
+
+        return sState.localSunset
+
+    def sunlightDuration(self, aDate, aTime=datetime.time(0, 0, 0)):
+        sState = self.solarState(aDate, aTime)
+        sState.requireHorizon()
+
+        return sState.sunlightDuration
+
+    # Sunrise, sunset and solar noon (fractions of the day) and sunlight
+    # duration (minutes) from one evaluation of the chain
+    # Returns a tuple (sunrise, sunset, solarNoon, sunlightDuration)
+    def solarEvents(self, aDate, aTime=datetime.time(0, 0, 0)):
+        sState = self.solarState(aDate, aTime)
+        sState.requireHorizon()
+
+        return (sState.localSunrise, sState.localSunset, sState.solarNoon,
+                sState.sunlightDuration)
+
+    # Classify the day as DAY_NORMAL, DAY_MIDNIGHT_SUN or DAY_POLAR_NIGHT
+    def dayType(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.solarState(aDate, aTime).dayType
+
+    # Sunrise, sunset, solar noon and sunlight duration without raising
+    # ValueError on days the sun doesn't cross the horizon, see
+    # polarSentinels
+    # Returns a tuple (dayType, sunrise, sunset, solarNoon, sunlightDuration)
+    def dayEvents(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.solarState(aDate, aTime).dayEvents()
+
+    # Solar noon and the sunrise/sunset and twilight crossings from one
+    # evaluation of the chain
+    # Returns a tuple (solarNoon, crossings), see SolarState.horizonCrossings
+    def horizonCrossings(self, aDate, aTime=datetime.time(0, 0, 0)):
+        sState = self.solarState(aDate, aTime)
+
+        return (sState.solarNoon, sState.horizonCrossings())
+# SolarObserver
+
+
+# The same solar calculations as a SolarObserver with each sunrise, sunset and
+# twilight time re-evaluated at the instant it happens. The chain is evaluated
+# at one time of the day, so the declination and equation of time used for an
+# evening event are most of a day old. Each refinement step evaluates the
+# chain once at the latest estimate of the event and takes the event time
+# from it, until a step moves it by no more than tolerance seconds or
+# maxIterations steps have been made. Wraps an observer for its location
+class RefinedObserver:
+    __slots__ = ("observer", "latitude", "longitude", "tz", "maxIterations",
+                 "tolerance")
+
+    def __init__(self, observer, maxIterations=None, tolerance=None):
+        if maxIterations is None:
+            maxIterations = refineMaxIterations
+        if tolerance is None:
+            tolerance = refineTolerance
+
+        self.observer = observer
+        self.latitude = observer.latitude
+        self.longitude = observer.longitude
+        self.tz = observer.tz
+        self.maxIterations = maxIterations
+        self.tolerance = tolerance
+
+    def __repr__(self):
+        return "RefinedObserver({}, {}, {})".format(self.observer,
+                                                    self.maxIterations,
+                                                    self.tolerance)
+
+    def __eq__(self, other):
+        if not isinstance(other, RefinedObserver):
+            return NotImplemented
+
+        return (self.observer == other.observer) and\
+            (self.maxIterations == other.maxIterations) and\
+            (self.tolerance == other.tolerance)
+
+    def __hash__(self):
+        return hash((self.observer, self.maxIterations, self.tolerance))
+
+    # Refine the time the sun reaches a zenith angle (degrees) before (begin)
+    # or after solar noon on a date, starting from an estimate (fraction of
+    # the day). An estimate at which the sun doesn't reach the zenith is kept
+    # Returns a tuple (fraction, iterations, residual), the residual is how
+    # far the last step moved the time in seconds or None without a step
+    def refineCrossing(self, aDate, aTime, zenith, begin, estimate):
+        dateJDay = refDays(aDate) + 2415018.5 - self.tz / 24.0
+        fraction = estimate
+        iterations = 0
+        residual = None
+        while iterations < self.maxIterations:
+            sState = SolarState(aDate, aTime, self.latitude, self.longitude,
+                                self.tz, dateJDay + fraction)
+            haLevel = zenithHourAngle(self.latitude, sState.declination,
+                                      zenith)
+            if haLevel is None:
+                break
+
+            iterations += 1
+            if begin is True:
+                refined = abs(sState.solarNoon) - abs(haLevel) * 4 / 1440
+            else:
+                refined = abs(sState.solarNoon) + abs(haLevel) * 4 / 1440
+            residual = abs(refined - fraction) * 86400.0
+            fraction = refined
+            if residual <= self.tolerance:
+                break
+
+        return (fraction, iterations, residual)
+
+    # Sunrise and sunset refined from the chain at a time of the day with how
+    # the refinement went. Polar days are the unrefined polarSentinels
+    # Returns a tuple (dayType, sunrise, sunset, solarNoon, sunlightDuration,
+    # iterations, residual), the iterations for both events together and the
+    # larger residual (seconds)
+    def refinedDayEvents(self, aDate, aTime=datetime.time(0, 0, 0)):
+        sState = self.observer.solarState(aDate, aTime)
+        if sState.dayType != DAY_NORMAL:
+            return sState.dayEvents() + (0, None)
+
+        zenith = horizonZeniths[0][1]
+        sRise, riseIterations, riseResidual =\
+            self.refineCrossing(aDate, aTime, zenith, True,
+                                sState.localSunrise)
+        sSet, setIterations, setResidual =\
+            self.refineCrossing(aDate, aTime, zenith, False,
+                                sState.localSunset)
+        residuals = [r for r in (riseResidual, setResidual) if r is not None]
+        if len(residuals) > 0:
+            residual = max(residuals)
+        else:
+            residual = None
+
+        return (DAY_NORMAL, sRise, sSet, sState.solarNoon,
+                (sSet - sRise) * 1440, riseIterations + setIterations,
+                residual)
+
+    def solarState(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.observer.solarState(aDate, aTime)
+
+    def solarNoon(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.observer.solarNoon(aDate, aTime)
+
+    def localSunrise(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.solarEvents(aDate, aTime)[0]
+
+    def localSunset(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.solarEvents(aDate, aTime)[1]
+
+    def sunlightDuration(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.solarEvents(aDate, aTime)[3]
+
+    # Returns a tuple (sunrise, sunset, solarNoon, sunlightDuration)
+    def solarEvents(self, aDate, aTime=datetime.time(0, 0, 0)):
+        self.observer.solarState(aDate, aTime).requireHorizon()
+
+        return self.refinedDayEvents(aDate, aTime)[1:5]
+
+    def dayType(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.observer.dayType(aDate, aTime)
+
+    # Returns a tuple (dayType, sunrise, sunset, solarNoon, sunlightDuration)
+    def dayEvents(self, aDate, aTime=datetime.time(0, 0, 0)):
+        return self.refinedDayEvents(aDate, aTime)[:5]
+
+    # Returns a tuple (solarNoon, crossings), see SolarState.horizonCrossings
+    def horizonCrossings(self, aDate, aTime=datetime.time(0, 0, 0)):
+        sNoon, crossings = self.observer.horizonCrossings(aDate, aTime)
+        for level, zenith in horizonZeniths:
+            if crossings[level] is not None:
+                begin, end = crossings[level]
+                crossings[level] = (self.refineCrossing(aDate, aTime, zenith,
+                                                        True, begin)[0],
+                                    self.refineCrossing(aDate, aTime, zenith,
+                                                        False, end)[0])
+
+        return (sNoon, crossings)
+# RefinedObserver
+
+
+# Compare refined sunrise/sunset with the chain at one time of the day on
+# each date from firstDate to lastDate inclusive
+# Returns a tuple (days refined, mean iterations per day, most iterations in a
+# day, largest residual in seconds, largest change in seconds)
+def measureRefinement(observer, firstDate, lastDate,
+                      aTime=datetime.time(0, 6, 0)):
+    refined = RefinedObserver(observer)
+    days = 0
+    totalIterations = 0
+    maxIterations = 0
+    maxResidual = 0.0
+    maxChange = 0.0
+    aDate = firstDate
+    while aDate <= lastDate:
+        sState = observer.solarState(aDate, aTime)
+        dayType, sRise, sSet, sNoon, sDur, iterations, residual =\
+            refined.refinedDayEvents(aDate, aTime)
+        if dayType == DAY_NORMAL:
+            days += 1
+            totalIterations += iterations
+            maxIterations = max(maxIterations, iterations)
+            if residual is not None:
+                maxResidual = max(maxResidual, residual)
+            maxChange = max(maxChange,
+                            abs(sRise - sState.localSunrise) * 86400.0,
+                            abs(sSet - sState.localSunset) * 86400.0)
+        aDate += datetime.timedelta(days=1)
+
+    if days > 0:
+        meanIterations = totalIterations / days
+    else:
+        meanIterations = 0.0
+
+    return (days, meanIterations, maxIterations, maxResidual, maxChange)
+# measureRefinement
+
+
+# Get an observer for the current home location and timezone globals
+def getHomeObserver():
+    global HomeLat, HomeLong, HomeTZ
+
+    return SolarObserver(HomeLat, HomeLong, HomeTZ)
+# getHomeObserver
+
+
 def testFunction(aTime):
     global doDBug, Today
     if doDBug is True:
@@ -444,10 +831,15 @@ def setLongitude(newLon):
         HomeLong = newLon
 
 
-def setSystemTime():
+# Save the system time, a struct_time as time.localtime() returns can be
+# supplied to save one already read
+def setSystemTime(newTime=None):
     global systemTime
 
-    systemTime = time.localtime()
+    if newTime is None:
+        newTime = time.localtime()
+
+    systemTime = newTime
 
 
 def getHomeTZ():
@@ -485,6 +877,23 @@ def SsMathTest():
     return doTest
 
 
+# Kinds of day, whether the sun crosses the horizon
+DAY_NORMAL = "normal"
+DAY_MIDNIGHT_SUN = "midnightsun"
+DAY_POLAR_NIGHT = "polarnight"
+
+# The zenith angles (degrees) of the sun at sunrise/sunset and at the start
+# and end of each twilight, by level name. Sunrise/sunset is the first
+horizonZeniths = (("horizon", 90.833),
+                  ("civil", 96.0),
+                  ("nautical", 102.0),
+                  ("astronomical", 108.0))
+
+# Most refinement steps for each event and the change in seconds that ends
+# the refinement before then, see RefinedObserver
+refineMaxIterations = 4
+refineTolerance = 1.0
+
 # Global state
 doDBug = True
 doTest = False
@@ -494,6 +903,7 @@ HomeLong = -101.766673
 # HomeLat = 55.8
 # HomeLong = -4.5
 Today = datetime.date.today()
+lastSolarState = None
 systemTime = time.localtime()
 HomeTZ = 1.0 * systemTime.tm_gmtoff
 HomeTZ /= 3600.0
@@ -0,0 +1,435 @@
+# This Python file uses the following encoding: utf-8
+#
+# Micro-benchmark of every public QtSsMath and QtSsTODMath function. Each
+# function is called with the arguments a display tick would use, at a fixed
+# date, time and location, and its calls per second measured. How much work
+# one call does is counted as well: the number of NOAA chain evaluations
+# (each computes the julian century once, as JulianCentury does) and calls of
+# the trig primitives (sin, cos, tan, asin, acos, atan, atan2) it makes, both
+# from cold (no saved ephemeris, event index or solar state) and warm (called
+# again at the same time).
+#
+# The results are checked against a threshold file, by default
+# QtSsMathBenchmark.json beside this file, and the run fails if a function
+# makes more chain evaluations or trig calls than its thresholds or manages
+# fewer calls per second. The counts don't depend on the machine, so the
+# shipped file only has those. Write a file from a run, optionally with calls
+# per second thresholds a margin below the measured rates, with
+# --write-thresholds.
+#
+# Usage:
+#     python QtSsMathBenchmark.py [--min-time <seconds>] [--only <name>[,...]]
+#                                 [--thresholds <file.json>]
+#                                 [--write-thresholds <file.json>
+#                                  [--rate-margin <fraction>]]
+#                                 [--output <file.json>]
+#
+# Version: 1.0
+# Copyright (C) 2020/10/19 David A. Mair
+# This file is part of QtSunsetter<https://github.com/mairda/QtSunsetter.git>.
+#
+# QtSunsetter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# QtSunsetter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with QtSunsetter.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import calendar
+import datetime
+import inspect
+import json
+import os
+import time
+
+import QtSsMath
+import QtSsFastMath
+import QtSsTODMath
+
+from QtSsDebug import warningMessage, errorMessage, enableWarnings
+from QtSsMath import SolarObserver, DAY_MIDNIGHT_SUN
+from QtSsTODMath import ClockSnapshot
+
+
+# The fixed date, time and location every function is called for
+class BenchContext:
+    def __init__(self):
+        self.latitude = benchLatitude
+        self.longitude = benchLongitude
+        self.tz = benchTZ
+        self.date = benchDate
+        self.time = datetime.time(0, 6, 0)
+        self.observer = SolarObserver(self.latitude, self.longitude, self.tz)
+
+        # Local noon at the location
+        self.epoch = calendar.timegm(benchDate.timetuple()) +\
+            (12.0 - self.tz) * 3600.0
+        self.clock = ClockSnapshot(self.epoch)
+        self.clockSource = lambda: ClockSnapshot(self.epoch)
+
+    # Make the module state the benchmark's, again after any function that
+    # changed it
+    def apply(self):
+        QtSsMath.setLatitude(self.latitude)
+        QtSsMath.setLongitude(self.longitude)
+        QtSsMath.setHomeTZ(self.tz * 3600.0)
+        QtSsTODMath.setClockSource(self.clockSource)
+        QtSsTODMath.setCorrectForSysTZ(True)
+        QtSsTODMath.setRefineEvents(False)
+        QtSsTODMath.setEventTable(None)
+
+    # Forget everything saved between calls
+    def clearCaches(self):
+        QtSsMath.lastSolarState = None
+        QtSsTODMath.invalidateDayEphemeris()
+        QtSsTODMath.eventIndex = None
+# BenchContext
+
+
+# Count NOAA chain evaluations and trig primitive calls while installed
+class WorkCounter:
+    def __init__(self):
+        self.julianCentury = 0
+        self.trig = 0
+        self.saved = []
+
+    def reset(self):
+        self.julianCentury = 0
+        self.trig = 0
+
+    # Wrap a trig primitive to count its calls
+    def countTrig(self, func):
+        def counted(*args):
+            self.trig += 1
+            return func(*args)
+
+        return counted
+
+    # Replace the chain and the trig primitives in the modules that use them
+    # with counting versions
+    def install(self):
+        counter = self
+        baseState = QtSsMath.SolarState
+
+        class CountedSolarState(baseState):
+            __slots__ = ()
+
+            def __init__(self, *args, **kwargs):
+                counter.julianCentury += 1
+                super().__init__(*args, **kwargs)
+
+        for module in (QtSsMath, QtSsFastMath):
+            if hasattr(module, "SolarState"):
+                self.saved.append((module, "SolarState",
+                                   module.SolarState))
+                module.SolarState = CountedSolarState
+            for name in benchTrigNames:
+                if hasattr(module, name):
+                    func = getattr(module, name)
+                    self.saved.append((module, name, func))
+                    setattr(module, name, self.countTrig(func))
+
+    # Put back everything install replaced
+    def uninstall(self):
+        for module, name, func in reversed(self.saved):
+            setattr(module, name, func)
+        self.saved = []
+# WorkCounter
+
+
+# Get every public function defined in a module
+# Returns a list of (name, function) tuples
+def publicFunctions(module):
+    return [(name, func) for name, func in
+            inspect.getmembers(module, inspect.isfunction)
+            if (func.__module__ == module.__name__) and
+            (not name.startswith("_"))]
+# publicFunctions
+
+
+# Get the arguments to call a function with, from the recipes or from its
+# parameter names
+# Returns a tuple of arguments or None if there's no way to call it
+def benchArguments(name, func, ctx):
+    recipe = benchRecipes.get(name)
+    if recipe is not None:
+        return recipe(ctx)
+
+    params = list(inspect.signature(func).parameters)
+    if len(params) == 0:
+        return ()
+    elif params == ["clock"]:
+        return (ctx.clock,)
+    elif params == ["aDate", "aTime"]:
+        return (ctx.date, ctx.time)
+
+    return None
+# benchArguments
+
+
+# Call a function repeatedly for at least minTime seconds
+# Returns the calls per second
+def measureRate(func, args, minTime):
+    calls = 0
+    batch = 1
+    elapsed = 0.0
+    while elapsed < minTime:
+        startTime = time.perf_counter()
+        for callNum in range(batch):
+            func(*args)
+        elapsed += time.perf_counter() - startTime
+        calls += batch
+        batch *= 2
+
+    return calls / elapsed
+# measureRate
+
+
+# Measure one function
+# Returns a dictionary of its rate and work counts
+def benchFunction(func, args, ctx, counter, minTime):
+    ctx.apply()
+    ctx.clearCaches()
+    counter.install()
+    try:
+        counter.reset()
+        func(*args)
+        ctx.apply()
+        cold = (counter.julianCentury, counter.trig)
+
+        counter.reset()
+        func(*args)
+        ctx.apply()
+        warm = (counter.julianCentury, counter.trig)
+    finally:
+        counter.uninstall()
+
+    # Timed warm, as a display tick calls it
+    rate = measureRate(func, args, minTime)
+    ctx.apply()
+
+    return {"callsPerSecond": rate,
+            "coldJulianCentury": cold[0],
+            "coldTrig": cold[1],
+            "warmJulianCentury": warm[0],
+            "warmTrig": warm[1]}
+# benchFunction
+
+
+# Measure every public function of the modules, or only those named
+# Returns a tuple (results by "module.function", names not measured)
+def runMathBenchmark(minTime=None, only=None):
+    if minTime is None:
+        minTime = benchMinTime
+
+    ctx = BenchContext()
+    counter = WorkCounter()
+    results = {}
+    skipped = []
+    for module in benchModules:
+        for name, func in publicFunctions(module):
+            fullName = "{}.{}".format(module.__name__, name)
+            if (only is not None) and (name not in only) and\
+                    (fullName not in only):
+                continue
+            if name in benchSkipped:
+                skipped.append(fullName)
+                continue
+
+            args = benchArguments(name, func, ctx)
+            if args is None:
+                warningMessage("No arguments known for {}, add it to "
+                               "benchRecipes".format(fullName),
+                               mathBenchSrcFrom)
+                skipped.append(fullName)
+                continue
+
+            results[fullName] = benchFunction(func, args, ctx, counter,
+                                              minTime)
+
+    QtSsTODMath.setClockSource(None)
+
+    return (results, skipped)
+# runMathBenchmark
+
+
+# Compare results with thresholds
+# Returns a list of failure messages, empty if everything is within them
+def checkThresholds(results, thresholds):
+    failures = []
+    for fullName, limits in thresholds.items():
+        measured = results.get(fullName)
+        if measured is None:
+            continue
+
+        for key, limit in limits.items():
+            if key == "callsPerSecond":
+                if measured[key] < limit:
+                    failures.append("{}: {:.0f} calls per second, below "
+                                    "{:.0f}".format(fullName, measured[key],
+                                                    limit))
+            elif measured[key] > limit:
+                failures.append("{}: {} {}, above {}".format(
+                    fullName, measured[key], key, limit))
+
+    return failures
+# checkThresholds
+
+
+# Make thresholds from results, the counts exactly and if a margin is given
+# calls per second that fraction below the measured rate
+# Returns a dictionary of thresholds by "module.function"
+def makeThresholds(results, rateMargin=None):
+    thresholds = {}
+    for fullName, measured in results.items():
+        limits = {key: measured[key] for key in benchCountKeys}
+        if rateMargin is not None:
+            limits["callsPerSecond"] = round(measured["callsPerSecond"] *
+                                             (1.0 - rateMargin))
+        thresholds[fullName] = limits
+
+    return thresholds
+# makeThresholds
+
+
+# Print the results as a table
+def printMathResults(results):
+    print("{:<48} {:>12} {:>12} {:>12}".format("function", "calls/s",
+                                               "cold jc/trig",
+                                               "warm jc/trig"))
+    for fullName, measured in results.items():
+        print("{:<48} {:>12.0f} {:>5}/{:<6} {:>5}/{:<6}".format(
+            fullName, measured["callsPerSecond"],
+            measured["coldJulianCentury"], measured["coldTrig"],
+            measured["warmJulianCentury"], measured["warmTrig"]))
+# printMathResults
+
+
+# A name for this module in warning messages
+mathBenchSrcFrom = "Math Benchmark"
+
+# The modules measured
+benchModules = (QtSsMath, QtSsTODMath)
+
+# Where and when every function is called, a day with both a sunrise and a
+# sunset at the default home location
+benchLatitude = 29.976634
+benchLongitude = -101.766673
+benchTZ = -6.0
+benchDate = datetime.date(2021, 6, 21)
+
+# Shortest time to call each function for when measuring its rate, seconds
+benchMinTime = 0.05
+
+# The trig primitives counted
+benchTrigNames = ("sin", "cos", "tan", "asin", "acos", "atan", "atan2")
+
+# The work counts in the results and thresholds
+benchCountKeys = ("coldJulianCentury", "coldTrig", "warmJulianCentury",
+                  "warmTrig")
+
+# Public functions not measured, with why
+benchSkipped = {"testFunction": "prints every chain value",
+                "measureRefinement": "measures a range of dates itself"}
+
+# Arguments for functions that can't be called from their parameter names,
+# setters are given the benchmark's own values
+benchRecipes = {
+    "crossingSecondFraction": lambda ctx: (0.5,),
+    "dayTypeFromCos": lambda ctx: (0.1,),
+    "fracOfLocalDay": lambda ctx: (ctx.time,),
+    "getAngleDegrees": lambda ctx: (ctx.latitude,),
+    "getAngleMinutes": lambda ctx: (ctx.latitude,),
+    "getAngleSeconds": lambda ctx: (ctx.latitude,),
+    "polarSentinels": lambda ctx: (DAY_MIDNIGHT_SUN, 0.5),
+    "refDays": lambda ctx: (ctx.date,),
+    "setHomeTZ": lambda ctx: (ctx.tz * 3600.0,),
+    "setLatitude": lambda ctx: (ctx.latitude,),
+    "setLongitude": lambda ctx: (ctx.longitude,),
+    "setSystemTime": lambda ctx: (ctx.clock.localTime,),
+    "timeFromDayFraction": lambda ctx: (0.5,),
+    "zenithHourAngle": lambda ctx: (ctx.latitude, 10.0, 96.0),
+    "getCrossingState": lambda ctx: ("sunset", None, ctx.clock),
+    "getNextSolarEvent": lambda ctx: (("civildusk",), ctx.clock),
+    "setClockSource": lambda ctx: (ctx.clockSource,),
+    "setCorrectForSysTZ": lambda ctx: (True,),
+    "setEventTable": lambda ctx: (None,),
+    "setRefineEvents": lambda ctx: (False,)}
+
+# The shipped thresholds
+benchThresholdFile = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  "QtSsMathBenchmark.json")
+
+if __name__ == "__main__":
+    enableWarnings()
+
+    benchOptions = {"--min-time": None, "--only": None,
+                    "--thresholds": benchThresholdFile,
+                    "--write-thresholds": None, "--rate-margin": None,
+                    "--output": None}
+    try:
+        for option in benchOptions:
+            if option in sys.argv:
+                argNum = sys.argv.index(option)
+                benchOptions[option] = sys.argv[argNum + 1]
+                del sys.argv[argNum:argNum + 2]
+        if len(sys.argv) != 1:
+            raise IndexError()
+
+        benchMin = benchOptions["--min-time"]
+        if benchMin is not None:
+            benchMin = float(benchMin)
+        benchMargin = benchOptions["--rate-margin"]
+        if benchMargin is not None:
+            benchMargin = float(benchMargin)
+        benchOnly = benchOptions["--only"]
+        if benchOnly is not None:
+            benchOnly = benchOnly.split(",")
+    except IndexError:
+        errorMessage("Usage: {} [--min-time <seconds>] [--only <name>[,...]] "
+                     "[--thresholds <file.json>] "
+                     "[--write-thresholds <file.json> "
+                     "[--rate-margin <fraction>]] "
+                     "[--output <file.json>]".format(sys.argv[0]))
+        sys.exit(1)
+    except ValueError as e:
+        errorMessage("{}".format(e), mathBenchSrcFrom)
+        sys.exit(1)
+
+    benchResults, benchNotRun = runMathBenchmark(benchMin, benchOnly)
+    printMathResults(benchResults)
+    for fullName in benchNotRun:
+        print("Not measured: {}".format(fullName))
+
+    try:
+        if benchOptions["--output"] is not None:
+            with open(benchOptions["--output"], "w") as outputFile:
+                json.dump(benchResults, outputFile, indent=2)
+
+        if benchOptions["--write-thresholds"] is not None:
+            with open(benchOptions["--write-thresholds"], "w") as outputFile:
+                json.dump(makeThresholds(benchResults, benchMargin),
+                          outputFile, indent=2, sort_keys=True)
+            sys.exit(0)
+
+        with open(benchOptions["--thresholds"], "r") as thresholdFile:
+            benchThresholds = json.load(thresholdFile)
+    except (OSError, ValueError) as e:
+        errorMessage("{}".format(e), mathBenchSrcFrom)
+        sys.exit(1)
+
+    benchFailures = checkThresholds(benchResults, benchThresholds)
+    for failure in benchFailures:
+        errorMessage(failure, mathBenchSrcFrom)
+    if len(benchFailures) > 0:
+        sys.exit(1)
+
+    print("Within the thresholds in {}".format(benchOptions["--thresholds"]))
+    sys.exit(0)
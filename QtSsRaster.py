@@ -0,0 +1,261 @@
+# This Python file uses the following encoding: utf-8
+#
+# Sunrise, sunset and day length over a latitude/longitude grid for a date or
+# range of dates, e.g. to plan camera placement or precompute schedules for
+# new sites. The grid is split into tiles of dates and bands of latitude that
+# are calculated with the QtSsBatchMath functions by a pool of processes, so
+# every core can be used. Each process writes its tiles straight into
+# memory mapped NumPy .npy files, nothing large is passed between processes.
+#
+# Usage:
+#     python QtSsRaster.py [--processes <count>] [--timezone <hours>|solar]
+#                          <resolution> <first-date> [<last-date>]
+#                          <output-directory>
+#
+# Writes to the output directory:
+#     sunrise.npy   - shape (dates, latitudes, longitudes), float32 fractions
+#                     of the day in the timezone, NaN without a sunrise
+#     sunset.npy    - the same for sunset
+#     daylength.npy - the same shape, float32 minutes, 1440 on a midnight sun
+#                     day and 0 on a polar night day
+#     daytype.npy   - the same shape, int8 QtSsBatchMath.BATCH_DAY_NORMAL,
+#                     BATCH_DAY_MIDNIGHT_SUN or BATCH_DAY_POLAR_NIGHT
+#     latitudes.npy, longitudes.npy - the grid cell centres in degrees
+#     dates.npy     - the dates as datetime64[D]
+#
+# The timezone is a fixed offset in hours for every cell (0, UTC, by default)
+# or solar for each cell's longitude / 15 hours.
+#
+# Version: 1.0
+# Copyright (C) 2020/10/19 David A. Mair
+# This file is part of QtSunsetter<https://github.com/mairda/QtSunsetter.git>.
+#
+# QtSunsetter is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# QtSunsetter is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with QtSunsetter.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+import datetime
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from QtSsDebug import debugMessage, errorMessage
+from QtSsBatchMath import batchSolarDays, batchDateRange, BATCH_DAY_NORMAL
+
+
+# The centres of the cells of a grid covering the globe at a resolution in
+# degrees
+# Returns a tuple of arrays (latitudes, longitudes)
+def rasterGrid(resolution):
+    latCount = int(round(180.0 / resolution))
+    longCount = int(round(360.0 / resolution))
+    if (latCount < 1) or (longCount < 1):
+        raise ValueError("Resolution too large: {}".format(resolution))
+
+    lats = -90.0 + resolution * (np.arange(latCount) + 0.5)
+    longs = -180.0 + resolution * (np.arange(longCount) + 0.5)
+
+    return (lats, longs)
+# rasterGrid
+
+
+# Split a raster into tiles of one date and a band of latitude rows
+# Returns a list of (date index, first row, end row) tuples
+def rasterTiles(dateCount, latCount, tileRows):
+    tiles = []
+    for dateIndex in range(dateCount):
+        for firstRow in range(0, latCount, tileRows):
+            tiles.append((dateIndex, firstRow,
+                          min(firstRow + tileRows, latCount)))
+
+    return tiles
+# rasterTiles
+
+
+# The output file names in a raster directory, by result
+def rasterFiles(outDir):
+    return {name: os.path.join(outDir, name + ".npy")
+            for name in rasterResults}
+# rasterFiles
+
+
+# Set up a pool process with what every tile needs
+def initRasterWorker(outDir, dates, lats, longs, tz):
+    global workerState
+
+    workerState = {"outputs": {name: np.load(path, mmap_mode="r+")
+                               for name, path in
+                               rasterFiles(outDir).items()},
+                   "dates": dates,
+                   "lats": lats,
+                   "longs": longs,
+                   "tz": tz}
+# initRasterWorker
+
+
+# Calculate one tile in a pool process and write it to the output files
+# Returns the tile
+def computeRasterTile(tile):
+    dateIndex, firstRow, endRow = tile
+    longs = workerState["longs"]
+    lats = workerState["lats"][firstRow:endRow, np.newaxis]
+    if workerState["tz"] is None:
+        tzs = longs / 15.0
+    else:
+        tzs = workerState["tz"]
+
+    dayType, sRise, sSet, sNoon, dayLength = batchSolarDays(
+        workerState["dates"][dateIndex], lats, longs, tzs, rasterTime)
+
+    # The sun doesn't cross the horizon on polar days and nights, those
+    # cells have no sunrise or sunset
+    normal = (dayType == BATCH_DAY_NORMAL)
+    outputs = workerState["outputs"]
+    outputs["sunrise"][dateIndex, firstRow:endRow] = np.where(normal, sRise,
+                                                              np.nan)
+    outputs["sunset"][dateIndex, firstRow:endRow] = np.where(normal, sSet,
+                                                             np.nan)
+    outputs["daylength"][dateIndex, firstRow:endRow] = dayLength
+    outputs["daytype"][dateIndex, firstRow:endRow] = dayType
+
+    return tile
+# computeRasterTile
+
+
+# Calculate the sunrise, sunset and day length rasters for a range of dates
+# into a directory. tz is the timezone in hours for every cell or None for
+# each cell's solar timezone
+# Returns the shape of the rasters (dates, latitudes, longitudes)
+def writeRaster(outDir, resolution, firstDate, lastDate=None, tz=0.0,
+                processes=None, tileRows=None):
+    if tileRows is None:
+        tileRows = rasterTileRows
+    if lastDate is None:
+        lastDate = firstDate
+    if lastDate < firstDate:
+        raise ValueError("Last date {} is before first date "
+                         "{}".format(lastDate, firstDate))
+
+    lats, longs = rasterGrid(resolution)
+    dates = batchDateRange(firstDate, lastDate)
+    shape = (len(dates), len(lats), len(longs))
+
+    os.makedirs(outDir, exist_ok=True)
+    np.save(os.path.join(outDir, "latitudes.npy"), lats)
+    np.save(os.path.join(outDir, "longitudes.npy"), longs)
+    np.save(os.path.join(outDir, "dates.npy"), dates)
+    for name, path in rasterFiles(outDir).items():
+        output = np.lib.format.open_memmap(path, mode="w+",
+                                           dtype=rasterResults[name],
+                                           shape=shape)
+        output.flush()
+        del output
+
+    tiles = rasterTiles(len(dates), len(lats), tileRows)
+    with multiprocessing.Pool(processes, initRasterWorker,
+                              (outDir, dates, lats, longs, tz)) as pool:
+        for tileNum, tile in enumerate(pool.imap_unordered(computeRasterTile,
+                                                           tiles)):
+            if (tileNum + 1) % 100 == 0:
+                debugMessage("Raster tiles done: {} of "
+                             "{}".format(tileNum + 1, len(tiles)))
+
+        # Let every process exit, unmapping its files, before returning
+        pool.close()
+        pool.join()
+
+    return shape
+# writeRaster
+
+
+# Load a raster directory's results as read only memory mapped arrays
+# Returns a dictionary of arrays by name, including the grid and dates
+def loadRaster(outDir):
+    raster = {name: np.load(path, mmap_mode="r")
+              for name, path in rasterFiles(outDir).items()}
+    for name in ("latitudes", "longitudes", "dates"):
+        raster[name] = np.load(os.path.join(outDir, name + ".npy"))
+
+    return raster
+# loadRaster
+
+
+# A name for this module in warning messages
+rasterSrcFrom = "Raster"
+
+# The results written for each raster and their types
+rasterResults = {"sunrise": np.float32,
+                 "sunset": np.float32,
+                 "daylength": np.float32,
+                 "daytype": np.int8}
+
+# Latitude rows per tile
+rasterTileRows = 16
+
+# The time of day the solar state is calculated at, as for the other events
+rasterTime = datetime.time(0, 6, 0)
+
+# Set in each pool process by initRasterWorker
+workerState = None
+
+if __name__ == "__main__":
+    rasterProcesses = None
+    rasterTZ = 0.0
+    try:
+        if "--processes" in sys.argv:
+            argNum = sys.argv.index("--processes")
+            rasterProcesses = int(sys.argv[argNum + 1])
+            del sys.argv[argNum:argNum + 2]
+        if "--timezone" in sys.argv:
+            argNum = sys.argv.index("--timezone")
+            if sys.argv[argNum + 1] == "solar":
+                rasterTZ = None
+            else:
+                rasterTZ = float(sys.argv[argNum + 1])
+            del sys.argv[argNum:argNum + 2]
+
+        if len(sys.argv) not in (4, 5):
+            raise IndexError()
+
+        rasterResolution = float(sys.argv[1])
+        rasterFirst = datetime.date.fromisoformat(sys.argv[2])
+        if len(sys.argv) == 5:
+            rasterLast = datetime.date.fromisoformat(sys.argv[3])
+        else:
+            rasterLast = None
+    except IndexError:
+        errorMessage("Usage: {} [--processes <count>] "
+                     "[--timezone <hours>|solar] <resolution> <first-date> "
+                     "[<last-date>] <output-directory>\n"
+                     "Dates are YYYY-MM-DD".format(sys.argv[0]))
+        sys.exit(1)
+    except ValueError as e:
+        errorMessage("{}".format(e), rasterSrcFrom)
+        sys.exit(1)
+
+    startTime = time.perf_counter()
+    try:
+        rasterShape = writeRaster(sys.argv[-1], rasterResolution,
+                                  rasterFirst, rasterLast, rasterTZ,
+                                  rasterProcesses)
+    except (OSError, ValueError) as e:
+        errorMessage("{}".format(e), rasterSrcFrom)
+        sys.exit(1)
+
+    print("Wrote {} dates of {} x {} cells to {} in {:.2f}s".format(
+        rasterShape[0], rasterShape[1], rasterShape[2], sys.argv[-1],
+        time.perf_counter() - startTime))
+
+    sys.exit(0)
@@ -29,53 +29,98 @@
 
 import time
 import datetime
+import math
 
-from QtSsMath import LocalSunrise, LocalSunset, getHomeTZ, timeFromDayFraction
+from QtSsMath import getHomeTZ, timeFromDayFraction
+from QtSsMath import getLatitude, getLongitude, getHomeObserver
+from QtSsMath import RefinedObserver
+from QtSsMath import DAY_NORMAL
 
 from QtSsDebug import debugMessage
+from QtSsEvents import EventIndex, nextSolarEvent, twilightState
+from QtSsEvents import EVENT_SUNRISE
 
 
-# Get the current time
-# Returns a daytime type (h:m:s)
-def getTimeNow():
-    systemTime = time.localtime()
+# The system clock read once, so that every calculation made from it agrees on
+# the time even when a second boundary passes while they are made. Supply
+# epoch (seconds, as time.time() returns) to make a snapshot of any other time
+class ClockSnapshot:
+    __slots__ = ("epoch", "localTime", "date", "time", "sysTZ")
 
-    return datetime.time(systemTime[3], systemTime[4], systemTime[5])
+    def __init__(self, epoch=None):
+        if epoch is None:
+            epoch = time.time()
 
+        self.epoch = epoch
+        self.localTime = time.localtime(epoch)
+        self.date = datetime.date(self.localTime.tm_year,
+                                  self.localTime.tm_mon,
+                                  self.localTime.tm_mday)
+        self.time = datetime.time(self.localTime.tm_hour,
+                                  self.localTime.tm_min,
+                                  self.localTime.tm_sec)
 
-# Get the current time and correct from system timezone to a saved timezone
+        # System timezone clock offset in hours
+        self.sysTZ = self.localTime.tm_gmtoff / 3600.0
+
+
+# Read the clock, using any clock source set by setClockSource
+# Returns a ClockSnapshot object
+def takeClockSnapshot():
+    global clockSource
+
+    if clockSource is not None:
+        return clockSource()
+
+    return ClockSnapshot()
+
+
+# Use a supplied clock snapshot or read the clock if there isn't one
+# Returns a ClockSnapshot object
+def useClock(clock=None):
+    if clock is None:
+        return takeClockSnapshot()
+
+    return clock
+
+
+# Replace the system clock with a function returning a ClockSnapshot, e.g. to
+# test or simulate a time. None restores the system clock
+def setClockSource(newSource=None):
+    global clockSource
+
+    clockSource = newSource
+
+
+# Get the current time
 # Returns a daytime type (h:m:s)
-def getTimeNowWithCorrection():
-    global CorrectForSysTZ
+def getTimeNow(clock=None):
+    return useClock(clock).time
 
-    timeNow = getTimeNow()
-    correctHour = timeNow.hour
-    if CorrectForSysTZ is True:
-        systemTime = time.localtime()
-        sysTZ = 1.0 * systemTime.tm_gmtoff
-        sysTZ /= 3600.0
-        usingTZ = getHomeTZ()
 
-        correction = int(usingTZ - sysTZ)
+# Get the current time and correct from system timezone to a saved timezone.
+# This is the time on the clock crossings are timed by (see getClockTZ), at
+# its exact offset, so it agrees with itsDaytime
+# Returns a daytime type (h:m:s)
+def getTimeNowWithCorrection(clock=None):
+    return getClockDateTime(clock).time()
 
-        correctHour += correction
-        while correctHour < 0:
-            correctHour += 24
-        while correctHour > 23:
-            correctHour -= 24
 
-    correctedTime = datetime.time(correctHour,
-                                  timeNow.minute,
-                                  timeNow.second)
-    # debugMessage("UsingTZ: {}, SysTZ: {}, Correction: {}, Hour: {} => {}".format(usingTZ, sysTZ, correction, timeNow.hour, correctHour))
+# Get the clock's time on the clock crossings are timed by, to the start of
+# the clock's current second as the event index is
+# Returns a datetime object
+def getClockDateTime(clock=None):
+    clock = useClock(clock)
 
-    return correctedTime
+    return datetime.datetime(1970, 1, 1) +\
+        datetime.timedelta(seconds=int(clock.epoch) +
+                           round(getClockTZ(clock) * 3600.0))
 
 
 # Get the current time
 # Returns a timedelta object
-def getTimeNowDelta():
-    TimeNow = getTimeNow()
+def getTimeNowDelta(clock=None):
+    TimeNow = getTimeNow(clock)
 
     return datetime.timedelta(hours=TimeNow.hour,
                               minutes=TimeNow.minute,
@@ -84,8 +129,8 @@ def getTimeNowDelta():
 
 # Get the current time and correct from system timezone to a saved timezone
 # Returns a timedelta object
-def getTimeNowDeltaWithCorrection():
-    TimeNow = getTimeNowWithCorrection()
+def getTimeNowDeltaWithCorrection(clock=None):
+    TimeNow = getTimeNowWithCorrection(clock)
 
     return datetime.timedelta(hours=TimeNow.hour,
                               minutes=TimeNow.minute,
@@ -94,8 +139,8 @@ def getTimeNowDeltaWithCorrection():
 
 # Get the current time as a fraction of a 24 hour day
 # Returns a float in the range zero to one inclusive
-def getTimeNowFractionofDay():
-    timeNow = getTimeNowWithCorrection()
+def getTimeNowFractionofDay(clock=None):
+    timeNow = getTimeNowWithCorrection(clock)
     y = timeNow.hour * 3600.0
     y += timeNow.minute * 60.0
     y += timeNow.second
@@ -103,27 +148,102 @@ def getTimeNowFractionofDay():
     return (y / 86400.0)
 
 
+# Today's and tomorrow's sunrise/sunset fractions of the day. They can't change
+# until the date, location or timezone changes, so they are kept until then.
+# On a midnight sun or polar night day they are the QtSsMath.polarSentinels
+class DayEphemeris:
+    __slots__ = ("key", "dayType", "sunrise", "sunset", "tomorrowType",
+                 "tomorrowSunrise")
+
+    def __init__(self, key, today):
+        self.key = key
+
+        aTime = datetime.time(0, 6, 0)
+        observer = getHomeEvaluator()
+        if isinstance(observer, RefinedObserver):
+            self.dayType, self.sunrise, self.sunset, sNoon, sDur, iterations,\
+                residual = observer.refinedDayEvents(today, aTime)
+            if residual is not None:
+                debugMessage("Refined sunrise/sunset for {} in {} "
+                             "iterations, residual {:.3f} "
+                             "seconds".format(today, iterations, residual))
+        else:
+            self.dayType, self.sunrise, self.sunset, sNoon, sDur =\
+                observer.dayEvents(today, aTime)
+
+        tomorrow = today + datetime.timedelta(days=1)
+        self.tomorrowType, self.tomorrowSunrise, sSet, sNoon, sDur =\
+            observer.dayEvents(tomorrow, aTime)
+
+
+# Get the ephemeris for today, re-computing it when the date, location,
+# timezone or whether we correct for the system timezone has changed
+# Returns a DayEphemeris object
+def getDayEphemeris(clock=None):
+    global dayEphemeris, ephemerisHits, ephemerisMisses, CorrectForSysTZ
+
+    today = getClockDateTime(clock).date()
+    key = (today, getLatitude(), getLongitude(), getHomeTZ(), CorrectForSysTZ,
+           RefineEvents)
+    ephemeris = dayEphemeris
+    if (ephemeris is not None) and (ephemeris.key == key):
+        ephemerisHits += 1
+    else:
+        ephemerisMisses += 1
+        ephemeris = DayEphemeris(key, today)
+        dayEphemeris = ephemeris
+
+    return ephemeris
+
+
+# Forget any saved ephemeris, the next use will re-compute it
+def invalidateDayEphemeris():
+    global dayEphemeris
+
+    dayEphemeris = None
+
+
+# Get the number of times the saved ephemeris was used and re-computed
+# Returns a tuple (hits, misses)
+def getEphemerisCacheStats():
+    global ephemerisHits, ephemerisMisses
+
+    return (ephemerisHits, ephemerisMisses)
+
+
+# Restart counting ephemeris hits and misses from zero
+def resetEphemerisCacheStats():
+    global ephemerisHits, ephemerisMisses
+
+    ephemerisHits = 0
+    ephemerisMisses = 0
+
+
+# Get whether the sun crosses the horizon today
+# Returns DAY_NORMAL, DAY_MIDNIGHT_SUN or DAY_POLAR_NIGHT
+def getDayType(clock=None):
+    return getDayEphemeris(clock).dayType
+
+
 # Get today's sunrise time as a fraction of a 24 hour day
 # Returns a float in the range zero to one inclusive
-def getSunriseFractionOfDay():
-    Today = datetime.date.today()
-    aTime = datetime.time(0, 6, 0)
-
-    return LocalSunrise(Today, aTime)
+def getSunriseFractionOfDay(clock=None):
+    return getDayEphemeris(clock).sunrise
 
 
 # Get today's sunrise time
 # Returns a datetime object (h:m:s)
-def getSunriseTime():
-    x = getSunriseFractionOfDay()
+def getSunriseTime(clock=None):
+    # A polar day's sentinel can be outside the day
+    x = getSunriseFractionOfDay(clock) % 1.0
 
     return timeFromDayFraction(x)
 
 
 # Get today's sunrise time
 # Returns a timedelta object
-def getSunriseDelta():
-    sRise = getSunriseTime()
+def getSunriseDelta(clock=None):
+    sRise = getSunriseTime(clock)
 
     return datetime.timedelta(hours=sRise.hour,
                               minutes=sRise.minute,
@@ -132,25 +252,22 @@ def getSunriseDelta():
 
 # Get tomorrow's sunrise time as a fraction of a 24 hour day
 # Returns a float in the range zero to one inclusive
-def getTomorrowSunriseFractionOfDay():
-    Tomorrow = datetime.date.fromtimestamp(86400.0 + time.time())
-    aTime = datetime.time(0, 6, 0)
-
-    return LocalSunrise(Tomorrow, aTime)
+def getTomorrowSunriseFractionOfDay(clock=None):
+    return getDayEphemeris(clock).tomorrowSunrise
 
 
 # Get tomorrow's sunrise time
 # Returns a datetime object (h:m:s)
-def getTomorrowSunriseTime():
-    x = getTomorrowSunriseFractionOfDay()
+def getTomorrowSunriseTime(clock=None):
+    x = getTomorrowSunriseFractionOfDay(clock) % 1.0
 
     return timeFromDayFraction(x)
 
 
 # Get tomorrow's sunrise time
 # Returns a timedelta object
-def getTomorrowSunriseDelta():
-    sRise = getTomorrowSunriseTime()
+def getTomorrowSunriseDelta(clock=None):
+    sRise = getTomorrowSunriseTime(clock)
 
     return datetime.timedelta(hours=sRise.hour,
                               minutes=sRise.minute,
@@ -159,108 +276,158 @@ def getTomorrowSunriseDelta():
 
 # Get today's sunset time as a fraction of a 24 hour day
 # Returns a float in the range zero to one inclusive
-def getSunsetFractionOfDay():
-    Today = datetime.date.today()
-    aTime = datetime.time(0, 6, 0)
-
-    return LocalSunset(Today, aTime)
+def getSunsetFractionOfDay(clock=None):
+    return getDayEphemeris(clock).sunset
 
 
 # Get today's sunset time
 # Returns a datetime object (h:m:s)
-def getSunsetTime():
-    x = getSunsetFractionOfDay()
+def getSunsetTime(clock=None):
+    x = getSunsetFractionOfDay(clock) % 1.0
 
     return timeFromDayFraction(x)
 
 
 # Get today's sunset time
 # Returns a timedelta object
-def getSunsetDelta():
-    sSet = getSunsetTime()
+def getSunsetDelta(clock=None):
+    sSet = getSunsetTime(clock)
 
     return datetime.timedelta(hours=sSet.hour,
                               minutes=sSet.minute,
                               seconds=sSet.second)
 
 
-# Returns true if the time now is in today's daytime
+# Get the clock offset in hours of the clock crossings are timed by, the home
+# timezone when we correct for the system timezone. Without correction the
+# system clock is taken to be the clock at the home location
+def getClockTZ(clock=None):
+    global CorrectForSysTZ
+
+    if CorrectForSysTZ is True:
+        return getHomeTZ()
+
+    return useClock(clock).sysTZ
+
+
+# Get the index of horizon crossings around the clock's time for the home
+# location, re-making it when the location, timezone or whether we correct
+# for the system timezone has changed
+# Returns an EventIndex object
+def getEventIndex(clock=None):
+    global eventIndex
+
+    clock = useClock(clock)
+    clockTZ = getClockTZ(clock)
+
+    evaluator = getHomeEvaluator()
+    index = eventIndex
+    if (index is None) or (index.clockTZ != clockTZ) or\
+            (index.observer != evaluator):
+        index = EventIndex(evaluator, clockTZ)
+        eventIndex = index
+
+    return index
+
+
+# Returns true if the time now is in daytime, after a sunrise with no sunset
+# since
 # Returns a bool
-def itsDaytime():
-    srDelta = getSunriseDelta()
-    ssDelta = getSunsetDelta()
-    nowDelta = getTimeNowDeltaWithCorrection()
+def itsDaytime(clock=None):
+    clock = useClock(clock)
+    crossings = getEventTableCrossings(clock)
+    if crossings is not None:
+        return crossings[0][1] == EVENT_SUNRISE
 
-    return (nowDelta >= srDelta) and (nowDelta < ssDelta)
+    return getEventIndex(clock).isDaytime(int(clock.epoch))
 
 
 # Returns true if the time now is in today's nighttime
 # Returns a bool
-def itsNighttime():
+def itsNighttime(clock=None):
     # Implicitly not daytime
-    return not itsDaytime()
+    return not itsDaytime(clock)
 
 
 # Returns true if it's after sunset but before midnight
 # Returns a bool
-def itsAfterSunsetToday():
-    ssDelta = getSunsetFractionOfDay()
-    nowDelta = getTimeNowFractionofDay()
-    if nowDelta > ssDelta:
+def itsAfterSunsetToday(clock=None):
+    clock = useClock(clock)
+    ssDelta = crossingSecondFraction(getSunsetFractionOfDay(clock))
+    nowDelta = getTimeNowFractionofDay(clock)
+    if nowDelta >= ssDelta:
         return True
 
     return False
 
 
+# Get a crossing's fraction of the day at the start of its second, where
+# itsDaytime and the event index place it
+# Returns a float
+def crossingSecondFraction(fraction):
+    return math.floor(fraction * 86400.0) / 86400.0
+
+
 # Returns the fraction of the day that is daytime
 # Returns a float with value greater than zero and less than one
-def daytimeFractionOfDay():
-    Today = datetime.date.today()
-    aTime = datetime.time(0, 6, 0)
+def daytimeFractionOfDay(clock=None):
+    ephemeris = getDayEphemeris(clock)
 
-    r = LocalSunrise(Today, aTime)
-    s = LocalSunset(Today, aTime)
-
-    return (s - r)
+    return (ephemeris.sunset - ephemeris.sunrise)
 
 
 # Returns the duration of the day (24 hours) that is daytime
 # Returns a datetime object (h:m:s)
-def daytimeDuration():
-    return timeFromDayFraction(daytimeFractionOfDay())
+def daytimeDuration(clock=None):
+    return timeFromDayFraction(daytimeFractionOfDay(clock))
 
 
 # Get the fraction of the day that is nighttime
 # Returns a float with value greater than zero and less than one
 # NB: Returns the amount of night during this day, i.e. before today's sunrise
 # plus after today's sunset. Not a continuous time of night
-def nighttimeFractionOfDay():
-    return (1.0 - daytimeFractionOfDay())
+def nighttimeFractionOfDay(clock=None):
+    return (1.0 - daytimeFractionOfDay(clock))
 
 
 # Returns the duration of the day (24 hours) that is nighttime
 # Returns a datetime object (h:m:s)
 # NB: Returns the amount of night during this day, i.e. before today's sunrise
 # plus after today's sunset. Not a continuous time of night
-def nighttimeDuration():
-    return timeFromDayFraction(nighttimeFractionOfDay())
+def nighttimeDuration(clock=None):
+    return timeFromDayFraction(nighttimeFractionOfDay(clock))
 
 
 # Get the current time as a fraction of the light period it is within
 # e.g. if it's daytime, what fraction of daytime has elapsed at current time
 # Automatically chooses daytime or nighttime
 # Returns a float in the range zero to one
-def getTimeNowFractionOfLightPeriod():
-    srDelta = getSunriseFractionOfDay()
-    ssDelta = getSunsetFractionOfDay()
-    nowDelta = getTimeNowFractionofDay()
-    if itsDaytime():
+def getTimeNowFractionOfLightPeriod(clock=None):
+    clock = useClock(clock)
+
+    # Between an event table's crossings, unless they are either side of a
+    # polar day or night which is a light period a day as calculated below
+    crossings = getEventTableCrossings(clock)
+    if crossings is not None:
+        previous, following = crossings
+        if following[0] - previous[0] <= 86400:
+            return (int(clock.epoch) - previous[0]) /\
+                (following[0] - previous[0])
+
+    srDelta = crossingSecondFraction(getSunriseFractionOfDay(clock))
+    ssDelta = crossingSecondFraction(getSunsetFractionOfDay(clock))
+    nowDelta = getTimeNowFractionofDay(clock)
+    if getDayType(clock) != DAY_NORMAL:
+        # A midnight sun or polar night day is one light period from its
+        # sunrise sentinel, solar midnight or solar noon respectively
+        elapsedFraction = (nowDelta - srDelta) % 1.0
+    elif itsDaytime(clock):
         # Subtract sunrise from now, all as a fraction of ratio of daytime
         elapsedFraction = nowDelta - srDelta
-        elapsedFraction /= daytimeFractionOfDay()
+        elapsedFraction /= daytimeFractionOfDay(clock)
     else:
         # Night crosses midnight, take care
-        if itsAfterSunsetToday():
+        if itsAfterSunsetToday(clock):
             # Evening, subtract sunset
             elapsedFraction = nowDelta - ssDelta
         else:
@@ -268,7 +435,7 @@ def getTimeNowFractionOfLightPeriod():
             elapsedFraction = 1.0 - ssDelta + nowDelta
 
         # As a fraction of nighttime
-        elapsedFraction /= nighttimeFractionOfDay()
+        elapsedFraction /= nighttimeFractionOfDay(clock)
 
     # debugMessage("time now as a fraction of current light period: {}".format(elapsedFraction))
 
@@ -279,40 +446,179 @@ def getTimeNowFractionOfLightPeriod():
 # e.g. if it's daytime, how much of of daytime has elapsed at current time
 # Automatically chooses daytime or nighttime
 # Returns a datetime object (h:m:s)
-def getTimeNowDurationOfLightPeriod():
-    elapsedFraction = getTimeNowFractionOfLightPeriod()
-    if itsDaytime():
-        elapsedFraction *= daytimeFractionOfDay()
+def getTimeNowDurationOfLightPeriod(clock=None):
+    clock = useClock(clock)
+    elapsedFraction = getTimeNowFractionOfLightPeriod(clock)
+    if itsDaytime(clock):
+        elapsedFraction *= daytimeFractionOfDay(clock)
     else:
-        elapsedFraction *= nighttimeFractionOfDay()
+        elapsedFraction *= nighttimeFractionOfDay(clock)
 
     return timeFromDayFraction(elapsedFraction)
 
 
-# Get the remaining time until the next solar crossing of the horizon
+# Use a precomputed event table (a QtSsEventTable.EventTable) to find the
+# horizon crossings around the time instead of calculating them. None stops
+# using one
+def setEventTable(newTable=None):
+    global eventTable
+
+    eventTable = newTable
+
+
+# Get the event table, if there is one for the home location and timezone and
+# its times are the clock's times
+# Returns a QtSsEventTable.EventTable object or None
+def getHomeEventTable(clock=None):
+    global eventTable, CorrectForSysTZ
+
+    clock = useClock(clock)
+    if (eventTable is None) or\
+            (not eventTable.matches(getLatitude(), getLongitude(),
+                                    getHomeTZ())):
+        return None
+
+    # Without correction the clock is taken to be in the home timezone
+    if (CorrectForSysTZ is not True) and (clock.sysTZ != getHomeTZ()):
+        return None
+
+    return eventTable
+
+
+# Get the next horizon crossing from the event table, see getHomeEventTable
+# Returns the crossing time (seconds since the epoch) or None
+def getEventTableCrossing(clock):
+    table = getHomeEventTable(clock)
+    if table is None:
+        return None
+
+    # From the start of the clock's current second, as calculated below
+    event = table.nextEvent(int(clock.epoch))
+    if event is None:
+        return None
+
+    return event[0]
+
+
+# Get the horizon crossings either side of the clock's time from the event
+# table, see getHomeEventTable. Times are from the start of the clock's
+# current second, as the event index's are
+# Returns a tuple ((epoch, event type), (epoch, event type)) of the previous
+# and next crossings, or None if there's no table or it doesn't cover the time
+def getEventTableCrossings(clock):
+    table = getHomeEventTable(clock)
+    if table is None:
+        return None
+
+    nowEpoch = int(clock.epoch)
+    previous = table.previousEvent(nowEpoch)
+    following = table.nextEvent(nowEpoch)
+    if (previous is None) or (following is None):
+        return None
+
+    return (previous, following)
+
+
+# Get the remaining time until the next solar crossing of the horizon, from
+# the start of the clock's current second
 # Returns a timedelta object
-def getTimeToNextHorizonCrossing():
-    nowDelta = getTimeNowDeltaWithCorrection()
-    ssDelta = getSunsetDelta()
-    if itsDaytime():
-        # Daytime, get the remaining fraction of the day until sunset
-        diffTime = ssDelta - nowDelta
-    else:
-        # Nighttime, get the remaining fraction of the day until next sunrise
-        if itsAfterSunsetToday():
-            # After sunset but before midnight we need to combine today and
-            # tomorrow, plus a second because the day ends at 23:59:59
-            srDelta = getTomorrowSunriseDelta()
-            endOfDay = datetime.timedelta(hours=23, minutes=59, seconds=59)
-            plusSecond = datetime.timedelta(hours=0, minutes=0, seconds=1)
-            diffTime = endOfDay - nowDelta + plusSecond
-            diffTime += srDelta
-        else:
-            # After midnight, use time until sunrise today
-            srDelta = getSunriseDelta()
-            diffTime = srDelta - nowDelta
+def getTimeToNextHorizonCrossing(clock=None):
+    clock = useClock(clock)
+    nowEpoch = int(clock.epoch)
+    crossing = getEventTableCrossing(clock)
+    if crossing is None:
+        nextEvent = getEventIndex(clock).nextCrossing(nowEpoch)
+        if nextEvent is None:
+            # As calculating a sunrise or sunset without one reports
+            raise ValueError("math domain error")
+        crossing = nextEvent[0]
+
+    return datetime.timedelta(seconds=crossing - nowEpoch)
+
+
+# Get the first event of one of a list of types (QtSsEvents event types,
+# including twilight) after the clock's time at the home location
+# Returns a tuple (epoch, event type) or None if there isn't one in a year
+def getNextSolarEvent(eventTypes, clock=None):
+    clock = useClock(clock)
+
+    # The home location's local times are placed on the clock's timezone
+    shift = (getHomeTZ() - getClockTZ(clock)) * 3600.0
+    event = nextSolarEvent(getHomeEvaluator(), clock.epoch - shift,
+                           eventTypes=eventTypes)
+    if event is None:
+        return None
+
+    return (event[0] + shift, event[1])
+
+
+# Get what the programs run at a horizon crossing are told about it. The
+# scheduled time is when the crossing was due and the clock's time is when it
+# was handled, both seconds since the epoch
+# Returns a dictionary
+def getCrossingState(eventType, scheduled=None, clock=None):
+    clock = useClock(clock)
+    ephemeris = getDayEphemeris(clock)
+    if scheduled is None:
+        scheduled = clock.epoch
+
+    # Without a crossing today there's no sunrise or sunset to report
+    sunrise = None
+    sunset = None
+    tomorrowSunrise = None
+    if ephemeris.dayType == DAY_NORMAL:
+        sunrise = str(timeFromDayFraction(ephemeris.sunrise))
+        sunset = str(timeFromDayFraction(ephemeris.sunset))
+    if ephemeris.tomorrowType == DAY_NORMAL:
+        tomorrowSunrise = str(timeFromDayFraction(ephemeris.tomorrowSunrise))
+
+    state = {"event": eventType,
+             "scheduled": scheduled,
+             "actual": clock.epoch,
+             "latitude": getLatitude(),
+             "longitude": getLongitude(),
+             "timezone": getHomeTZ(),
+             "date": getClockDateTime(clock).date().isoformat(),
+             "sunrise": sunrise,
+             "sunset": sunset,
+             "tomorrowSunrise": tomorrowSunrise,
+             "dayLength": (ephemeris.sunset - ephemeris.sunrise) * 86400.0,
+             "lightPeriodFraction": getTimeNowFractionOfLightPeriod(clock),
+             "nextCrossing":
+                 getTimeToNextHorizonCrossing(clock).total_seconds(),
+             "dayType": ephemeris.dayType}
+    state.update(twilightState(getHomeEvaluator(),
+                                getClockDateTime(clock).date()))
+
+    return state
+
+
+# Get what to calculate the home location's events with, the home observer or
+# a RefinedObserver of it when refining event times
+def getHomeEvaluator():
+    global RefineEvents
+
+    observer = getHomeObserver()
+    if RefineEvents is True:
+        return RefinedObserver(observer)
+
+    return observer
+
+
+# Store whether to refine event times at the instant of each event, see
+# QtSsMath.RefinedObserver
+def setRefineEvents(newVal=True):
+    global RefineEvents
+
+    RefineEvents = newVal
+
+
+# Get whether event times are refined
+# Returns a bool
+def getRefineEvents():
+    global RefineEvents
 
-    return diffTime
+    return RefineEvents
 
 
 # Store whether we are to correct from system to configured timezone
@@ -332,6 +638,23 @@ def getCorrectForSysTZ():
 
 CorrectForSysTZ = True
 
+# Whether event times are refined at the instant of each event
+RefineEvents = False
+
+# Function returning a ClockSnapshot used in place of the system clock
+clockSource = None
+
+# Saved ephemeris for today and how often it was used or re-computed
+dayEphemeris = None
+ephemerisHits = 0
+ephemerisMisses = 0
+
+# Precomputed horizon crossings, if any
+eventTable = None
+
+# Horizon crossings around the time now for the home location
+eventIndex = None
+
 
 # if __name__ == "__main__":
 #     pass
@@ -41,19 +41,16 @@
 
 import sys
 import os
-import subprocess
 
 from math import sin, cos, atan2, pi, pow, sqrt
 # from math import tan, asin, acos, radians, pi, degrees,
 
-from threading import enumerate, main_thread, Thread
-from time import sleep
 
 from PySide2.QtWidgets import QApplication, QWidget, QPushButton, QDialog
 from PySide2.QtWidgets import QLineEdit, QLabel, QComboBox, QCheckBox
 from PySide2.QtWidgets import QSpinBox, QMessageBox, QFileDialog
 from PySide2.QtWidgets import QGraphicsView, QGraphicsScene
-from PySide2.QtCore import Qt
+from PySide2.QtCore import Qt, QEvent
 from PySide2.QtCore import QFile, QPoint, QObject, QSize, QTimer, SIGNAL, SLOT
 from PySide2.QtCore import QDir, QFileInfo, QCoreApplication
 from PySide2.QtGui import QColor, QPen
@@ -68,8 +65,12 @@ from QtSsLocationDialog import Ui_QtSsLocationDialog
 from QtSsTODMath import getTimeNowWithCorrection, getSunriseTime, getSunsetTime
 from QtSsTODMath import itsDaytime, itsNighttime
 from QtSsTODMath import getCorrectForSysTZ, setCorrectForSysTZ
+from QtSsTODMath import getRefineEvents, setRefineEvents
 from QtSsTODMath import getTimeNowFractionOfLightPeriod
 from QtSsTODMath import getTimeToNextHorizonCrossing
+from QtSsTODMath import takeClockSnapshot, getCrossingState, setEventTable
+from QtSsTODMath import getNextSolarEvent, getDayType
+from QtSsEventTable import loadEventTable
 # from QtSsTODMath import getTimeNowDeltaWithCorrection
 # from QtSsTODMath import getSunriseDelta
 # from QtSsTODMath import daytimeFractionOfDay
@@ -80,19 +81,37 @@ from QtSsMath import getLatitudeDegrees, getLatitudeMinutes, getLatitudeSeconds
 from QtSsMath import getLongitudeDegrees, getLongitudeMinutes
 from QtSsMath import getLongitudeSeconds, getAbsLatitude, getAbsLongitude
 from QtSsMath import setSystemTime, getHomeTZ, setHomeTZ, setLocalTZ
+from QtSsMath import DAY_NORMAL, DAY_MIDNIGHT_SUN, DAY_POLAR_NIGHT
 from QtSsConfig import SunsetterConfig, QTS_SUNRISE, QTS_SUNSET
+from QtSsHooks import HookDispatcher, HookWorker, defaultHookTimeout
+from QtSsHooks import hookEnvironment, hookStdinData
+from QtSsHooks import HOOK_MODE_WORKER
+from QtSsEvents import EVENT_SUNRISE, EVENT_SUNSET, twilightEventTypes
 from QtSsDebug import disableWarnings, enableWarnings, warningsEnabled
 from QtSsDebug import warningMessage
 from QtSsDebug import disableDebug, enableDebug, debugIsEnabled, debugMessage
 
 
 class QtSunsetter(QWidget):
-    # Class variables for child threads on rise/set events
-    sunriseChildName = "QtS Rise"
-    sunsetChildName = "QtS Set"
-    childThreadAny = 0
-    childThreadSunrise = 1
-    childThreadSunset = 2
+    # Milliseconds after a computed solar horizon crossing to fire the
+    # crossing timer, so the clock has passed the crossing second when it does
+    crossingMargin = 50
+    # Seconds the next crossing can move by before the crossing timer is
+    # re-armed, e.g. after a clock step or timezone/location change
+    crossingTolerance = 2.0
+    # Longest time the crossing timer waits before checking the next crossing
+    # again, in seconds. A crossing after a polar day or night can be weeks
+    # away, longer than a QTimer interval can hold
+    crossingMaxWait = 86400.0
+    # Longest time the twilight timer waits before checking the next twilight
+    # event again, in seconds
+    twilightMaxWait = 3600.0
+    # Shown in place of the sunrise and sunset times when there are none
+    polarDayNames = {DAY_MIDNIGHT_SUN: "Midnight sun",
+                     DAY_POLAR_NIGHT: "Polar night"}
+    # Steps of the light period fraction in the sky, ground and run program
+    # color tables, see buildSkyColorTables and getTargetLineEditColor
+    colorSteps = 256
 
     def __init__(self):
         super(QtSunsetter, self).__init__()
@@ -105,6 +124,20 @@ class QtSunsetter(QWidget):
         self.lastHeight = -1.0
         self.lastXObject = -1.0
         self.lastYObject = 256.0
+
+        # The sky view's scene and items, made on first use, see
+        # updateSkyScene
+        self.skyScene = None
+        self.skyItems = None
+        self.skyItemShapes = None
+        self.skyItemColors = None
+        self.buildSkyColorTables()
+
+        # The run program background colors through the light period, made
+        # when the line edit colors are read, and the step shown in each
+        self.runEditColorTables = {}
+        self.runEditMinColor = self.getMinimumRunControlColor()
+        self.runEditIndexes = {QTS_SUNRISE: None, QTS_SUNSET: None}
         self.lastY = 128.0
         # self.yMaxObject = 0.0
         self.yMaxObject = 5.65
@@ -118,10 +151,26 @@ class QtSunsetter(QWidget):
         self.lockAngle = 0.0
 
         self.nextCrossing = None
+        self.hookDispatcher = HookDispatcher()
+        self.hookWorkers = {}
         setLocalTZ()
         self.presetConfig()
         self.loadConfig()
         self.timer = QTimer(self)
+
+        # A single shot timer for the exact time of the next horizon crossing
+        self.crossingDeadline = None
+        self.crossingTimer = QTimer(self)
+        self.crossingTimer.setSingleShot(True)
+        self.crossingTimer.setTimerType(Qt.PreciseTimer)
+        self.crossingTimer.timeout.connect(self.crossingTimerFired)
+
+        # A single shot timer for the next twilight event with a program
+        self.twilightEvent = None
+        self.twilightTimer = QTimer(self)
+        self.twilightTimer.setSingleShot(True)
+        self.twilightTimer.setTimerType(Qt.PreciseTimer)
+        self.twilightTimer.timeout.connect(self.twilightTimerFired)
         self.load_ui()
         if self.getRunLastEventAtLaunch():
             if itsDaytime():
@@ -180,13 +229,20 @@ class QtSunsetter(QWidget):
             QObject.connect(btnChooseRun, SIGNAL('clicked()'),
                             self, SLOT('chooseSetRun()'))
 
+        # Start a worker for a program typed into a run control
+        for crossing in (QTS_SUNRISE, QTS_SUNSET):
+            crossingCtrl = self.getSolarCrossingProgramControl(crossing)
+            if crossingCtrl is not None:
+                crossingCtrl.editingFinished.connect(self.startHookWorkers)
+
         # Create an application icon and not the file as a name
         self.createAppIcon()
         self.setWindowIconText("QtSunsetter")
         self.setWindowTitle("QtSunsetter")
 
         # Start a timer to update the time, it doesn't need to be per-second
-        # in normal use
+        # in normal use. Horizon crossings are handled by the crossing timer
+        # so this only refreshes the display
         self.timer.timeout.connect(self.tick)
         if not debugIsEnabled():
             # Not debugging, and not forcing time progression, just update
@@ -341,15 +397,15 @@ class QtSunsetter(QWidget):
             debugMessage("New position: {}, {}".format(newPos.x(), newPos.y()))
             self.move(newPos.x(), newPos.y())
 
-    # Manage close to delay it while child threads are running
+    # Manage close to delay it while sunrise/sunset programs are running
     def closeEvent(self, event):
-        self.listChildren()
-        while self.haveRunningThreadOfType(self.childThreadSunrise):
+        self.stopHookWorkers()
+        while self.hookDispatcher.isRunning(QTS_SUNRISE):
             print("Waiting for a sunrise program to finish")
-            sleep(15)
-        while self.haveRunningThreadOfType(self.childThreadSunset):
+            self.hookDispatcher.waitIdle(15)
+        while self.hookDispatcher.isRunning(QTS_SUNSET):
             print("Waiting for a sunset program to finish")
-            sleep(15)
+            self.hookDispatcher.waitIdle(15)
         event.accept()
 
     def showLocation(self):
@@ -429,114 +485,131 @@ class QtSunsetter(QWidget):
                 result = True
         return result
 
-    def runEventProgram(self, fileName):
-        if self.isRunnableFile(fileName) is True:
-            sproc = subprocess.Popen([fileName],
-                                     stdout=subprocess.PIPE,
-                                     stderr=subprocess.STDOUT)
-            stdout, stderr = sproc.communicate()
-            if stderr is None:
-                mornInfo = stdout.splitlines()
-                for aLine in mornInfo:
-                    uText = str(aLine, "utf-8")
-                    print("<: {}".format(uText))
+    # The longest time a sunrise/sunset program can run for, in seconds
+    def getHookTimeout(self):
+        if self.hookTimeout is None:
+            return defaultHookTimeout
+
+        return self.hookTimeout
+
+    # Get the sunrise, sunset and twilight programs, those loaded from the
+    # configuration until the window's controls show them
+    def getConfiguredPrograms(self):
+        programs = []
+        for crossing, initRun in ((QTS_SUNRISE, self.initRiseRun),
+                                  (QTS_SUNSET, self.initSetRun)):
+            if self.getSolarCrossingProgramControl(crossing) is not None:
+                programs.append(self.getSolarCrossingProgramText(crossing))
             else:
-                mornErr = stdout.splitlines()
-                for aLine in mornErr:
-                    uText = str(aLine, "utf-8")
-                    print("<: {}".format(uText))
+                programs.append(initRun)
+        programs += list(self.twilightRuns.values())
+
+        return programs
+
+    # Get the running worker for a program, starting it on first use. A
+    # worker for a program no longer configured is stopped
+    def getHookWorker(self, fileName):
+        worker = self.hookWorkers.get(fileName)
+        if worker is None:
+            programs = self.getConfiguredPrograms()
+            for oldName in list(self.hookWorkers.keys()):
+                if oldName not in programs:
+                    self.hookWorkers.pop(oldName).stop(0)
+
+            worker = HookWorker([fileName])
+            self.hookWorkers[fileName] = worker
+
+        return worker
+
+    # In worker mode start a worker for every configured program, so the first
+    # event doesn't wait for one to start, and stop any for programs no
+    # longer configured
+    def startHookWorkers(self):
+        if self.hookMode != HOOK_MODE_WORKER:
+            return
+
+        programs = self.getConfiguredPrograms()
+        for oldName in list(self.hookWorkers.keys()):
+            if oldName not in programs:
+                self.hookWorkers.pop(oldName).stop(0)
+        for fileName in programs:
+            if self.isRunnableFile(fileName) is True:
+                self.getHookWorker(fileName).start()
+
+    def stopHookWorkers(self):
+        for worker in self.hookWorkers.values():
+            worker.stop(15)
+        self.hookWorkers = {}
+
+    # Run the program for a crossing, how one still running from the last
+    # crossing of the same type is handled depends on the dispatcher policy.
+    # In worker mode the program keeps running and is sent each crossing.
+    # The program is given the solar state at the crossing in its environment
+    # and optionally on its standard input, scheduled is when the crossing
+    # was due (seconds since the epoch) if it isn't now
+    def runEventProgram(self, fileName, crossing=QTS_SUNRISE, clock=None,
+                        scheduled=None):
+        if crossing == QTS_SUNRISE:
+            eventType = EVENT_SUNRISE
+        else:
+            eventType = EVENT_SUNSET
+        self.runProgram(fileName, eventType, crossing, clock, scheduled)
 
-    # Threaded versions of the exec'ing of sunrise/sunset programs
+    # Run the program for any event (QtSsEvents type), hookKey is the
+    # dispatcher slot it runs in
+    def runProgram(self, fileName, eventType, hookKey, clock=None,
+                   scheduled=None):
+        if self.isRunnableFile(fileName) is True:
+            state = getCrossingState(eventType, scheduled, clock)
 
-    def reachedSunriseThreadEntry(self):
-        debugMessage("Entered threaded sunrise reached")
-        self.runEventProgram(self.getSolarCrossingProgramText(QTS_SUNRISE))
+            if self.hookMode == HOOK_MODE_WORKER:
+                self.getHookWorker(fileName).send(eventType, state)
+            else:
+                if self.hookStdin is True:
+                    stdinData = hookStdinData(state)
+                else:
+                    stdinData = None
+                self.hookDispatcher.dispatch(hookKey, [fileName],
+                                             timeout=self.getHookTimeout(),
+                                             env=hookEnvironment(state),
+                                             stdinData=stdinData)
+
+    def reachedSunrise(self, clock=None, scheduled=None):
+        self.runEventProgram(self.getSolarCrossingProgramText(QTS_SUNRISE),
+                             QTS_SUNRISE, clock, scheduled)
         self.lastY = 128.0
-        debugMessage("Exiting threaded sunrise reached")
 
-    def reachedSunsetThreadEntry(self):
-        debugMessage("Entered threaded sunset reached")
-        self.runEventProgram(self.getSolarCrossingProgramText(QTS_SUNSET))
+    def reachedSunset(self, clock=None, scheduled=None):
+        self.runEventProgram(self.getSolarCrossingProgramText(QTS_SUNSET),
+                             QTS_SUNSET, clock, scheduled)
         self.lastY = 128.0
-        debugMessage("Exiting threaded sunset reached")
-
-    def listChildren(self):
-        for th in enumerate():
-            if th is main_thread():
-                continue
-            print("We have a thread named: {}".format(th.getName()))
-
-    def threadTypeIs(self, thrdObj, thrdType=childThreadAny):
-        if thrdObj is not None:
-            thrdName = thrdObj.getName()
-            isRise = (thrdName == self.sunriseChildName)
-            isSet = (thrdName == self.sunsetChildName)
-            if (thrdType == self.childThreadSunrise) and isRise:
-                return True
-            if (thrdType == self.childThreadSunset) and isSet:
-                return True
-            if (thrdType == self.childThreadAny) and (isRise or isSet):
-                return True
-
-        return False
-
-    def haveRunningThreadOfType(self, thrdType=childThreadAny):
-        # Look for instances of the child thread
-        hasChildren = False
-        for th in enumerate():
-            if th is main_thread():
-                continue
-            if self.threadTypeIs(th, thrdType) is True:
-                hasChildren = True
-                break
-
-        return hasChildren
-
-    def launchThreadOfType(self, thrdType):
-        # If there is no thread already running
-        if self.haveRunningThreadOfType(self) is False:
-            child = None
-            if thrdType == self.childThreadSunrise:
-                child = Thread(target=self.reachedSunriseThreadEntry,
-                               name=self.sunriseChildName)
-            elif thrdType == self.childThreadSunset:
-                child = Thread(target=self.reachedSunsetThreadEntry,
-                               name=self.sunsetChildName)
-
-            if child is not None:
-                child.start()
-
-    def reachedSunrise(self):
-        # self.lastY = 128.0
-        # self.runEventProgram(self.getSolarCrossingProgramText(QTS_SUNRISE))
-        self.launchThreadOfType(self.childThreadSunrise)
-
-    def reachedSunset(self):
-        # self.lastY = 128.0
-        # self.runEventProgram(self.getSolarCrossingProgramText(QTS_SUNSET))
-        self.launchThreadOfType(self.childThreadSunset)
 
     # Set a supplied time or the current time in the control
-    def showTime(self, newTime):
+    def showTime(self, newTime, clock=None):
         labTimeNow = self.findChild(QLabel, "timeNow")
         if labTimeNow is not None:
             if newTime is None:
-                TimeNow = getTimeNowWithCorrection()
+                TimeNow = getTimeNowWithCorrection(clock)
             else:
                 TimeNow = newTime
             labTimeNow.setText("{}".format(TimeNow))
 
     # Show the sunset or sunrise time
-    def showSolarCrossingTime(self, crossing=QTS_SUNRISE):
+    def showSolarCrossingTime(self, crossing=QTS_SUNRISE, clock=None):
         if crossing == QTS_SUNRISE:
-            theTime = getSunriseTime()
+            theTime = getSunriseTime(clock)
             labCtrl = self.findChild(QLabel, "sunrise")
         elif crossing == QTS_SUNSET:
-            theTime = getSunsetTime()
+            theTime = getSunsetTime(clock)
             labCtrl = self.findChild(QLabel, "sunset")
         else:
             labCtrl = None
 
+        # On a polar day or night there is no time to show
+        dayType = getDayType(clock)
+        if dayType != DAY_NORMAL:
+            theTime = self.polarDayNames[dayType]
+
         if labCtrl is not None:
             labCtrl.setText("{}".format(theTime))
             if crossing == QTS_SUNRISE:
@@ -544,17 +617,21 @@ class QtSunsetter(QWidget):
             elif crossing == QTS_SUNSET:
                 self.shownSSet = theTime
 
+    # Read the run program line edits' background colors from the theme and
+    # make the tables of their faded colors through the light period. The
+    # theme's palette is used, not the line edits' own, as that is changed as
+    # they fade
     def getTargetLineEditColor(self):
         riseRun = self.getSolarCrossingProgramControl(QTS_SUNRISE)
         setRun = self.getSolarCrossingProgramControl(QTS_SUNSET)
         if (riseRun is not None) and (setRun is not None):
-            wPalette = riseRun.palette()
+            wPalette = QApplication.palette(riseRun)
             bgBrush = wPalette.brush(QPalette.Active, QPalette.Base)
             self.actvRiseTgtColor = bgBrush.color()
             bgBrush = wPalette.brush(QPalette.Inactive, QPalette.Base)
             self.inactvRiseTgtColor = bgBrush.color()
 
-            wPalette = setRun.palette()
+            wPalette = QApplication.palette(setRun)
             bgBrush = wPalette.brush(QPalette.Active, QPalette.Base)
             self.actvSetTgtColor = bgBrush.color()
             bgBrush = wPalette.brush(QPalette.Inactive, QPalette.Base)
@@ -565,6 +642,30 @@ class QtSunsetter(QWidget):
             self.actvSetTgtColor = None
             self.inactvSetTgtColor = None
 
+        self.runEditColorTables = {}
+        self.runEditIndexes = {QTS_SUNRISE: None, QTS_SUNSET: None}
+        if (riseRun is not None) and (setRun is not None):
+            minColor = self.runEditMinColor
+            for crossing, actvTgtColor, inactvTgtColor in\
+                    ((QTS_SUNRISE, self.actvRiseTgtColor,
+                      self.inactvRiseTgtColor),
+                     (QTS_SUNSET, self.actvSetTgtColor,
+                      self.inactvSetTgtColor)):
+                self.runEditColorTables[crossing] =\
+                    [(self.getTargetColor(minColor, actvTgtColor, x),
+                      self.getTargetColor(minColor, inactvTgtColor, x))
+                     for x in self.getColorTableFractions()]
+
+    # Re-read the run program colors when the theme changes
+    def changeEvent(self, event):
+        if event.type() in (QEvent.PaletteChange,
+                            QEvent.ApplicationPaletteChange):
+            self.getTargetLineEditColor()
+            self.recolorRunEditBackground(QTS_SUNRISE)
+            self.recolorRunEditBackground(QTS_SUNSET)
+
+        super(QtSunsetter, self).changeEvent(event)
+
     def getMinimumRunControlColor(self):
         minColor = QColor()
         minColor.setNamedColor("darkGray")
@@ -597,70 +698,46 @@ class QtSunsetter(QWidget):
 
         return newColor
 
-    def recolorRunEditBackground(self, rise=QTS_SUNRISE):
-        # Get the line edit (rise or set) and it's default background colors
+    # Fade the run program line edit for the coming crossing through the light
+    # period, by looking its colors up in the tables made by
+    # getTargetLineEditColor. The palette is only written when the color
+    # moves to another step of the table
+    def recolorRunEditBackground(self, rise=QTS_SUNRISE, clock=None):
+        # Get the line edit (rise or set) and it's table of colors
         if rise == QTS_SUNRISE:
-            ctrlRun = self.getSolarCrossingProgramControl(QTS_SUNRISE)
-            actvTgtColor = self.actvRiseTgtColor
-            inactvTgtColor = self.inactvRiseTgtColor
-            lightTime = itsNighttime()
+            crossing = QTS_SUNRISE
+            lightTime = itsNighttime(clock)
         else:
-            ctrlRun = self.getSolarCrossingProgramControl(QTS_SUNSET)
-            actvTgtColor = self.actvSetTgtColor
-            inactvTgtColor = self.inactvSetTgtColor
-            lightTime = itsDaytime()
+            crossing = QTS_SUNSET
+            lightTime = itsDaytime(clock)
+        ctrlRun = self.getSolarCrossingProgramControl(crossing)
+        colorTable = self.runEditColorTables.get(crossing)
 
         # IF there is a control and colors
-        if (ctrlRun is not None) and\
-                (actvTgtColor is not None) and\
-                (inactvTgtColor is not None):
-            # Get the assumed minimum color
-            minColor = self.getMinimumRunControlColor()
-
-            # Get the control palette, active and inactive background brushes
-            # and colors
-            wPalette = ctrlRun.palette()
-            bgBrushActv = wPalette.brush(QPalette.Active, QPalette.Base)
-            bgColorActv = bgBrushActv.color()
-            bgBrushInactv = wPalette.brush(QPalette.Inactive, QPalette.Base)
-            bgColorInactv = bgBrushInactv.color()
-
+        if (ctrlRun is not None) and (colorTable is not None):
             # If we are waiting for the event implied by the value of
             # rise argument
             if lightTime:
-                # Get the fraction of the light period passed
-                x = getTimeNowFractionOfLightPeriod()
-
-                # Use it to get faded colors that fraction between min and max
-                curColorActv = self.getTargetColor(minColor,
-                                                   actvTgtColor,
-                                                   x)
-                curColorInactv = self.getTargetColor(minColor,
-                                                     inactvTgtColor,
-                                                     x)
+                # Use the fraction of the light period passed to get faded
+                # colors that fraction between min and max
+                index = self.getColorIndex(
+                    getTimeNowFractionOfLightPeriod(clock))
+                curColorActv, curColorInactv = colorTable[index]
             else:
                 # Specified control is not the fading one, make it minimum
-                curColorActv = minColor
-                curColorInactv = minColor
-
-            # Assume no palette change
-            newPalette = False
-
-            # If a new active color was created, set the brush and palette
-            if not bgColorActv.__eq__(curColorActv):
-                bgBrushActv.setColor(curColorActv)
-                wPalette.setBrush(QPalette.Active, QPalette.Base, bgBrushActv)
-                newPalette = True
-            # If a new inactive color was created, set the brush and palette
-            if not bgColorInactv.__eq__(curColorInactv):
-                bgBrushInactv.setColor(curColorInactv)
-                wPalette.setBrush(QPalette.Inactive,
-                                  QPalette.Base,
-                                  bgBrushInactv)
-                newPalette = True
-            # If we did change the palette, use it for the control
-            if newPalette is True:
+                index = -1
+                curColorActv = self.runEditMinColor
+                curColorInactv = self.runEditMinColor
+
+            # If the color moved, set the brushes and palette
+            if index != self.runEditIndexes[crossing]:
+                wPalette = ctrlRun.palette()
+                wPalette.setBrush(QPalette.Active, QPalette.Base,
+                                  QBrush(curColorActv))
+                wPalette.setBrush(QPalette.Inactive, QPalette.Base,
+                                  QBrush(curColorInactv))
                 ctrlRun.setPalette(wPalette)
+                self.runEditIndexes[crossing] = index
 
     # Given a number that varies between zero and one, modify it to range from
     # zero to one to zero, peaking when 0.5 is supplied
@@ -677,10 +754,39 @@ class QtSunsetter(QWidget):
     def getTimeRevBounce(self, fromTimeFrac=0.0):
         return (1.0 - self.getTimeBounce(fromTimeFrac))
 
-    def getSkyColor(self, timeFrac=0.0, assumeDaytime=False):
+    # Get the fractions of the light period at each step of a color table
+    def getColorTableFractions(self):
+        return [step / (self.colorSteps - 1.0)
+                for step in range(self.colorSteps)]
+
+    # Get the step of a color table nearest a fraction of the light period
+    def getColorIndex(self, fraction):
+        index = int(round(fraction * (self.colorSteps - 1)))
+
+        return min(max(index, 0), self.colorSteps - 1)
+
+    # Make the tables of the sky and ground colors through the day (True) and
+    # night (False) and the sun and moon colors. These don't depend on the
+    # theme so are made once
+    def buildSkyColorTables(self):
+        self.sunColor = QColor(Qt.yellow)
+        self.moonColor = QColor(Qt.lightGray)
+        fractions = self.getColorTableFractions()
+        self.skyColorTables = {}
+        self.groundColorTables = {}
+        for daytime in (True, False):
+            self.skyColorTables[daytime] = [self.makeSkyColor(x, daytime)
+                                            for x in fractions]
+            self.groundColorTables[daytime] = [self.makeGroundColor(x,
+                                                                    daytime)
+                                               for x in fractions]
+
+    # Calculate the sky color at a fraction of the day or night, a negative
+    # fraction is the default sky color
+    def makeSkyColor(self, timeFrac, daytime):
         tRevBounce = self.getTimeRevBounce(timeFrac)
 
-        if (assumeDaytime is False) and itsNighttime():
+        if daytime is False:
             defaultSky = QColor(0x2A, 0x2A, 0x35)
             if timeFrac >= 0.0:
                 skyNow = defaultSky.lighter(100.0 + (75.0 * tRevBounce))
@@ -695,12 +801,14 @@ class QtSunsetter(QWidget):
 
         return skyNow
 
-    def getGroundColor(self, timeFrac=0.0):
+    # Calculate the ground color at a fraction of the day or night, a
+    # negative fraction is the default ground color
+    def makeGroundColor(self, timeFrac, daytime):
         defaultGround = QColor(0x7C, 0xFC, 0)
         tBounce = self.getTimeBounce(timeFrac)
         tRevBounce = self.getTimeRevBounce(timeFrac)
         if timeFrac >= 0.0:
-            if itsDaytime():
+            if daytime:
                 groundNow = defaultGround.darker(100.0 + (200.0 * tRevBounce))
             else:
                 groundNow = defaultGround.darker(300.0 + (250.0 * tBounce))
@@ -709,6 +817,21 @@ class QtSunsetter(QWidget):
 
         return groundNow
 
+    def getSkyColor(self, timeFrac=0.0, assumeDaytime=False, clock=None):
+        daytime = (assumeDaytime is not False) or not itsNighttime(clock)
+        if timeFrac < 0.0:
+            return self.makeSkyColor(timeFrac, daytime)
+
+        return self.skyColorTables[daytime][self.getColorIndex(timeFrac)]
+
+    def getGroundColor(self, timeFrac=0.0, clock=None):
+        if timeFrac < 0.0:
+            return self.makeGroundColor(timeFrac, True)
+
+        daytime = itsDaytime(clock)
+
+        return self.groundColorTables[daytime][self.getColorIndex(timeFrac)]
+
     # Given ellipse width and height, their product and an angle in radians
     # around the ellipse return the polar length from center to the point on
     # the ellipse at that angle
@@ -718,7 +841,35 @@ class QtSunsetter(QWidget):
 
         return elAB / sqrt(aElem + bElem)
 
-    def drawIconByAngle(self):
+    # Keep the sky, sky object and ground items of the sky view and change
+    # only their geometry and colors as they move, rather than clearing the
+    # scene and making new ones. The items are made the first time and again
+    # if the view is given a new scene. Each of sky, skyObject and ground is
+    # a tuple ((x, y, width, height), QColor)
+    def updateSkyScene(self, scene, sky, skyObject, ground):
+        if (self.skyItems is None) or (self.skyScene is not scene):
+            self.skyScene = scene
+            self.skyItems = (scene.addRect(*sky[0]),
+                             scene.addEllipse(*skyObject[0]),
+                             scene.addRect(*ground[0]))
+            self.skyItemShapes = [sky[0], skyObject[0], ground[0]]
+            self.skyItemColors = [None, None, None]
+
+        for itemNum, (shape, color) in enumerate((sky, skyObject, ground)):
+            item = self.skyItems[itemNum]
+            if shape != self.skyItemShapes[itemNum]:
+                item.setRect(*shape)
+                self.skyItemShapes[itemNum] = shape
+            if color != self.skyItemColors[itemNum]:
+                item.setPen(QPen(color,
+                                 1,
+                                 Qt.SolidLine,
+                                 Qt.SquareCap,
+                                 Qt.BevelJoin))
+                item.setBrush(QBrush(color))
+                self.skyItemColors[itemNum] = color
+
+    def drawIconByAngle(self, clock=None):
         view = self.findChild(QGraphicsView, "dayIcon")
         if view is not None:
             scene = view.scene()
@@ -797,7 +948,7 @@ class QtSunsetter(QWidget):
             # Ranges from 0.0 to 1.0 through the day or night, used to compute
             # an angle for the sky object.
             if self.forceTime is False:
-                t = getTimeNowFractionOfLightPeriod()
+                t = getTimeNowFractionOfLightPeriod(clock)
             else:
                 t = self.savedT + self.forceAmount
                 self.savedT = t
@@ -857,59 +1008,29 @@ class QtSunsetter(QWidget):
                 # debugMessage("Draw new sky object at {}, {}".format(xObject,
                 #                                                     yObject))
 
-                # Compute colors based on fraction of day/night time and get
-                # pen and brush for each
-                groundNow = self.getGroundColor(t)
-                skyNow = self.getSkyColor(t, False)
-                skyPen = QPen(skyNow,
-                              1,
-                              Qt.SolidLine,
-                              Qt.SquareCap,
-                              Qt.BevelJoin)
-                skyBrush = QBrush(skyNow)
-                groundPen = QPen(groundNow,
-                                 1,
-                                 Qt.SolidLine,
-                                 Qt.SquareCap,
-                                 Qt.BevelJoin)
-                groundBrush = QBrush(groundNow)
+                # Compute colors based on fraction of day/night time
+                groundNow = self.getGroundColor(t, clock)
+                skyNow = self.getSkyColor(t, False, clock)
 
-                # Get pen and brush for the object in the sky
-                if itsDaytime():
+                # Get the color for the object in the sky
+                if itsDaytime(clock):
                     # Sun color
-                    objectPen = QPen(Qt.yellow,
-                                     1,
-                                     Qt.SolidLine,
-                                     Qt.SquareCap,
-                                     Qt.BevelJoin)
-                    objectBrush = QBrush(Qt.yellow)
+                    objectNow = self.sunColor
                 else:
                     # Moon color
-                    objectPen = QPen(Qt.lightGray,
-                                     1,
-                                     Qt.SolidLine,
-                                     Qt.SquareCap,
-                                     Qt.BevelJoin)
-                    objectBrush = QBrush(Qt.lightGray)
+                    objectNow = self.moonColor
 
                 # Draw the view (sky, object in the sky and ground)
                 scene.setSceneRect(0.0, 0.0, vSize.width() * 1.0,
                                    vSize.height() * 1.0)
-                scene.clear()
-                scene.addRect(0.0, 0.0, skySize.width(), skySize.height(),
-                              skyPen, skyBrush)
-                scene.addEllipse(xObject,
-                                 yObject,
-                                 objectDiam,
-                                 objectDiam,
-                                 objectPen,
-                                 objectBrush)
-                scene.addRect(0.0,
-                              skySize.height(),
-                              vSize.width(),
-                              vSize.height() - skySize.height(),
-                              groundPen,
-                              groundBrush)
+                self.updateSkyScene(scene,
+                                    ((0.0, 0.0, skySize.width(),
+                                      skySize.height()), skyNow),
+                                    ((xObject, yObject, objectDiam,
+                                      objectDiam), objectNow),
+                                    ((0.0, skySize.height(), vSize.width(),
+                                      vSize.height() - skySize.height()),
+                                     groundNow))
 
                 # Save the position we drew the sky object at so we don't
                 # re-draw in the same place
@@ -919,9 +1040,9 @@ class QtSunsetter(QWidget):
                 view.show()
 
     # Returns true if we are passing sunrise/sunset
-    def setNextHorizonCrossingText(self):
+    def setNextHorizonCrossingText(self, clock=None):
         crossed = False
-        if itsDaytime():
+        if itsDaytime(clock):
             if self.nextCrossing is None:
                 self.nextCrossing = "sunset"
             elif self.nextCrossing == "sunrise":
@@ -943,21 +1064,115 @@ class QtSunsetter(QWidget):
         if (self.nextCrossing != "sunrise") and\
                 (self.nextCrossing != "sunset"):
             warningMessage("Unrecognized horizon crossing detected: {}".format(self.nextCrossing))
-            if itsDaytime():
+            if itsDaytime(clock):
                 self.nextCrossing = "sunset"
             else:
                 self.nextCrossing = "sunrise"
 
         return crossed
 
+    # Start the crossing timer to fire at the next solar horizon crossing,
+    # waiting no more than crossingMaxWait before it fires early and is re-armed
+    def armCrossingTimer(self, clock=None, diffTime=None):
+        if clock is None:
+            clock = takeClockSnapshot()
+        if diffTime is None:
+            diffTime = getTimeToNextHorizonCrossing(clock)
+
+        # The remaining time is from the start of the clock's current second
+        remaining = diffTime.total_seconds() - (clock.epoch % 1.0)
+        if remaining < 0.0:
+            remaining = 0.0
+
+        self.crossingDeadline = clock.epoch + remaining
+        self.crossingTimer.start(int(min(remaining, self.crossingMaxWait) *
+                                     1000.0) + self.crossingMargin)
+
+    # Re-arm the crossing timer if it isn't running or the next crossing has
+    # moved since it was armed
+    def checkCrossingTimer(self, clock, diffTime):
+        deadline = clock.epoch + diffTime.total_seconds() - (clock.epoch % 1.0)
+        if (not self.crossingTimer.isActive()) or\
+                (self.crossingDeadline is None) or\
+                (abs(deadline - self.crossingDeadline) >
+                 self.crossingTolerance):
+            self.armCrossingTimer(clock, diffTime)
+
+    def crossingTimerFired(self):
+        clock = takeClockSnapshot()
+        setSystemTime(clock.localTime)
+
+        # Adjust our sense of which horizon crossing is next, if we have
+        # just made a crossing
+        if self.setNextHorizonCrossingText(clock):
+            # Crossing made, run the target program for it
+            if self.nextCrossing == "sunset":
+                self.reachedSunrise(clock, self.crossingDeadline)
+            elif self.nextCrossing == "sunrise":
+                self.reachedSunset(clock, self.crossingDeadline)
+
+        # Wait for the crossing after this one, or the one we haven't yet
+        # reached if the timer fired early
+        self.armCrossingTimer(clock)
+
+        # Show the new state now rather than at the next display refresh
+        self.tick()
+
+    # Start the twilight timer for the next twilight event that has a
+    # program, waiting no more than twilightMaxWait before checking again
+    def armTwilightTimer(self, clock=None):
+        if clock is None:
+            clock = takeClockSnapshot()
+
+        self.twilightEvent = None
+        self.twilightTimer.stop()
+        if len(self.twilightRuns) == 0:
+            return
+
+        event = getNextSolarEvent(tuple(self.twilightRuns.keys()), clock)
+        if event is None:
+            return
+
+        self.twilightEvent = event
+        remaining = min(max(event[0] - clock.epoch, 0.0),
+                        self.twilightMaxWait)
+        self.twilightTimer.start(int(remaining * 1000.0) +
+                                 self.crossingMargin)
+
+    # Re-arm the twilight timer if it isn't running or the next twilight
+    # event has moved since it was armed
+    def checkTwilightTimer(self, clock):
+        if len(self.twilightRuns) == 0:
+            return
+
+        event = getNextSolarEvent(tuple(self.twilightRuns.keys()), clock)
+        if (not self.twilightTimer.isActive()) or\
+                (event is None) or (self.twilightEvent is None) or\
+                (event[1] != self.twilightEvent[1]) or\
+                (abs(event[0] - self.twilightEvent[0]) >
+                 self.crossingTolerance):
+            self.armTwilightTimer(clock)
+
+    def twilightTimerFired(self):
+        clock = takeClockSnapshot()
+        event = self.twilightEvent
+        if (event is not None) and (clock.epoch >= event[0]):
+            self.runProgram(self.twilightRuns.get(event[1]), event[1],
+                            event[1], clock, event[0])
+
+        self.armTwilightTimer(clock)
+
     def tick(self):
+        # Read the clock once, everything this tick uses the same time
+        clock = takeClockSnapshot()
+
         # Set the current time in the math library
-        setSystemTime()
+        setSystemTime(clock.localTime)
 
         # In the main window, show the current, sunrise and sunset times
-        self.showTime(None)
-        self.showSolarCrossingTime(QTS_SUNRISE)
-        self.showSolarCrossingTime(QTS_SUNSET)
+        self.showTime(None, clock)
+        self.showSolarCrossingTime(QTS_SUNRISE, clock)
+        self.showSolarCrossingTime(QTS_SUNSET, clock)
 
         # debugMessage("    Daytime as a fraction of day: {}".format(daytimeFractionOfDay()))
         # debugMessage("  Nighttime as a fraction of day: {}".format(nighttimeFractionOfDay()))
@@ -967,16 +1182,17 @@ class QtSunsetter(QWidget):
         # How long to the next solar horizon crossing. This uses tomorrow's
         # sunrise time when used after today's sunset. The literal sunrise
         # sunset times displayed are always for today however
-        diffTime = getTimeToNextHorizonCrossing()
+        diffTime = getTimeToNextHorizonCrossing(clock)
 
-        # Adjust our sense of which horizon crossing is next, if we have
-        # just made a crossing
-        if self.setNextHorizonCrossingText():
-            # Crossing made, run the target program for it
-            if self.nextCrossing == "sunset":
-                self.reachedSunrise()
-            elif self.nextCrossing == "sunrise":
-                self.reachedSunset()
+        # Crossings are made by the crossing timer, only establish which is
+        # next the first time through
+        if self.nextCrossing is None:
+            self.setNextHorizonCrossingText(clock)
+
+        # Catch clock steps and timezone or location changes moving the next
+        # crossing away from when the crossing timer will fire
+        self.checkCrossingTimer(clock, diffTime)
+        self.checkTwilightTimer(clock)
 
         # Display time until the next crossing by name
         labrTimePrompt = self.findChild(QLabel, "rTimePrompt")
@@ -987,12 +1203,12 @@ class QtSunsetter(QWidget):
             labrTimeValue.setText("{}".format(diffTime))
 
         # Re-color the background of the run at sunrise control
-        self.recolorRunEditBackground(QTS_SUNRISE)
+        self.recolorRunEditBackground(QTS_SUNRISE, clock)
         # Re-color the background of the run at sunset control
-        self.recolorRunEditBackground(QTS_SUNSET)
+        self.recolorRunEditBackground(QTS_SUNSET, clock)
 
         # Show the animated pretend sky view
-        self.drawIconByAngle()
+        self.drawIconByAngle(clock)
 
     def signLatLonDirection(self, location, direction):
         # If the direction is South or West, the position is negative
@@ -1189,6 +1405,7 @@ class QtSunsetter(QWidget):
         curFile = self.getSolarCrossingProgramText(crossing)
         fileName = self.chooseRunnableFile(curFile, crossing)
         self.showSolarCrossingProgramText(fileName, crossing)
+        self.startHookWorkers()
 
     def chooseRiseRun(self):
         self.chooseSolarCrossingRun(QTS_SUNRISE)
@@ -1210,6 +1427,12 @@ class QtSunsetter(QWidget):
         self.initRiseRun = None
         self.initSetRun = None
         self.initRunLastEventAtLaunch = False
+        self.hookTimeout = None
+        self.hookPolicy = None
+        self.hookMode = None
+        self.hookStdin = False
+        self.eventTableFile = None
+        self.twilightRuns = {}
 
     def loadConfig(self):
         config = SunsetterConfig()
@@ -1236,6 +1459,21 @@ class QtSunsetter(QWidget):
                                               QTS_SUNSET)
             self.initRunLastEventAtLaunch = config.getRunLastEventAtLaunch()
             self.showRunLastEventAtLaunch(nVal)
+            self.hookTimeout = config.getHookTimeout()
+            self.hookPolicy = config.getHookPolicy()
+            if self.hookPolicy is not None:
+                self.hookDispatcher.setPolicy(self.hookPolicy)
+            self.hookMode = config.getHookMode()
+            self.hookStdin = config.getHookStdin()
+            setRefineEvents(config.getRefineEvents())
+            self.eventTableFile = config.getEventTableFile()
+            if self.eventTableFile is not None:
+                setEventTable(loadEventTable(self.eventTableFile))
+            for eventType in twilightEventTypes:
+                fileName = config.getTwilightRun(eventType)
+                if fileName is not None:
+                    self.twilightRuns[eventType] = fileName
+            self.startHookWorkers()
             # debugMessage("sunset program = {}".format(self.initSetRun))
 
     # Save the config but only replace supported configuration items while
@@ -1254,6 +1492,14 @@ class QtSunsetter(QWidget):
         crTxt = self.getSolarCrossingProgramText(QTS_SUNSET)
         config.setSolarCrossingRun(crTxt, QTS_SUNSET)
         config.setRunLastEventAtLaunch(self.getRunLastEventAtLaunch())
+        config.setHookTimeout(self.hookTimeout)
+        config.setHookPolicy(self.hookPolicy)
+        config.setHookMode(self.hookMode)
+        config.setHookStdin(self.hookStdin)
+        config.setRefineEvents(getRefineEvents())
+        config.setEventTableFile(self.eventTableFile)
+        for eventType, fileName in self.twilightRuns.items():
+            config.setTwilightRun(fileName, eventType)
         config.saveConfig()
         print("Saved Config")
         print("showLocationDMS is {}".format(self.showLocationDMS))
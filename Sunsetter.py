@@ -39,80 +39,173 @@
 # along with QtSunsetter.  If not, see <http://www.gnu.org/licenses/>.
 
 import sys
-import subprocess
 import time
 import datetime
+import ctypes
+import ctypes.util
+import errno
+import os
 
 from QtSsDebug import debugMessage, disableDebug, enableDebug, debugIsEnabled
+from QtSsDebug import errorMessage
 from QtSsMath import setLatitude, setLongitude
 from QtSsMath import setHomeTZ
-from QtSsMath import LocalSunrise, LocalSunset, timeFromDayFraction
 from QtSsMath import SsMathTest, testFunction
+from QtSsTODMath import ClockSnapshot, takeClockSnapshot, setClockSource
+from QtSsTODMath import setCorrectForSysTZ, setRefineEvents, getHomeEvaluator
+from QtSsTODMath import getSunriseTime, getSunsetTime, getSunriseFractionOfDay
+from QtSsTODMath import getCrossingState, setEventTable, getHomeEventTable
+from QtSsEventTable import loadEventTable
+from QtSsEvents import iterSolarEventsAfter, EVENT_SUNRISE
+from QtSsHooks import HookDispatcher, defaultHookTimeout, hookEnvironment
 
 
-def sunriseReached():
+def sunriseReached(clock=None, scheduled=None):
     if enableRun is True:
         # Just made the crossing to day, do our work
-        sproc = subprocess.Popen(['/root/bin/morning.sh'],
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.STDOUT)
-        stdout, stderr = sproc.communicate()
-        if stderr is None:
-            mornInfo = stdout.splitlines()
-            for aLine in mornInfo:
-                uText = str(aLine, "utf-8")
-                print("<: {}".format(uText))
-        else:
-            mornErr = stdout.splitlines()
-            for aLine in mornErr:
-                uText = str(aLine, "utf-8")
-                print("<: {}".format(uText))
+        state = getCrossingState("sunrise", scheduled, clock)
+        hookDispatcher.dispatch("sunrise", ['/root/bin/morning.sh'],
+                                timeout=defaultHookTimeout,
+                                env=hookEnvironment(state))
 
 
-def sunsetReached():
+def sunsetReached(clock=None, scheduled=None):
     if enableRun is True:
         # Just made the crossing to night, do our work
-        sproc = subprocess.Popen(['/root/bin/evening.sh'],
-                                 stdout=subprocess.PIPE,
-                                 stderr=subprocess.STDOUT)
-        stdout, stderr = sproc.communicate()
-        if stderr is None:
-            mornInfo = stdout.splitlines()
-            for aLine in mornInfo:
-                uText = str(aLine, "utf-8")
-                print("<: {}".format(uText))
-        else:
-            mornErr = stdout.splitlines()
-            for aLine in mornErr:
-                uText = str(aLine, "utf-8")
-                print("<: {}".format(uText))
-
-
-def doWait(remainingSeconds):
-    interval = datetime.timedelta(hours=0,
-                                  minutes=0,
-                                  seconds=0)
-    if remainingSeconds > 60:
-        time.sleep(60)
-        if SsMathTest() is True:
-            interval = datetime.timedelta(hours=0,
-                                          minutes=0,
-                                          seconds=60)
+        state = getCrossingState("sunset", scheduled, clock)
+        hookDispatcher.dispatch("sunset", ['/root/bin/evening.sh'],
+                                timeout=defaultHookTimeout,
+                                env=hookEnvironment(state))
+
+
+# Get the current time in seconds since the epoch, simulated in test mode
+def getEpoch():
+    global simulatedEpoch
+
+    if simulatedEpoch is not None:
+        return simulatedEpoch
+
+    return time.time()
+
+
+# Get a monotonic time in seconds, simulated in test mode
+def getMonotonic():
+    global simulatedEpoch
+
+    if simulatedEpoch is not None:
+        return simulatedEpoch
+
+    return time.monotonic()
+
+
+# Sleep, or in test mode move the simulated time on instead
+def doSleep(seconds):
+    global simulatedEpoch
+
+    if simulatedEpoch is not None:
+        simulatedEpoch += seconds
     else:
-        if SsMathTest() is True:
-            interval = datetime.timedelta(hours=0,
-                                          minutes=0,
-                                          seconds=remainingSeconds)
-            interval += datetime.timedelta(hours=0,
-                                           minutes=0,
-                                           seconds=1)
+        time.sleep(seconds)
+
+
+# The timespec and itimerspec structures timerfd_settime takes
+class TimeSpec(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long), ("tv_nsec", ctypes.c_long)]
+
+
+class ITimerSpec(ctypes.Structure):
+    _fields_ = [("it_interval", TimeSpec), ("it_value", TimeSpec)]
+
+
+# A Linux timerfd on the realtime clock. A sleep on it ends at a realtime
+# deadline even if the system was suspended for some of it, and at once if
+# the clock is set, where time.sleep runs on the monotonic clock which stops
+# during a suspend. Where timerfd isn't available fd is None
+class RealtimeTimer:
+    def __init__(self):
+        self.fd = None
+        self.libc = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.timerfd_create(CLOCK_REALTIME, TFD_CLOEXEC)
+        except (OSError, AttributeError, TypeError):
+            return
+
+        if fd >= 0:
+            self.libc = libc
+            self.fd = fd
+
+    # Sleep until a deadline (seconds since the epoch) on the realtime clock
+    # Returns True if the clock was set while sleeping
+    def sleepUntil(self, deadline):
+        whole = int(deadline)
+        spec = ITimerSpec(TimeSpec(0, 0),
+                          TimeSpec(whole, int((deadline - whole) * 1e9)))
+        if self.libc.timerfd_settime(self.fd, TFD_TIMER_ABSTIME |
+                                     TFD_TIMER_CANCEL_ON_SET,
+                                     ctypes.byref(spec), None) < 0:
+            raise OSError(ctypes.get_errno(), "timerfd_settime failed")
+
+        try:
+            os.read(self.fd, 8)
+        except OSError as e:
+            if e.errno == errno.ECANCELED:
+                return True
+            raise
+
+        return False
+
+
+# Generate the crossings that follow a time (seconds since the epoch), read
+# from the event table while it has this location's crossings, and
+# calculated after it ends or without one
+# Yields (datetime, event type) tuples in time order
+def iterCrossingsAfter(afterEpoch):
+    table = getHomeEventTable()
+    if table is not None:
+        event = table.nextEvent(afterEpoch)
+        while event is not None:
+            yield (datetime.datetime.fromtimestamp(event[0]), event[1])
+            afterEpoch = event[0]
+            event = table.nextEvent(afterEpoch)
+
+        # Table times are truncated to the second, don't repeat the last
+        afterEpoch += 1
+
+    for event in iterSolarEventsAfter(getHomeEvaluator(), afterEpoch):
+        yield (event[0], event[1])
+
+
+# Sleep until deadline (seconds since the epoch) or for no more than maxSleep
+# seconds. The realtime clock is compared with the monotonic clock across the
+# sleep to detect a suspend/resume or a step of the clock. Without a realtime
+# timer a suspend is only noticed when a sleep ends, so sleeps are no longer
+# than fallbackSleepSeconds
+# Returns True if the clock jumped while sleeping
+def waitUntil(deadline, maxSleep):
+    global simulatedEpoch
+
+    startEpoch = getEpoch()
+    startMono = getMonotonic()
+
+    useTimer = (simulatedEpoch is None) and (realtimeTimer.fd is not None)
+    if not useTimer:
+        maxSleep = min(maxSleep, fallbackSleepSeconds)
+    sleepFor = min(deadline - startEpoch, maxSleep)
+    if sleepFor > 0.0:
+        if useTimer:
+            if realtimeTimer.sleepUntil(startEpoch + sleepFor):
+                return True
+        else:
+            doSleep(sleepFor)
 
-        time.sleep(remainingSeconds + 1)
+    realElapsed = getEpoch() - startEpoch
+    monoElapsed = getMonotonic() - startMono
 
-        return interval
+    return abs(realElapsed - monoElapsed) > clockJumpTolerance
 
 
-# No argument support, use globals to set state
+# The only argument is --max-sleep, use globals to set the rest of the state
 
 # disableDebug()
 enableDebug()
@@ -126,14 +219,23 @@ setLatitude(useLat)
 setLongitude(useLong)
 # debugMessage("Using location {}, {}".format(useLat, useLong))
 
+# The location's clock is the system clock
+setCorrectForSysTZ(False)
+
+# Re-evaluate each crossing at the instant it happens for sub-minute timing
+refineEvents = False
+setRefineEvents(refineEvents)
+
 # Current time and system timezone information
-today = datetime.date.today()
-systemTime = time.localtime()
 if SsMathTest() is False:
-    timeNow = datetime.time(systemTime[3], systemTime[4], systemTime[5])
+    simulatedEpoch = None
 else:
-    # Fake a start time to test
-    timeNow = datetime.time(23, 59, 20)
+    # Fake a start time to test, time passes only when we "sleep"
+    lt = time.localtime()
+    simulatedEpoch = time.mktime((lt.tm_year, lt.tm_mon, lt.tm_mday,
+                                  23, 59, 20, 0, 0, -1))
+    setClockSource(lambda: ClockSnapshot(simulatedEpoch))
+systemTime = time.localtime(getEpoch())
 useTZs = 1.0 * systemTime.tm_gmtoff
 useTZ = useTZs / 3600.0
 setHomeTZ(useTZs)
@@ -142,113 +244,123 @@ setHomeTZ(useTZs)
 # enable exec on solar horizon crossings
 enableRun = False
 
+# Runs the crossing programs without waiting, one still running at the next
+# crossing of the same type is left to finish and that run skipped
+hookDispatcher = HookDispatcher()
+
+# A table of crossings made by QtSsEventTable.py for this location and
+# timezone, the crossings waited for are read from it instead of calculated
+eventTableFile = None
+# eventTableFile = "/root/sunsetter.qse"
+if eventTableFile is not None:
+    setEventTable(loadEventTable(eventTableFile))
+
+# Longest time to sleep before re-checking, in seconds, set with --max-sleep.
+# Sleeps are on a realtime timer so a suspend or clock step ends one early
+maxSleepSeconds = 3600.0
+
+# Longest sleep without a realtime timer, the sleep runs on the monotonic
+# clock which stops while the system is suspended, so a suspend is only
+# noticed when a sleep ends and this bounds how late a crossing passed
+# during one is reached
+fallbackSleepSeconds = 60.0
+
+# Linux timerfd values
+CLOCK_REALTIME = 0
+TFD_CLOEXEC = 0o2000000
+TFD_TIMER_ABSTIME = 1
+TFD_TIMER_CANCEL_ON_SET = 2
+realtimeTimer = RealtimeTimer()
+
+# How far after a crossing to wake, so the clock has passed it, in seconds
+wakeMargin = 0.05
+
+# Seconds the realtime and monotonic clocks can disagree by across a sleep
+# before it's treated as a clock jump
+clockJumpTolerance = 2.0
+
 if __name__ == '__main__':
+    if "--max-sleep" in sys.argv:
+        argNum = sys.argv.index("--max-sleep")
+        try:
+            maxSleepSeconds = float(sys.argv[argNum + 1])
+        except (IndexError, ValueError):
+            errorMessage("Usage: {} [--max-sleep <seconds>]".format(
+                sys.argv[0]))
+            sys.exit(1)
+        del sys.argv[argNum:argNum + 2]
+
     aTime = datetime.time(0, 6, 0)
     testFunction(aTime)
 
-    # Which boundary we cross next
-    nextCrossing = None
+    # The crossings to come, calculated a day at a time as they are used
+    crossings = None
 
     # Just keep going until stopped
     while True:
         print("")
 
-        today = datetime.date.today()
-        systemTime = time.localtime()
-        # print("Now: {}:{}:{}".format(systemTime[3], systemTime[4], systemTime[5]))
-
-        if SsMathTest() is False:
-            timeNow = datetime.time(systemTime[3],
-                                    systemTime[4],
-                                    systemTime[5])
+        clock = takeClockSnapshot()
 
-        # If the time-zone time offset changed, use it
-        if systemTime.tm_gmtoff != int(useTZ * 3600):
-            useTZ = 1.0 * systemTime.tm_gmtoff
-            useTZ /= 3600.0
-            setHomeTZ(useTZ)
+        # If the time-zone time offset changed, use it and re-plan
+        if clock.localTime.tm_gmtoff != int(useTZ * 3600):
+            useTZs = 1.0 * clock.localTime.tm_gmtoff
+            useTZ = useTZs / 3600.0
+            setHomeTZ(useTZs)
+            crossings = None
 
-        # print("Time: {}".format(timeNow))
+        if crossings is None:
+            crossings = iterCrossingsAfter(int(clock.epoch))
+            nextCrossing = next(crossings)
 
-        x = LocalSunrise(today, aTime)
-        sRise = timeFromDayFraction(x)
+        sRise = getSunriseTime(clock)
+        x = getSunriseFractionOfDay(clock)
         debugMessage("Sun rises at: {} ({})".format(sRise, x))
-        # print("Sun rises at: {}".format(sRise))
-
-        x = LocalSunset(today, aTime)
-        sSet = timeFromDayFraction(x)
-        # print(" Sun sets at: {} ({})".format(sSet, x))
-        # print(" Sun sets at: {}".format(sSet))
-
-        print("Time: {}; Sunrise: {}; Sunset: {}".format(timeNow, sRise, sSet))
-
-        nowDelta = datetime.timedelta(hours=timeNow.hour,
-                                      minutes=timeNow.minute,
-                                      seconds=timeNow.second)
-
-        srDelta = datetime.timedelta(hours=sRise.hour,
-                                     minutes=sRise.minute,
-                                     seconds=sRise.second)
-        ssDelta = datetime.timedelta(hours=sSet.hour,
-                                     minutes=sSet.minute,
-                                     seconds=sSet.second)
-        endOfDay = datetime.timedelta(hours=23, minutes=59, seconds=59)
-
-        # Are we in in day or night (day is after sunrise and before sunset
-        if (nowDelta > srDelta) and (nowDelta < ssDelta):
-            if nextCrossing is None:
-                # We are pending sunset
-                nextCrossing = "sunset"
-            elif nextCrossing == "sunrise":
-                sunriseReached()
-
-                # Now we are pending sunset
-                nextCrossing = "sunset"
-
-            # Daytime, get the remaining time to sunset
-            diffTime = ssDelta - nowDelta
-            print("Remaining time until sunset: {}".format(diffTime))
-        else:
-            if nextCrossing is None:
-                # We are pending sunrise
-                nextCrossing = "sunrise"
-            elif nextCrossing == "sunset":
-                sunsetReached()
-
-                # Now we are pending sunrise
-                nextCrossing = "sunrise"
-
-            # Nighttime get the remaining time until sunrise
-            if nowDelta > ssDelta:
-                # After sunset but before midnight we need to combine today and
-                # tomorrow
-                diffTime = endOfDay - nowDelta
-                diffTime += srDelta
+        sSet = getSunsetTime(clock)
+
+        print("Time: {}; Sunrise: {}; Sunset: {}".format(clock.time,
+                                                          sRise,
+                                                          sSet))
+
+        # Crossing times are kept to the second, as they are displayed
+        dueEpoch = int(nextCrossing[0].timestamp())
+        diffTime = datetime.timedelta(seconds=dueEpoch - int(clock.epoch))
+        print("Remaining time until {}: {}".format(nextCrossing[1], diffTime))
+
+        # Sleep until the crossing. Waking early after maxSleepSeconds keeps
+        # the same deadline unless the clock jumped
+        deadline = dueEpoch + wakeMargin
+        jumped = False
+        while getEpoch() < deadline:
+            if waitUntil(deadline, maxSleepSeconds):
+                debugMessage("Clock jump detected, re-planning")
+                jumped = True
+                break
+
+        clock = takeClockSnapshot()
+        if jumped:
+            # Re-plan from the new time, if it moved to the other side of
+            # a crossing report reaching that crossing
+            crossings = iterCrossingsAfter(int(clock.epoch))
+            planned = nextCrossing
+            nextCrossing = next(crossings)
+            if nextCrossing[1] == planned[1]:
+                reached = None
+            elif nextCrossing[1] == EVENT_SUNRISE:
+                reached = "sunset"
             else:
-                # After midnight
-                diffTime = srDelta - nowDelta
-            print("Remaining time until sunrise: {}".format(diffTime))
+                reached = "sunrise"
+            dueEpoch = None
+        else:
+            reached = nextCrossing[1]
+            nextCrossing = next(crossings)
 
-        # difftime has the remaining time until our next boundary crossing
-        # Don't sleep for it all, to allow events to be handled
-        interval = doWait(diffTime.total_seconds())
+        if reached == "sunrise":
+            sunriseReached(clock, dueEpoch)
+        elif reached == "sunset":
+            sunsetReached(clock, dueEpoch)
 
         if SsMathTest() is True:
-            nextTime = datetime.timedelta(hours=timeNow.hour,
-                                          minutes=timeNow.minute,
-                                          seconds=timeNow.second)
-            nextTime += interval
-            aDay = datetime.timedelta(days=1)
-            while nextTime >= aDay:
-                nextTime -= aDay
-            nextHour = int(nextTime.total_seconds() / 3600)
-            hourSec = nextHour * 3600
-            nextMinute = int((nextTime.total_seconds() - (hourSec)) / 60)
-            nextSecond = int((nextTime.total_seconds() - (hourSec))) % 60
-            print("NEXT: {} - {}:{}:{}".format(nextTime,
-                                               nextHour,
-                                               nextMinute,
-                                               nextSecond))
-            timeNow = datetime.time(nextHour, nextMinute, nextSecond)
+            print("NEXT: {}".format(takeClockSnapshot().time))
 
     sys.exit(0)